@@ -0,0 +1,280 @@
+from collections import defaultdict, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from executor.executor import Executor, CompiledProgram, NonUniqueException, NonExistentException, predicate
+from executor.scene_index import SceneIndex
+
+
+class BitsetScene:
+    """
+    A scene (or several scenes merged together) indexed for `BitsetExecutor`: objects get dense ids by their order in
+    the scene, and sets of objects are integer bitmasks of these ids
+    """
+
+    def __init__(self, scene_objects_dict: Dict, index: bool = True):
+        self.objects_dict = scene_objects_dict
+        self.objects = list(scene_objects_dict.values())
+        self.ids = {obj_key: i for i, obj_key in enumerate(scene_objects_dict.keys())}
+        self.all_mask = (1 << len(self.objects)) - 1
+        # identifies the indexed scenes
+        self.scenes_key = (tuple(dict.fromkeys(obj['scene_id'] for obj in self.objects)), len(self.objects))
+
+        self.name_masks = defaultdict(int)
+        self.attribute_masks = defaultdict(int)
+        # object id -> relation name -> mask of the objects it relates to, with the prepositions of its first relation
+        # (the relations `Executor.with_relation` iterates)
+        self.relation_masks = []
+        # object id -> mask of all objects it relates to
+        self.related_masks = []
+        if index:
+            self._index()
+
+    def _index(self):
+        for i, obj in enumerate(self.objects):
+            self.name_masks[obj['name']] |= 1 << i
+            for attr in obj['attributes']:
+                self.attribute_masks[attr] |= 1 << i
+
+            relations = list(obj['relations'])
+            if obj['relations'] and obj['relations'][0].get('prepositions'):
+                relations += obj['relations'][0]['prepositions']
+            object_relations = defaultdict(int)
+            for rel in relations:
+                # scenes read by `SceneReader` only relate objects of the same scene
+                if rel['object'] in self.ids:
+                    object_relations[rel['name']] |= 1 << self.ids[rel['object']]
+            self.relation_masks.append(dict(object_relations))
+            self.related_masks.append(BitsetScene._union(object_relations.values()))
+
+    @staticmethod
+    def _union(masks) -> int:
+        union = 0
+        for mask in masks:
+            union |= mask
+        return union
+
+    def __len__(self):
+        return len(self.objects)
+
+    @staticmethod
+    def merge(scenes: List['BitsetScene']) -> 'BitsetScene':
+        """
+        A view of several scenes, as one scene. Ids of each scene are offset by the number of objects before it, so
+        the indexes of the scenes are reused rather than built again
+        """
+        objects_dict = {ok: ov for s in scenes for ok, ov in s.objects_dict.items()}
+        if len(objects_dict) != sum(len(s) for s in scenes):
+            # object keys that appear in several scenes are kept once, as in the merged dict
+            return BitsetScene(objects_dict)
+
+        merged = BitsetScene(objects_dict, index=False)
+        offset = 0
+        for s in scenes:
+            for name, mask in s.name_masks.items():
+                merged.name_masks[name] |= mask << offset
+            for attr, mask in s.attribute_masks.items():
+                merged.attribute_masks[attr] |= mask << offset
+            merged.relation_masks += [{name: mask << offset for name, mask in object_relations.items()}
+                                      for object_relations in s.relation_masks]
+            merged.related_masks += [mask << offset for mask in s.related_masks]
+            offset += len(s)
+        return merged
+
+
+class ObjectSet:
+    """
+    A set of objects of a `BitsetScene`, as a bitmask of their ids
+    """
+    __slots__ = ('scene', 'mask')
+
+    def __init__(self, scene: BitsetScene, mask: int):
+        self.scene = scene
+        self.mask = mask
+
+    def __len__(self):
+        return bin(self.mask).count("1")
+
+    def __bool__(self):
+        return self.mask != 0
+
+    def __iter__(self):
+        return (self.scene.objects[i] for i in self.ids())
+
+    def ids(self):
+        mask = self.mask
+        while mask:
+            lowest = mask & -mask
+            yield lowest.bit_length() - 1
+            mask ^= lowest
+
+    def to_list(self) -> List[Dict]:
+        return list(self)
+
+
+class BitsetExecutor(Executor):
+    """
+    Executes programs on a `BitsetScene`, where sets of objects are `ObjectSet` bitmasks, so finding, filtering,
+    counting, quantifiers and relation hops are integer operations rather than loops over object dicts.
+
+    Answers are the same as `Executor`'s. Sets of objects that are returned as answers are converted to lists in the
+    order of the scene (`Executor` returns the output of `with_relation` in the order of a Python set). Programs with
+    operations whose answer depends on that order (`all_same`) are executed by `Executor`.
+    """
+    ORDER_SENSITIVE_OPERATIONS = {'all_same'}
+    # compiled programs call the methods of this class, so they are not shared with `Executor`
+    _compiled_programs = OrderedDict()
+
+    def __init__(self):
+        super().__init__()
+        self._scene = None
+        self._list_executor = Executor()
+
+    def run(self, program: Union[List[Dict], CompiledProgram], scene: Union[Dict, BitsetScene],
+            scene_index: SceneIndex = None):
+        """
+        Runs a program on a scene dict or on a `BitsetScene`. Compiled programs should be compiled by this executor.
+        The index of the scene is only used by programs that are executed by `Executor`
+        """
+        if type(scene) is not BitsetScene:
+            scene = BitsetScene(scene)
+        if type(program) is not CompiledProgram and BitsetExecutor._is_order_sensitive(program):
+            return self._list_executor.run(program, scene.objects_dict, scene_index)
+
+        self._scene = scene
+        if type(program) is CompiledProgram:
+            self._curr_scene_objects = scene.objects
+            self._curr_scene_objects_dict = scene.objects_dict
+            ans = self._run_steps(program)
+        else:
+            ans = self.interpret(program, scene.objects_dict)
+        return ans.to_list() if type(ans) is ObjectSet else ans
+
+    def run_with_status(self, program: Union[List[Dict], CompiledProgram], scene: Union[Dict, BitsetScene],
+                        scene_index: SceneIndex = None) -> Tuple[Any, Optional[str]]:
+        if type(scene) is not BitsetScene:
+            scene = BitsetScene(scene)
+        program = self.compile(program)
+        if type(program) is not CompiledProgram:
+            # order sensitive (see `compile`)
+            return self._list_executor.run_with_status(program, scene.objects_dict, scene_index)
+
+        self._scene = scene
+        self._curr_scene_objects = scene.objects
+        self._curr_scene_objects_dict = scene.objects_dict
+        ans, error = self._run_steps_with_status(program)
+        return ans.to_list() if type(ans) is ObjectSet else ans, error
+
+    def compile(self, program: Union[List[Dict], CompiledProgram]) -> Union[List[Dict], CompiledProgram]:
+        if type(program) is not CompiledProgram and BitsetExecutor._is_order_sensitive(program):
+            # kept as is, to be executed by `Executor` (see `run`)
+            return program
+        return super().compile(program)
+
+    @staticmethod
+    def _is_order_sensitive(program: List[Dict]) -> bool:
+        for program_row in program:
+            if program_row['operation'] in BitsetExecutor.ORDER_SENSITIVE_OPERATIONS:
+                return True
+            if program_row['operation'] in Executor.QUANTIFIERS and \
+                    BitsetExecutor._is_order_sensitive(program_row['arguments'][0]):
+                return True
+        return False
+
+    def _mask(self, input_objects) -> int:
+        if type(input_objects) is ObjectSet:
+            return input_objects.mask
+        # lists of objects, e.g. outputs of `group_by_images`
+        ids = self._scene.ids
+        mask = 0
+        for o in input_objects:
+            mask |= 1 << ids[o['object_key']]
+        return mask
+
+    @predicate
+    def scene(self, _=None):
+        return ObjectSet(self._scene, self._scene.all_mask)
+
+    @predicate
+    def all(self, input_objects, condition_program):
+        return self._mask(input_objects) & ~self._condition_output(condition_program) == 0
+
+    @predicate
+    def some(self, input_objects, condition_program):
+        return self._mask(input_objects) & self._condition_output(condition_program) != 0
+
+    @predicate
+    def none(self, input_objects, condition_program):
+        return self._mask(input_objects) & self._condition_output(condition_program) == 0
+
+    def _scenes_key(self):
+        return self._scene.scenes_key
+
+    def _objects_set(self, objects) -> int:
+        return self._mask(objects)
+
+    @predicate
+    def find(self, object_names):
+        if type(object_names) is str:
+            object_names = {object_names}
+        if not object_names:
+            return ObjectSet(self._scene, self._scene.all_mask)
+        name_masks = self._scene.name_masks
+        mask = 0
+        for name in object_names:
+            mask |= name_masks.get(name, 0)
+        return ObjectSet(self._scene, mask)
+
+    @predicate
+    def filter(self, input_objects, attribute_name: Union[str, set]):
+        """keeps object if has *any* of the given attributes"""
+        if type(attribute_name) is str:
+            attribute_name = {attribute_name}
+        attribute_masks = self._scene.attribute_masks
+        mask = 0
+        for attr in attribute_name:
+            mask |= attribute_masks.get(attr, 0)
+        return ObjectSet(self._scene, self._mask(input_objects) & mask)
+
+    @predicate
+    def unique(self, input_objects):
+        if type(input_objects) is not ObjectSet:
+            return super().unique(input_objects)
+        if len(input_objects) > 1:
+            return self._fail(NonUniqueException)
+        if not input_objects:
+            return self._fail(NonExistentException)
+        return self._scene.objects[input_objects.mask.bit_length() - 1]
+
+    @predicate
+    def relation_between_nouns(self, input_object1, input_objects2):
+        IGNORE_RELATIONS = {'with'}
+        mask2 = self._mask(input_objects2)
+        ids = self._scene.ids
+        return [rel for rel in input_object1['relations']
+                if rel['object'] in ids and mask2 >> ids[rel['object']] & 1
+                if rel['name'] not in IGNORE_RELATIONS]
+
+    @predicate
+    def with_relation(self, input_objects1, input_objects2=None, relation_filter=None, return_object=False):
+        if relation_filter:
+            if type(relation_filter) is set:
+                relation_filter = set(relation_filter)
+            else:
+                relation_filter = {relation_filter}
+
+        mask2 = self._mask(input_objects2) if input_objects2 is not None else self._scene.all_mask
+        relation_masks = self._scene.relation_masks
+        related_masks = self._scene.related_masks
+        output_mask = 0
+        for i in ObjectSet(self._scene, self._mask(input_objects1)).ids():
+            if relation_filter:
+                related_mask = 0
+                for relation_name, mask in relation_masks[i].items():
+                    if relation_name in relation_filter:
+                        related_mask |= mask
+                related_mask &= mask2
+            else:
+                related_mask = related_masks[i] & mask2
+            if related_mask:
+                output_mask |= related_mask if return_object else 1 << i
+        return ObjectSet(self._scene, output_mask)
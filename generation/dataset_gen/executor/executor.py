@@ -2,8 +2,11 @@
 based on https://github.com/kexinyi/ns-vqa/blob/master/reason/executors/clevr_executor.py
 """
 import types
-from collections import defaultdict
-from typing import Callable, Dict, List, Union, Set
+from collections import defaultdict, OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from executor.executor_profile import ExecutorProfile
+from executor.scene_index import MultiSceneView, SceneIndex
 
 
 def predicate(function: Callable) -> Callable:
@@ -37,12 +40,76 @@ class MultipleAttributesForTypeException(Exception):
     pass
 
 
+# codes of the exceptions raised by programs, as returned by `Executor.run_with_status`
+EXCEPTION_CODES = {
+    NonUniqueException: 'non_unique',
+    NonExistentException: 'non_existent',
+    NeitherOfChooseException: 'invalid_choose',
+    NoCommonAttributeException: 'no_common_attribute',
+    MultipleAttributesForTypeException: 'multiple_attributes'
+}
+
+
+class ProgramFailure:
+    """
+    The failure of a step of a program, returned by the step instead of raising its exception when the program is run
+    by `Executor.run_with_status`
+    """
+    __slots__ = ('code',)
+
+    def __init__(self, code: str):
+        self.code = code
+
+
+# a single failure per exception
+PROGRAM_FAILURES = {exception: ProgramFailure(code) for exception, code in EXCEPTION_CODES.items()}
+PROGRAM_EXCEPTIONS = tuple(EXCEPTION_CODES)
+
+
+class CompiledProgram:
+    """
+    A program compiled by `Executor.compile`: a flat list of steps, each with the function of its module, the indices
+    of its dependencies in the execution trace and its arguments. Condition programs of quantifiers are compiled too.
+    `shared_steps` are the steps with shared sub-programs (see `Executor._share_sub_programs`), which are run instead
+    when the scenes are known, or None if no sub-program is shared. `key` is the canonical form of the program (see
+    `Executor.program_key`), if it was compiled from one.
+    """
+    __slots__ = ('steps', 'shared_steps', 'key')
+
+    def __init__(self, steps, shared_steps=None, key=None):
+        self.steps = steps
+        self.shared_steps = shared_steps
+        self.key = key
+
+    def __len__(self):
+        return len(self.steps)
+
+
 class Executor:
+    QUANTIFIERS = {'all', 'some', 'none'}
+    # compiled programs are shared by all executors of a class, keyed by the canonical form of the program (see
+    # `program_key`), since programs are filled again for each question
+    MAX_COMPILED_PROGRAMS = 10000
+    _compiled_programs = OrderedDict()
+    # outputs of condition programs of quantifiers, keyed by the canonical condition and the scenes it was run on
+    MAX_CONDITION_OUTPUTS = 10000
+    _condition_outputs = OrderedDict()
+    # if set, sub-programs of these operations (reference programs) of programs compiled afterwards are shared by
+    # programs, and their outputs are kept until the next starting scene (see `_share_sub_programs`)
+    share_sub_programs = False
+    SHARED_OPERATIONS = {'scene', 'find', 'filter', 'with_relation', 'with_relation_object'}
+    _shared_outputs = {}
+    # if set, operations executed by all executors of the process are recorded in it
+    profile: Optional[ExecutorProfile] = None
+
     def __init__(self):
         # extract all names of methods
 
         self._curr_scene_objects = []
         self._curr_scene_objects_dict = {}
+        self._curr_scene_index = None
+        # if set, steps that fail return a `ProgramFailure` rather than raising (see `run_with_status`)
+        self._return_failures = False
         self._modules = {}
         for name in dir(self):
             if isinstance(getattr(self, name), types.MethodType):
@@ -67,28 +134,295 @@ class Executor:
         helper(program_tree)
         return output
 
-    def run(self, program, scene_objects_dict: dict):
+    def run(self, program: Union[List[Dict], CompiledProgram], scene_objects_dict: dict,
+            scene_index: SceneIndex = None):
+        """
+        Programs that are run on many scenes should be compiled first (see `compile`), other programs are interpreted.
+        With the index of the scene (see `SceneReader.get_scene_index`), objects are found by lookups rather than by
+        scanning the scene. A `MultiSceneView` of several scenes is run on with the index of its scenes.
+        """
+        if scene_index is None and type(scene_objects_dict) is MultiSceneView:
+            scene_index = scene_objects_dict.index
+        if type(program) is CompiledProgram:
+            return self._run_compiled(program, scene_objects_dict, scene_index)
+        return self.interpret(program, scene_objects_dict, scene_index)
+
+    def run_many(self, program: Union[List[Dict], CompiledProgram], scenes: List,
+                 scene_indexes: List[SceneIndex] = None) -> Tuple[List, List[Optional[str]]]:
+        """
+        Runs a program on each of the given scenes (objects dicts, with their indexes), compiling it once. Returns the
+        answers and the codes of the failures on each scene (see `run_with_status`): the answer of a scene that failed
+        is None, and so is the code of a scene that did not
+        """
+        program = self.compile(program)
+        if scene_indexes is None:
+            scene_indexes = [None] * len(scenes)
+
+        answers, errors = [], []
+        for scene, scene_index in zip(scenes, scene_indexes):
+            answer, error = self.run_with_status(program, scene, scene_index)
+            answers.append(answer)
+            errors.append(error)
+        return answers, errors
+
+    def run_with_status(self, program: Union[List[Dict], CompiledProgram], scene_objects_dict: dict,
+                        scene_index: SceneIndex = None) -> Tuple[Any, Optional[str]]:
+        """
+        Runs a program as `run` does, but returns the answer with the code of the failure of the program (see
+        `EXCEPTION_CODES`) rather than raising: steps that fail (e.g. `unique` of several objects) return a
+        `ProgramFailure`, and the program stops at the first of them. The answer of a program that failed is None, and
+        so is the code of a program that did not
+        """
+        if scene_index is None and type(scene_objects_dict) is MultiSceneView:
+            scene_index = scene_objects_dict.index
+        self._curr_scene_objects = None
+        self._curr_scene_objects_dict = scene_objects_dict
+        self._curr_scene_index = scene_index
+        return self._run_steps_with_status(self.compile(program))
+
+    def _run_steps_with_status(self, compiled: CompiledProgram) -> Tuple[Any, Optional[str]]:
+        profile = self.profile
+        ans = None
+        trace = self.exe_trace = []
+        self._return_failures = True
+        try:
+            for function, dependencies, arguments in self._steps(compiled):
+                if profile is not None:
+                    ans = self._run_profiled_step(function, [trace[i] for i in dependencies], arguments)
+                elif len(dependencies) == 1:
+                    ans = function(self, trace[dependencies[0]], *arguments)
+                else:
+                    ans = function(self, *[trace[i] for i in dependencies], *arguments)
+                if type(ans) is ProgramFailure:
+                    return None, ans.code
+                trace.append(ans)
+        except PROGRAM_EXCEPTIONS as e:
+            # failures of nested programs (see `_run_nested`)
+            return None, EXCEPTION_CODES[type(e)]
+        finally:
+            self._return_failures = False
+        return ans, None
+
+    def _fail(self, exception: type):
+        """
+        Fails the current step, see `run_with_status`
+        """
+        if self._return_failures:
+            return PROGRAM_FAILURES[exception]
+        raise exception()
+
+    def interpret(self, program, scene_objects_dict: dict, scene_index: SceneIndex = None):
         ans, temp = None, None
 
-        scene_objects = list(scene_objects_dict.values())
-
-        self._curr_scene_objects = scene_objects
+        # listed when needed (see `_scene_objects`)
+        self._curr_scene_objects = None
         self._curr_scene_objects_dict = scene_objects_dict
+        self._curr_scene_index = scene_index
         self.exe_trace = []
+        profile = self.profile
         for program_row in program:
             module_name = program_row['operation']
             if module_name in self._modules:
                 module = self._modules[module_name]
                 dependencies = [self.exe_trace[di] for di in program_row.get('dependencies', [])]
-                ans = module(*dependencies, *program_row.get('arguments', []))
+                if profile is not None:
+                    ans = profile.call(module_name, dependencies[0] if dependencies else None,
+                                       module, *dependencies, *program_row.get('arguments', []))
+                else:
+                    ans = module(*dependencies, *program_row.get('arguments', []))
             else:
                 raise Exception(f"Unknown module: {module_name}")
             self.exe_trace.append(ans)
         return ans
 
+    def compile(self, program: Union[List[Dict], CompiledProgram]) -> CompiledProgram:
+        """
+        Compiles a program once, so that running it does not look up modules and unpack rows again. Results are
+        identical to `interpret`. Equal programs (see `program_key`) share a single compiled program, which keeps the
+        arguments of the first of them, so programs should not be changed once compiled.
+        """
+        if type(program) is CompiledProgram:
+            return program
+
+        key = Executor.program_key(program)
+        compiled_programs = type(self)._compiled_programs
+        compiled = compiled_programs.get(key)
+        if compiled is not None:
+            compiled_programs.move_to_end(key)
+            return compiled
+
+        steps = []
+        for program_row in program:
+            module_name = program_row['operation']
+            arguments = program_row.get('arguments', [])
+            if module_name not in self._modules:
+                function = Executor._unknown_module(module_name)
+            else:
+                function = getattr(type(self), module_name)
+                if module_name in Executor.QUANTIFIERS:
+                    arguments = [self.compile(arguments[0])] + list(arguments[1:])
+            steps.append((function, tuple(program_row.get('dependencies', [])), tuple(arguments)))
+        shared_steps = self._share_sub_programs(program, steps) if Executor.share_sub_programs else None
+        compiled = CompiledProgram(steps, shared_steps, key)
+
+        compiled_programs[key] = compiled
+        if len(compiled_programs) > Executor.MAX_COMPILED_PROGRAMS:
+            compiled_programs.popitem(last=False)
+        return compiled
+
+    def _share_sub_programs(self, program: List[Dict], steps: List) -> Optional[List]:
+        """
+        Replaces each sub-program of `SHARED_OPERATIONS` whose output is used by other operations (e.g. the reference
+        program of a question, see `merge_ref_program`) with a single step, that runs it once per scenes under a
+        canonical key of the sub-program. Programs that share the sub-program then only execute the rest of their steps.
+        Steps that are only used by such sub-programs are skipped. Returns None if no sub-program is shared.
+        """
+        keys = []
+        for program_row in program:
+            dependencies = program_row.get('dependencies', [])
+            if program_row['operation'] in Executor.SHARED_OPERATIONS and all(keys[d] for d in dependencies):
+                keys.append((program_row['operation'], Executor._canonical(program_row.get('arguments', [])),
+                             tuple(keys[d] for d in dependencies)))
+            else:
+                keys.append(None)
+
+        shared = [False] * len(steps)
+        for i, program_row in enumerate(program):
+            if keys[i] is None:
+                for d in program_row.get('dependencies', []):
+                    # single steps are not worth sharing
+                    shared[d] = shared[d] or (keys[d] is not None and len(steps[d][1]) > 0)
+        if not any(shared):
+            return None
+
+        # steps whose outputs are used outside of shared sub-programs
+        needed = [keys[i] is None or i == len(steps) - 1 for i in range(len(steps))]
+        for i in reversed(range(len(steps))):
+            if needed[i] and not shared[i]:
+                for d in steps[i][1]:
+                    needed[d] = True
+
+        output_steps = []
+        for i, step in enumerate(steps):
+            if shared[i]:
+                sub_program = sorted(Executor._sub_program_steps(steps, i))
+                positions = {j: position for position, j in enumerate(sub_program)}
+                sub_steps = [(steps[j][0], tuple(positions[d] for d in steps[j][1]), steps[j][2]) for j in sub_program]
+                output_steps.append((Executor._run_shared, (), (CompiledProgram(sub_steps), (type(self), keys[i]))))
+            elif not needed[i]:
+                output_steps.append((Executor._skipped, (), ()))
+            else:
+                output_steps.append(step)
+        return output_steps
+
+    @staticmethod
+    def _sub_program_steps(steps: List, i: int) -> Set[int]:
+        sub_program = {i}
+        for d in steps[i][1]:
+            sub_program |= Executor._sub_program_steps(steps, d)
+        return sub_program
+
+    @staticmethod
+    def program_key(program: List[Dict]) -> Tuple:
+        """
+        A hashable form of a program, equal for programs with the same operations, dependencies and arguments (sets in
+        any order), including their condition programs
+        """
+        return tuple([(program_row['operation'], tuple(program_row.get('dependencies', ())),
+                       Executor._canonical(program_row.get('arguments', ()))) for program_row in program])
+
+    @staticmethod
+    def _canonical(value):
+        # arguments of equal sub-programs are equal, regardless of the order of sets
+        value_type = type(value)
+        if value_type is str or value_type is int:
+            return value
+        if value_type is list or value_type is tuple:
+            if value and type(value[0]) is dict:
+                return 'program', Executor.program_key(value)
+            return 'list', tuple([Executor._canonical(v) for v in value])
+        if value_type is set or value_type is frozenset:
+            return 'set', tuple(sorted(value, key=repr))
+        if value_type is bool or value_type is float:
+            # not equal to the ints they compare equal to
+            return value_type.__name__, value
+        return value
+
+    def _run_shared(self, sub_program: CompiledProgram, key):
+        output_key = (key, self._scenes_key())
+        if output_key not in Executor._shared_outputs:
+            Executor._shared_outputs[output_key] = self._run_nested(sub_program)
+        return Executor._shared_outputs[output_key]
+
+    def _skipped(self):
+        return None
+
+    @staticmethod
+    def starting_new_scene():
+        """
+        Drops the outputs of shared sub-programs, which are mostly shared by the questions of a single starting scene
+        """
+        Executor._shared_outputs.clear()
+
+    @staticmethod
+    def _unknown_module(module_name):
+        # raised when the step is reached, as in `interpret`
+        def _raise(*_):
+            raise Exception(f"Unknown module: {module_name}")
+        return _raise
+
+    def _run_compiled(self, compiled: CompiledProgram, scene_objects_dict: dict, scene_index: SceneIndex = None):
+        self._curr_scene_objects = None
+        self._curr_scene_objects_dict = scene_objects_dict
+        self._curr_scene_index = scene_index
+        return self._run_steps(compiled)
+
+    def _scene_objects(self) -> List[Dict]:
+        if self._curr_scene_objects is None:
+            self._curr_scene_objects = list(self._curr_scene_objects_dict.values())
+        return self._curr_scene_objects
+
+    def _steps(self, compiled: CompiledProgram) -> List:
+        # outputs of shared sub-programs are kept by the scenes they were run on, so they are only shared when the
+        # scenes are known (see `_scenes_key`)
+        if compiled.shared_steps is not None and self._scenes_key() is not None:
+            return compiled.shared_steps
+        return compiled.steps
+
+    def _run_steps(self, compiled: CompiledProgram):
+        if self.profile is not None:
+            return self._run_steps_profiled(compiled)
+        ans = None
+        trace = self.exe_trace = []
+        for function, dependencies, arguments in self._steps(compiled):
+            # most steps depend on a single step
+            if len(dependencies) == 1:
+                ans = function(self, trace[dependencies[0]], *arguments)
+            else:
+                ans = function(self, *[trace[i] for i in dependencies], *arguments)
+            trace.append(ans)
+        return ans
+
+    def _run_steps_profiled(self, compiled: CompiledProgram):
+        ans = None
+        trace = self.exe_trace = []
+        for function, dependencies, arguments in self._steps(compiled):
+            ans = self._run_profiled_step(function, [trace[i] for i in dependencies], arguments)
+            trace.append(ans)
+        return ans
+
+    def _run_profiled_step(self, function: Callable, inputs: List, arguments: Tuple):
+        if function is Executor._skipped:
+            return None
+        operation = function.__name__.lstrip('_')
+        ans = self.profile.call(operation, inputs[0] if inputs else None, function, self, *inputs, *arguments)
+        if type(ans) is ProgramFailure:
+            self.profile.record_failure(operation)
+        return ans
+
     @predicate
     def scene(self, _=None):
-        return self._curr_scene_objects
+        return self._scene_objects()
 
     @predicate
     def all(self, input_objects, condition_program):
@@ -103,13 +437,56 @@ class Executor:
         return self.quantifier(input_objects, condition_program, lambda x: not any(x))
 
     def quantifier(self, input_objects, condition_program, quantifier_fn):
-        res = self.run(condition_program, self._curr_scene_objects_dict)
-        objects_with_condition = set(o['object_key'] for o in res)
+        objects_with_condition = self._condition_output(condition_program)
 
         objects_with_condition_in_res = [obj['object_key'] in objects_with_condition for obj in input_objects]
 
         return quantifier_fn(objects_with_condition_in_res)
 
+    def _condition_output(self, condition_program):
+        """
+        Runs the condition program of a quantifier on the current scenes. Outputs are memoized when the scenes are
+        known (see `_scenes_key`), since the same condition is often checked on the same scenes
+        """
+        condition_program = self.compile(condition_program)
+        scenes_key = self._scenes_key()
+        key = None
+        if type(condition_program) is CompiledProgram and condition_program.key is not None and scenes_key:
+            # outputs of executors of other classes are of other types (e.g. bitmasks)
+            key = (type(self), condition_program.key, scenes_key)
+        if key is not None and key in Executor._condition_outputs:
+            Executor._condition_outputs.move_to_end(key)
+            return Executor._condition_outputs[key]
+
+        output = self._objects_set(self._run_nested(condition_program))
+        if key is not None:
+            Executor._condition_outputs[key] = output
+            if len(Executor._condition_outputs) > Executor.MAX_CONDITION_OUTPUTS:
+                Executor._condition_outputs.popitem(last=False)
+        return output
+
+    def _scenes_key(self):
+        # the scenes of the current run, if they are indexed
+        return self._curr_scene_index.scenes_key if self._curr_scene_index is not None else None
+
+    def _objects_set(self, objects):
+        return frozenset(o['object_key'] for o in objects)
+
+    def _run_nested(self, program):
+        """
+        Runs a program on the current scene, keeping the execution trace of the program that is running
+        """
+        exe_trace = self.exe_trace
+        # outputs of nested programs are used by the step that runs them, so their failures are raised
+        return_failures, self._return_failures = self._return_failures, False
+        try:
+            if type(program) is CompiledProgram:
+                return self._run_steps(program)
+            return self.interpret(program, self._curr_scene_objects_dict, self._curr_scene_index)
+        finally:
+            self.exe_trace = exe_trace
+            self._return_failures = return_failures
+
     @predicate
     def all_same(self, input_objects, attribute_type):
         if len(input_objects) == 0:
@@ -124,7 +501,7 @@ class Executor:
         for attr, val in input_object1.get('attributes_by_group', {}).items():
             if input_object2.get('attributes_by_group', {}).get(attr, set()).intersection(val):
                 return attr
-        raise NoCommonAttributeException
+        return self._fail(NoCommonAttributeException)
 
     @predicate
     def query_name(self, input_object1):
@@ -137,8 +514,10 @@ class Executor:
         if type(object_names) is str:
             object_names = {object_names}
         if not object_names:
-            return self._curr_scene_objects
-        return [obj for obj in self._curr_scene_objects if obj['name'] in object_names]
+            return self._scene_objects()
+        if self._curr_scene_index is not None:
+            return self._curr_scene_index.find(object_names)
+        return [obj for obj in self._scene_objects() if obj['name'] in object_names]
 
     @predicate
     def count(self, input_objects):
@@ -187,22 +566,25 @@ class Executor:
             attribute_name = {attribute_name}
         else:
             attribute_name = set(attribute_name)
+        if self._curr_scene_index is not None:
+            objects_with_attributes = self._curr_scene_index.with_attributes(attribute_name)
+            return [obj for obj in input_objects if obj['object_key'] in objects_with_attributes]
         return [obj for obj in input_objects if attribute_name.intersection(obj['attributes'])]
 
     @predicate
     def unique(self, input_objects):
         if len(input_objects) > 1:
-            raise NonUniqueException()
+            return self._fail(NonUniqueException)
         if len(input_objects) == 0:
-            raise NonExistentException()
+            return self._fail(NonExistentException)
         return input_objects[0]
 
     @predicate
     def assert_unique(self, input_objects):
         if len(input_objects) > 1:
-            raise NonUniqueException()
+            return self._fail(NonUniqueException)
         if len(input_objects) == 0:
-            raise NonExistentException()
+            return self._fail(NonExistentException)
         return input_objects
 
     @predicate
@@ -238,7 +620,7 @@ class Executor:
         if not attributes_for_group:
             return None
         if len(attributes_for_group) > 1:
-            raise MultipleAttributesForTypeException()
+            return self._fail(MultipleAttributesForTypeException)
         return list(attributes_for_group)[0]
 
     @predicate
@@ -248,7 +630,7 @@ class Executor:
         elif attr2 in input_object['attributes']:
             return attr2
 
-        raise NeitherOfChooseException()
+        return self._fail(NeitherOfChooseException)
 
     @predicate
     def choose_name(self, input_object, name1, name2):
@@ -257,7 +639,7 @@ class Executor:
         elif name2 == input_object['name']:
             return name2
 
-        raise NeitherOfChooseException()
+        return self._fail(NeitherOfChooseException)
 
     @predicate
     def choose_relation(self, input_relation, relation1, relation2):
@@ -266,7 +648,7 @@ class Executor:
         elif relation2 == input_relation:
             return relation2
 
-        raise NeitherOfChooseException()
+        return self._fail(NeitherOfChooseException)
 
     @predicate
     def verify_attr(self, input_object, attr):
@@ -291,15 +673,25 @@ class Executor:
             else:
                 relation_filter = {relation_filter}
 
+        index = self._curr_scene_index
+        if index is not None and not return_object:
+            # subjects are looked up by the objects they relate to, and kept in the order they are added below
+            object_keys2 = [o['object_key'] for o in input_objects2] if input_objects2 is not None else None
+            subjects = index.subjects(object_keys2, relation_filter)
+            objects_with_name_and_relation = set(obj['object_key'] for obj in input_objects1
+                                                 if obj['object_key'] in subjects)
+            return [self._curr_scene_objects_dict[o] for o in objects_with_name_and_relation]
+
         objects_with_name_and_relation = set()
         input_objects2_set = set([o['object_key'] for o in input_objects2]) if input_objects2 else set()
         for obj in input_objects1:
-            to_iterate = list(obj['relations'])
-            if obj['relations'] and obj['relations'][0].get('prepositions'):
-                to_iterate += obj['relations'][0]['prepositions']
-            for relation in to_iterate:
-                other_object_key = relation['object']
-                relation_name = relation['name']
+            if index is not None:
+                to_iterate = index.object_relations(obj['object_key'])
+            else:
+                to_iterate = [(relation['name'], relation['object']) for relation in obj['relations']]
+                if obj['relations'] and obj['relations'][0].get('prepositions'):
+                    to_iterate += [(pp['name'], pp['object']) for pp in obj['relations'][0]['prepositions']]
+            for relation_name, other_object_key in to_iterate:
                 if relation_filter and relation_name not in relation_filter:
                     continue
                 if input_objects2 is not None and other_object_key not in input_objects2_set:
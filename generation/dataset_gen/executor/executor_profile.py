@@ -0,0 +1,126 @@
+import csv
+import time
+from collections import Counter
+from typing import Callable, Optional
+
+
+class ExecutorProfile:
+    """
+    Counts, cumulative time and sizes of the inputs and outputs (number of objects) of the operations executed by
+    `Executor`, per operation and per pattern that executed them (see `Executor.profile`). Times of operations that run
+    nested programs (quantifiers and shared sub-programs) include the operations of these programs.
+    Profiles are collected separately by each worker process and merged by the main process.
+    """
+    # operations executed outside of question patterns (e.g. reference programs and filtering of context scenes)
+    NO_PATTERN = '-'
+
+    def __init__(self):
+        # name of the pattern that is executing programs, if any
+        self.pattern = None
+
+        self.counts = Counter()
+        self.total_time = Counter()
+        self.failed = Counter()
+        self.sized_inputs = Counter()
+        self.total_input_size = Counter()
+        self.sized_outputs = Counter()
+        self.total_output_size = Counter()
+
+    def call(self, operation: str, input_value, function: Callable, *args):
+        """
+        Calls the function of an operation and records it. `input_value` is the first input of the operation
+        """
+        key = (self.pattern or ExecutorProfile.NO_PATTERN, operation)
+        st = time.perf_counter()
+        try:
+            output = function(*args)
+        except Exception:
+            self.failed[key] += 1
+            raise
+        finally:
+            self.counts[key] += 1
+            self.total_time[key] += time.perf_counter() - st
+
+        input_size = ExecutorProfile._size(input_value)
+        if input_size is not None:
+            self.sized_inputs[key] += 1
+            self.total_input_size[key] += input_size
+        output_size = ExecutorProfile._size(output)
+        if output_size is not None:
+            self.sized_outputs[key] += 1
+            self.total_output_size[key] += output_size
+        return output
+
+    def record_failure(self, operation: str):
+        """
+        Records that the last call of the operation failed without raising (see `Executor.run_with_status`)
+        """
+        self.failed[(self.pattern or ExecutorProfile.NO_PATTERN, operation)] += 1
+
+    @staticmethod
+    def _size(value) -> Optional[int]:
+        # sets of objects (lists, bitmasks) and outputs of `group_by_images`, but not single objects or answers
+        if value is None or isinstance(value, (str, bool, int, float)):
+            return None
+        if type(value) is dict and 'object_key' in value:
+            return None
+        try:
+            return len(value)
+        except TypeError:
+            return None
+
+    def merge(self, other: 'ExecutorProfile'):
+        self.counts.update(other.counts)
+        self.total_time.update(other.total_time)
+        self.failed.update(other.failed)
+        self.sized_inputs.update(other.sized_inputs)
+        self.total_input_size.update(other.total_input_size)
+        self.sized_outputs.update(other.sized_outputs)
+        self.total_output_size.update(other.total_output_size)
+
+    def _rows(self, by_pattern: bool):
+        """
+        Rows of (pattern, operation, count, total time, mean input size, mean output size, failed), sorted by total
+        time. Without `by_pattern`, the operations of all patterns are summed
+        """
+        counters = [self.counts, self.total_time, self.sized_inputs, self.total_input_size, self.sized_outputs,
+                    self.total_output_size, self.failed]
+        if not by_pattern:
+            summed = [Counter() for _ in counters]
+            for s, counter in zip(summed, counters):
+                for (_, operation), value in counter.items():
+                    s[('*', operation)] += value
+            counters = summed
+        counts, total_time, sized_inputs, total_input_size, sized_outputs, total_output_size, failed = counters
+
+        rows = []
+        for key, total in total_time.most_common():
+            mean_input = total_input_size[key] / sized_inputs[key] if sized_inputs[key] else None
+            mean_output = total_output_size[key] / sized_outputs[key] if sized_outputs[key] else None
+            rows.append((*key, counts[key], total, mean_input, mean_output, failed[key]))
+        return rows
+
+    def print_summary(self, top: int = 30):
+        if not self.counts:
+            return
+
+        def _print(rows, first_column):
+            width = max([len(first_column)] + [len(row[0]) for row in rows])
+            print(f"{first_column:<{width}} {'count':>9} {'total':>9} {'mean':>9} {'in':>7} {'out':>7} {'failed':>7}")
+            for name, count, time_sum, mean_input, mean_output, n_failed in rows:
+                print(f"{name:<{width}} {count:>9} {time_sum:>8.2f}s {time_sum / count * 1e6:>7.1f}us "
+                      f"{'-' if mean_input is None else f'{mean_input:.1f}':>7} "
+                      f"{'-' if mean_output is None else f'{mean_output:.1f}':>7} {n_failed:>7}")
+
+        print("Executor operations (sorted by total time, nested operations are counted in their callers too):")
+        _print([(operation, *row) for _, operation, *row in self._rows(by_pattern=False)], 'operation')
+        print(f"Top {top} executor operations per pattern:")
+        _print([(f"{pattern} / {operation}", *row) for pattern, operation, *row in self._rows(by_pattern=True)[:top]],
+               'pattern / operation')
+
+    def save(self, path: str):
+        with open(path, 'wt', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['pattern', 'operation', 'count', 'total_time', 'mean_input_size', 'mean_output_size',
+                             'failed'])
+            writer.writerows(self._rows(by_pattern=True))
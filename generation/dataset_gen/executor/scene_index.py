@@ -0,0 +1,247 @@
+from collections import defaultdict
+from collections.abc import Mapping
+from itertools import chain
+from typing import Dict, Iterator, List, Set, Tuple
+
+
+class SceneIndex:
+    """
+    Lookup tables of a single scene: objects by name, objects by attribute and the relations of each object, so that
+    reference programs can be evaluated without scanning all objects of the scene
+    """
+
+    def __init__(self, scene_objects_dict: Dict):
+        self.object_keys = set(scene_objects_dict.keys())
+        # identifies the indexed scenes
+        self.scenes_key = (tuple(dict.fromkeys(obj['scene_id'] for obj in scene_objects_dict.values())),
+                           len(scene_objects_dict))
+        # object key -> position in the scene
+        self.positions = {obj_key: i for i, obj_key in enumerate(scene_objects_dict.keys())}
+        self.objects_by_name = defaultdict(set)
+        # name -> objects, in the order of the scene
+        self.ordered_objects_by_name = defaultdict(list)
+        self.objects_by_attribute = defaultdict(set)
+
+        # object key -> (relation name, other object key), in the same order `Executor.with_relation` iterates them
+        self.relations = {}
+        # relation name -> subject key -> object keys, and relation name -> object key -> subject keys
+        self.forward_relations = defaultdict(lambda: defaultdict(list))
+        self.reverse_relations = defaultdict(lambda: defaultdict(list))
+
+        for obj_key, obj in scene_objects_dict.items():
+            self._index_object(obj_key, obj)
+
+    def _index_object(self, obj_key: str, obj: Dict):
+        self.objects_by_name[obj['name']].add(obj_key)
+        self.ordered_objects_by_name[obj['name']].append(obj)
+        for attr in obj['attributes']:
+            self.objects_by_attribute[attr].add(obj_key)
+
+        relations = list(obj['relations'])
+        if obj['relations'] and obj['relations'][0].get('prepositions'):
+            relations += obj['relations'][0]['prepositions']
+        self.relations[obj_key] = [(rel['name'], rel['object']) for rel in relations]
+        for rel in relations:
+            self.forward_relations[rel['name']][obj_key].append(rel['object'])
+            self.reverse_relations[rel['name']][rel['object']].append(obj_key)
+
+    def find(self, names: Set[str]) -> List[Dict]:
+        """
+        The objects with any of the given names, in the order of the scene
+        """
+        if len(names) == 1:
+            return list(self.ordered_objects_by_name.get(next(iter(names)), ()))
+        objects = [obj for name in names for obj in self.ordered_objects_by_name.get(name, ())]
+        if len(objects) > 1:
+            objects.sort(key=lambda obj: self.positions[obj['object_key']])
+        return objects
+
+    def with_attributes(self, attributes: Set[str]) -> Set[str]:
+        """
+        Keys of the objects with any of the given attributes
+        """
+        if len(attributes) == 1:
+            return self.objects_by_attribute.get(next(iter(attributes)), set())
+        return set().union(*[self.objects_by_attribute.get(attr, ()) for attr in attributes])
+
+    def subjects(self, object_keys, relation_names: Set[str] = None) -> Set[str]:
+        """
+        Keys of the objects that relate to any of the given objects (or to any object, if `object_keys` is None) with
+        any of the given relations (or with any relation)
+        """
+        names = [name for name in relation_names if name in self.reverse_relations] if relation_names \
+            else list(self.reverse_relations)
+        subjects = set()
+        for name in names:
+            if object_keys is None:
+                subjects.update(self.forward_relations[name].keys())
+            else:
+                adjacency = self.reverse_relations[name]
+                for obj_key in object_keys:
+                    subjects.update(adjacency.get(obj_key, ()))
+        return subjects
+
+    def object_relations(self, obj_key: str) -> List:
+        return self.relations[obj_key]
+
+
+class MultiSceneIndex:
+    """
+    The index of several scenes, answering the lookups of `SceneIndex` from the index of each scene
+    """
+
+    def __init__(self, indexes: List[SceneIndex]):
+        self._indexes = indexes
+        self.scenes_key = (tuple(scene_id for index in indexes for scene_id in index.scenes_key[0]),
+                           sum(index.scenes_key[1] for index in indexes))
+
+    def find(self, names: Set[str]) -> List[Dict]:
+        # objects of a scene come after the objects of the scenes before it
+        return [obj for index in self._indexes for obj in index.find(names)]
+
+    def with_attributes(self, attributes: Set[str]) -> Set[str]:
+        return set().union(*[index.with_attributes(attributes) for index in self._indexes])
+
+    def subjects(self, object_keys, relation_names: Set[str] = None) -> Set[str]:
+        return set().union(*[index.subjects(object_keys, relation_names) for index in self._indexes])
+
+    def object_relations(self, obj_key: str) -> List:
+        for index in self._indexes:
+            if obj_key in index.relations:
+                return index.relations[obj_key]
+        raise KeyError(obj_key)
+
+
+class MultiSceneView(Mapping):
+    """
+    A read-only objects dict of several scenes, in order, that `Executor` runs on without merging the objects of the
+    scenes into a new dict. Object keys are unique across scenes (they are the ids of the objects in the graph), so the
+    view has the same objects in the same order as the merged dict.
+    """
+
+    def __init__(self, scenes_objects: List[Dict], indexes: List[SceneIndex]):
+        self._scenes_objects = scenes_objects
+        self.index = MultiSceneIndex(indexes)
+
+    def __getitem__(self, obj_key):
+        for objects in self._scenes_objects:
+            if obj_key in objects:
+                return objects[obj_key]
+        raise KeyError(obj_key)
+
+    def __contains__(self, obj_key):
+        return any(obj_key in objects for objects in self._scenes_objects)
+
+    def __iter__(self) -> Iterator[str]:
+        return chain.from_iterable(self._scenes_objects)
+
+    def __len__(self):
+        return sum(len(objects) for objects in self._scenes_objects)
+
+    def values(self) -> Iterator[Dict]:
+        return chain.from_iterable(objects.values() for objects in self._scenes_objects)
+
+    def items(self) -> Iterator[Tuple[str, Dict]]:
+        return chain.from_iterable(objects.items() for objects in self._scenes_objects)
+
+
+class CompiledRefProgram:
+    """
+    A reference program (made of `scene`, `find`, `filter`, `with_relation` and `with_relation_object` operations, as
+    built by `sub_graph_root_to_ref_program`) compiled once to be checked against many scenes. Objects are represented
+    by their keys, and every operation is answered with `SceneIndex` lookups.
+    """
+    OPERATIONS = {'scene', 'find', 'filter', 'with_relation', 'with_relation_object'}
+
+    def __init__(self, program: List[Dict]):
+        self._steps = []
+
+        # names that must appear in a scene for the program to return any object
+        self.required_names = []
+        # sets of attributes that at least one object in the scene must have
+        self.required_attributes = []
+
+        for program_row in program:
+            operation = program_row['operation']
+            assert operation in CompiledRefProgram.OPERATIONS, f"Unsupported operation: {operation}"
+            arguments = program_row.get('arguments', [])
+            dependencies = program_row.get('dependencies', [])
+
+            if operation == 'find':
+                names = CompiledRefProgram._as_set(arguments[0])
+                if names:
+                    self.required_names.append(names)
+                arguments = [names]
+            elif operation == 'filter':
+                attributes = CompiledRefProgram._as_set(arguments[0])
+                self.required_attributes.append(attributes)
+                arguments = [attributes]
+            elif operation in ('with_relation', 'with_relation_object'):
+                # arguments are either [relation] (with the objects as the second dependency) or [None, relation]
+                arguments = [CompiledRefProgram._as_set(arguments[-1])]
+
+            self._steps.append((operation, dependencies, arguments))
+
+    @staticmethod
+    def _as_set(value) -> Set:
+        if not value:
+            return set()
+        if type(value) is str:
+            return {value}
+        return set(value)
+
+    def can_match(self, index: SceneIndex) -> bool:
+        for names in self.required_names:
+            if not any(name in index.objects_by_name for name in names):
+                return False
+        for attributes in self.required_attributes:
+            if not any(attr in index.objects_by_attribute for attr in attributes):
+                return False
+        return True
+
+    def run(self, index: SceneIndex) -> Set[str]:
+        """
+        Returns the keys of the objects the program evaluates to
+        """
+        trace = []
+        for operation, dependencies, arguments in self._steps:
+            inputs = [trace[i] for i in dependencies]
+            if operation == 'scene':
+                output = index.object_keys
+            elif operation == 'find':
+                names = arguments[0]
+                if not names:
+                    output = index.object_keys
+                else:
+                    output = set().union(*[index.objects_by_name.get(name, ()) for name in names])
+            elif operation == 'filter':
+                objects_with_attributes = set().union(*[index.objects_by_attribute.get(attr, ())
+                                                        for attr in arguments[0]])
+                output = inputs[0].intersection(objects_with_attributes)
+            else:
+                output = CompiledRefProgram._with_relation(index, inputs[0], inputs[1] if len(inputs) > 1 else None,
+                                                           arguments[0], operation == 'with_relation_object')
+            trace.append(output)
+            if not output:
+                # every operation of a reference program is an input of the last one, and keeps an empty input empty
+                return set()
+        return trace[-1] if trace else set()
+
+    @staticmethod
+    def _with_relation(index: SceneIndex, subjects, objects, relation_names, return_object):
+        output = set()
+        for subject in subjects:
+            for relation_name, other_object in index.relations[subject]:
+                if relation_names and relation_name not in relation_names:
+                    continue
+                if objects is not None and other_object not in objects:
+                    continue
+                output.add(other_object if return_object else subject)
+        return output
+
+    def exists_in_scenes(self, indexes: List[SceneIndex]) -> List[bool]:
+        """
+        Returns, for each scene, whether the program evaluates to at least one object. Scenes that miss a required name
+        or attribute are rejected without running the program.
+        """
+        return [self.can_match(index) and bool(self.run(index)) for index in indexes]
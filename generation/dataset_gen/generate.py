@@ -11,6 +11,7 @@ from random import Random
 from tqdm import tqdm
 
 from generator.queries.graph_executor import GraphExecutor
+from generator.queries.query_builder import QueryBuilder
 from generator.question_generator import QuestionGenerator
 from generator.resources import Resources
 
@@ -20,6 +21,43 @@ parser.add_argument('--multiproc', default=16, type=int)
 parser.add_argument('--split', default='val')
 parser.add_argument('--no_save_redis', action='store_true')
 parser.add_argument('--output_file')
+parser.add_argument('--graph_concurrency', default=4, type=int,
+                    help='maximum number of uncached neo4j queries executed concurrently by each process')
+parser.add_argument('--graph_batch_size', default=1, type=int,
+                    help='uncached neo4j queries that are sent together are combined into statements of this many '
+                         'queries (with UNION ALL)')
+parser.add_argument('--triplet_index', action='store_true',
+                    help='answer queries of several triplets by joining cached matches of each single triplet, so '
+                         'that only unseen triplets are sent to neo4j')
+parser.add_argument('--triplet_index_mb', default=256, type=int,
+                    help='memory limit (in MB) of triplet matches kept by each process, see `--triplet_index`')
+parser.add_argument('--graph_version',
+                    help='version of the graph in the cache namespace, instead of reading it from neo4j (see '
+                         '`scripts/cache_namespaces.py`)')
+parser.add_argument('--query_log',
+                    help='path of a log of every executed neo4j query, to be replayed by `scripts/replay_queries.py`')
+parser.add_argument('--bitset_executor', action='store_true',
+                    help='execute programs on sets of objects indexed as bitmasks, answers are not changed')
+parser.add_argument('--profile_executor', action='store_true',
+                    help='record the count, time and input/output sizes of executed operations, per pattern')
+parser.add_argument('--index_scenes', action='store_true',
+                    help='execute programs on scenes indexed by object names and relations, answers are not changed')
+parser.add_argument('--share_sub_programs', action='store_true',
+                    help='run reference sub-programs once per scenes for all programs (with --index_scenes), '
+                         'answers are not changed')
+parser.add_argument('--executor_profile_path', help='if given, the executor profile is also saved to it (csv)')
+parser.add_argument('--slow_query_threshold', default=0.5, type=float,
+                    help='queries slower than this (in seconds) are written to the slow query log')
+parser.add_argument('--slow_query_log', help='path of the slow query log (jsonl), disabled if not given')
+parser.add_argument('--sample_first', action='store_true',
+                    help='fetch only scene ids of distractor queries, and scene infos only for the sampled scenes')
+parser.add_argument('--pruning_cache_mb', default=64, type=int,
+                    help='memory bound of the triplet pruning cache of each process')
+parser.add_argument('--pruning_cache_path', help='if given, the triplet pruning cache is loaded from and saved to it')
+parser.add_argument('--split_labels', action='store_true',
+                    help='match scenes of the split by label (e.g. `:TrainScene`) instead of the `split` property')
+parser.add_argument('--attribute_labels', action='store_true',
+                    help='match attributes by label, requires importing neo4j with `--attribute-labels`')
 
 args = parser.parse_args()
 
@@ -45,7 +83,15 @@ def worker(scene_id, write_debug=False):
             qst_json['debug_info'] = debug_info
         questions.append(qst_json)
 
-    return scene_id, questions
+    return scene_id, questions, question_generator.pop_stats()
+
+
+def merge_stats(stats):
+    for key, value in stats.items():
+        if key in total_stats:
+            total_stats[key].merge(value)
+        else:
+            total_stats[key] = value
 
 
 def write_questions(qs, cnt_start, qid_prefix):
@@ -70,9 +116,26 @@ def write_questions(qs, cnt_start, qid_prefix):
 
 if __name__ == "__main__":
     Resources.load(questions_yaml='questions.yaml', load_tiny_distract_yaml=False)
+    QueryBuilder.use_split_labels = args.split_labels
+    QueryBuilder.use_attribute_labels = args.attribute_labels
     question_generator = QuestionGenerator(split=args.split, random_seed=2,
                                            question_patterns_ids=[],
-                                           enable_graph_cache=True)
+                                           enable_graph_cache=True,
+                                           max_concurrent_graph_queries=args.graph_concurrency,
+                                           slow_query_threshold=args.slow_query_threshold,
+                                           slow_query_log_path=args.slow_query_log,
+                                           sample_first_context_queries=args.sample_first,
+                                           pruning_cache_size=args.pruning_cache_mb * 1024 * 1024,
+                                           pruning_cache_path=args.pruning_cache_path,
+                                           graph_query_batch_size=args.graph_batch_size,
+                                           triplet_index=args.triplet_index,
+                                           triplet_index_size=args.triplet_index_mb * 1024 * 1024,
+                                           graph_version=args.graph_version,
+                                           graph_query_log_path=args.query_log,
+                                           bitset_executor=args.bitset_executor,
+                                           profile_executor=args.profile_executor,
+                                           share_sub_programs=args.share_sub_programs,
+                                           index_scenes=args.index_scenes)
     scene_ids = list(question_generator.scene_reader.get_all_scene_ids())
     Random(0).shuffle(scene_ids)
 
@@ -84,12 +147,14 @@ if __name__ == "__main__":
     os.makedirs("output", exist_ok=True)
 
     print(f"Starting generation for {len(scene_ids)} scenes")
+    print(f"Cache namespace: {question_generator.cache_namespace}")
     print(f"Output path: {fpath}")
 
     fw = open(fpath, 'wt')
 
     seen_questions = set()
     pattern_types_cnt = Counter()
+    total_stats = {}
 
     global_cnt = 0
 
@@ -101,18 +166,31 @@ if __name__ == "__main__":
 
             loop = tqdm(concurrent.futures.as_completed(futures.values()), total=len(scene_ids))
             for future in loop:
-                scene_id, questions = future.result()
+                scene_id, questions, scene_stats = future.result()
+                merge_stats(scene_stats)
                 global_cnt += write_questions(questions, global_cnt, qid_prefix=args.output_file)
                 loop.desc = f'# questions: {global_cnt}'
                 del futures[scene_id]
     else:
         for scene_id in tqdm(scene_ids):
-            _, questions = worker(scene_id)
+            _, questions, scene_stats = worker(scene_id)
+            merge_stats(scene_stats)
             global_cnt += write_questions(questions, global_cnt, qid_prefix=args.output_file)
 
     print("Total neo4j queries executed (not cached):", GraphExecutor.n_queries_executed_not_cached)
     print("Total neo4j queries executed (cached):", GraphExecutor.n_queries_executed_cached)
 
+    if 'queries' in total_stats:
+        total_stats['queries'].print_saved_executions(len(scene_ids))
+        total_stats['queries'].print_histograms()
+    if 'pruning' in total_stats:
+        total_stats['pruning'].print_summary()
+        question_generator.save_pruning_cache(total_stats['pruning'])
+    if 'executor' in total_stats:
+        total_stats['executor'].print_summary()
+        if args.executor_profile_path:
+            total_stats['executor'].save(args.executor_profile_path)
+
     for i in sorted(list(pattern_types_cnt.keys())):
         print(f"Questions for pattern #{i}: {pattern_types_cnt.get(i, '-')}")
 
@@ -0,0 +1,59 @@
+import sys
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A least-recently-used cache bounded by the estimated memory size (in bytes) of its keys and values, or by the sizes
+    given when entries are set (in any unit, e.g. the number of objects of an indexed scene)
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        if key not in self._entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def set(self, key, value, size: int = None):
+        if key in self._entries:
+            self.size -= self._entries.pop(key)[1]
+
+        entry_size = size if size is not None else LRUCache.estimate_size(key) + LRUCache.estimate_size(value)
+        if entry_size > self.max_size:
+            return
+        self._entries[key] = (value, entry_size)
+        self.size += entry_size
+
+        while self.size > self.max_size:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def items(self):
+        """
+        Returns (key, value) pairs from the least to the most recently used
+        """
+        return [(key, value) for key, (value, _) in self._entries.items()]
+
+    @staticmethod
+    def estimate_size(obj) -> int:
+        size = sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            size += sum(LRUCache.estimate_size(k) + LRUCache.estimate_size(v) for k, v in obj.items())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            size += sum(LRUCache.estimate_size(item) for item in obj)
+        return size
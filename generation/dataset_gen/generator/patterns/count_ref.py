@@ -58,6 +58,8 @@ class CountRefPattern(QuestionPattern):
 
         # pick two sets of images/slots for both true/false answers
         real_count_1 = self._compute_count_answer(pos1, neg1, program)
+        if real_count_1 is None:
+            return
         real_count_2 = real_count_1
 
         tries, limit = 0, 5
@@ -66,6 +68,8 @@ class CountRefPattern(QuestionPattern):
                 return
             neg2, pos2 = self._pick_scenes(verified_positives, negative_scenes, scene_key, n_min_positive=0)
             real_count_2 = self._compute_count_answer(pos2, neg2, program)
+            if real_count_2 is None:
+                return
             tries += 1
 
         if self._is_binary_question:
@@ -110,11 +114,11 @@ class CountRefPattern(QuestionPattern):
             yield slots, program, pos2, neg2, [sub_graph]
 
     def _compute_count_answer(self, pos, neg, program):
-        all_scenes = [self._scene_reader.get_formatted_scenes(k) for k in pos + neg]
-        objects_from_all_scenes = {ok: ov for s in all_scenes for ok, ov in s['objects'].items()}
-
         if program[-1]['operation'] != 'count':
             program = program[:-1]
 
-        answer = self._executor.run(program, objects_from_all_scenes)  # run only up to the "count" operation
-        return answer
+        # run only up to the "count" operation
+        answers, errors = self._run_on_scene_sets(program, [pos + neg])
+        if self._count_failures(errors):
+            return None
+        return answers[0]
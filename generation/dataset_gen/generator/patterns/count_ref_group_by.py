@@ -71,6 +71,8 @@ class CountRefGroupByPattern(QuestionPattern):
 
         # pick two sets of images/slots for both true/false answers
         real_count_1 = self._compute_count_answer(pos1, neg1, program, slots)
+        if real_count_1 is None:
+            return
         real_count_2 = real_count_1
 
         n_available_negative_scenes = len(set([s_id for s_set in verified_negatives.values() for s_id in s_set]))
@@ -84,6 +86,8 @@ class CountRefGroupByPattern(QuestionPattern):
                 return
             neg2, pos2 = self._pick_scenes(verified_positives, verified_negatives, scene_key, n_min_positive=0)
             real_count_2 = self._compute_count_answer(pos2, neg2, program, slots)
+            if real_count_2 is None:
+                return
             tries += 1
 
         if self._is_binary_question:
@@ -127,8 +131,10 @@ class CountRefGroupByPattern(QuestionPattern):
                     possible_slot["NUM_POS_GROUP_BY"] = self._random.randint(num_group_by, 5)
                 quantifier_text = {"keep_if_values_count_eq": "exactly", "keep_if_values_count_leq": "at most", "keep_if_values_count_geq": "at least"}
                 possible_slot["QUANTIFIER"] = quantifier_text[qnt]
-                ans1 = self._compute_count_answer(pos1, neg1, program, possible_slot)
-                ans2 = self._compute_count_answer(pos2, neg2, program, possible_slot)
+                answers = self._compute_count_answers([(pos1, neg1), (pos2, neg2)], program, possible_slot)
+                if answers is None:
+                    return
+                ans1, ans2 = answers
                 if ans1 != ans2:
                     possible_slots.append(possible_slot)
             selected_slots = self._random.choice(possible_slots)
@@ -139,16 +145,24 @@ class CountRefGroupByPattern(QuestionPattern):
         yield slots, program, pos2, neg2, [sub_graph]
 
     def _compute_count_answer(self, pos, neg, program, slots):
-        all_scenes = [self._scene_reader.get_formatted_scenes(k) for k in pos + neg]
-        objects_from_all_scenes = {ok: ov for s in all_scenes for ok, ov in s['objects'].items()}
+        answers = self._compute_count_answers([(pos, neg)], program, slots)
+        return answers[0] if answers is not None else None
+
+    def _compute_count_answers(self, scene_sets, program, slots):
+        """
+        The count answers of the program on each set of (positive, negative) scenes, or None if it failed on any of them
+        """
         program = fill_program_slots(program, slots)
 
         if self._is_binary_question:
             program = program[:-1]
 
-        answer = self._executor.run(program, objects_from_all_scenes)  # run only up to the "count" operation
-        assert type(answer) is int
-        return answer
+        # run only up to the "count" operation
+        answers, errors = self._run_on_scene_sets(program, [pos + neg for pos, neg in scene_sets])
+        if self._count_failures(errors):
+            return None
+        assert all(type(answer) is int for answer in answers)
+        return answers
 
     @staticmethod
     def does_pattern_support_multi_instances() -> bool:
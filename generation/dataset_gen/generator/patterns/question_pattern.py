@@ -1,10 +1,13 @@
 from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
 from copy import deepcopy
 from itertools import zip_longest
 from random import Random
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Set, Tuple, Union
 
+from executor.bitset_executor import BitsetExecutor, BitsetScene
 from executor.executor import Executor
+from executor.scene_index import SceneIndex
 from generator.queries.data_classes import QueryNode
 from generator.queries.query_builder import SubGraph
 from generator.resources import Resources
@@ -18,9 +21,12 @@ class NoNegativeScenesException(Exception):
 
 class QuestionPattern(ABC):
     MAX_CONTEXT_IMAGES = 5
+    # failures of programs by their codes (see `EXCEPTION_CODES`), per pattern index
+    generation_errors_per_pattern = defaultdict(lambda: Counter())
 
     def __init__(self, pattern_dict: Dict, scene_reader: SceneReader, random_seed=None,
-                 allow_ref_no_relations: bool = False, pick_random_distractors: bool = False):
+                 allow_ref_no_relations: bool = False, pick_random_distractors: bool = False,
+                 bitset_executor: bool = False, index_scenes: bool = False):
         self._pattern = pattern_dict
         self._scene_reader = scene_reader
         self._random = Random(random_seed)
@@ -30,7 +36,10 @@ class QuestionPattern(ABC):
         # create a separate random instance to run this experiment without changing the original random choices
         self._random_neg = Random(random_seed)
 
-        self._executor = Executor()
+        self._bitset_executor = bitset_executor
+        self._executor = BitsetExecutor() if bitset_executor else Executor()
+        # programs are executed on indexed scenes (see `SceneIndex`)
+        self._index_scenes = index_scenes
 
         self._nouns_to_ignore_for_color_questions = {'building', 'tree', 'sign', 'clock', 'bush', 'bus', 'flag', 'leaf', 'leaves',
                                       'sauce', 'water', 'ocean'}
@@ -61,6 +70,10 @@ class QuestionPattern(ABC):
             self._random.shuffle(scenes)
             yield picked_slots, self._pattern, program, scenes, relevant_scenes_info, sub_graphs, simple_ref_text, None
 
+    @property
+    def name(self) -> str:
+        return f"#{self._pattern['pattern_index']} {self._pattern['pattern_name']}"
+
     @staticmethod
     def does_pattern_support_multi_instances() -> bool:
         return False
@@ -232,15 +245,57 @@ class QuestionPattern(ABC):
     def _get_scenes_with_and_without_ref(self, negative_scenes, ref_2_program):
         scenes_with_ref = []
         scenes_without_ref = []
-        for scene_id in negative_scenes:
-            scene_objects_dict = self._scene_reader.get_formatted_scenes(scene_id)['objects']
-            exists = self._executor.run(ref_2_program, scene_objects_dict)
+        negative_scenes = list(negative_scenes)
+        answers, errors = self._run_on_scene_sets(ref_2_program, [[scene_id] for scene_id in negative_scenes])
+        self._count_failures(errors)
+        for scene_id, exists, error in zip(negative_scenes, answers, errors):
+            if error:
+                # neither known to have the reference nor not to have it
+                continue
             if exists:
                 scenes_with_ref.append(scene_id)
             else:
                 scenes_without_ref.append(scene_id)
         return scenes_with_ref, scenes_without_ref
 
+    def _run_on_scene_sets(self, program: List[Dict], scene_sets: List[List[str]]) -> Tuple[List, List[Optional[str]]]:
+        """
+        Runs a program on the objects of each set of scenes, see `Executor.run_many`
+        """
+        scenes_objects = [self._get_scenes_objects(scene_keys) for scene_keys in scene_sets]
+        return self._executor.run_many(program, [objects for objects, _ in scenes_objects],
+                                       [scene_index for _, scene_index in scenes_objects])
+
+    def _count_failures(self, errors: List[Optional[str]]) -> bool:
+        """
+        Counts the failures of `_run_on_scene_sets` by their codes, with the failures of the answers of the questions
+        of the pattern (see `generation_errors_per_pattern`). Returns whether any of the runs failed
+        """
+        failed = False
+        for error in errors:
+            if error:
+                QuestionPattern.generation_errors_per_pattern[self._pattern['pattern_index']][error] += 1
+                failed = True
+        return failed
+
+    def _get_scenes_objects(self, scene_keys: List[str]) -> Tuple[Union[Dict, BitsetScene], Optional[SceneIndex]]:
+        """
+        The objects of the given scenes and their index, to be executed on by `self._executor`
+        """
+        if self._bitset_executor:
+            if len(scene_keys) == 1:
+                return self._scene_reader.get_bitset_scene(scene_keys[0]), None
+            return BitsetScene.merge([self._scene_reader.get_bitset_scene(k) for k in scene_keys]), None
+        if not self._index_scenes:
+            if len(scene_keys) == 1:
+                return self._scene_reader.get_formatted_scenes(scene_keys[0])['objects'], None
+            return self._scene_reader.get_scenes_objects(scene_keys), None
+        if len(scene_keys) == 1:
+            return self._scene_reader.get_formatted_scenes(scene_keys[0])['objects'], \
+                self._scene_reader.get_scene_index(scene_keys[0])
+        scenes_view = self._scene_reader.get_scenes_view(scene_keys)
+        return scenes_view, scenes_view.index
+
     def _keep_only_valid_attributes_in_neg_sub_graph(self, neg_sub_graph, pos_sub_graph):
         # If any of negative element has attribute(s), pick a single one that is contradicted with positive element.
         # This is necessary since `scene_info_to_sub_graph` possibly returns multiple attributes, which we don't
@@ -15,7 +15,8 @@ class QuestionPatternFactory:
     factory_patterns = {}
 
     @classmethod
-    def create(cls, pattern, scene_reader, random_seed=None, pick_random_distractors=False) -> QuestionPattern:
+    def create(cls, pattern, scene_reader, random_seed=None, pick_random_distractors=False,
+               bitset_executor=False, index_scenes=False) -> QuestionPattern:
         patterns_to_class = {
             'compare_count': CompareCountPattern,
             'all_subject': AllSubjectPattern,
@@ -31,7 +32,8 @@ class QuestionPatternFactory:
         if pattern['pattern_index'] not in cls.factory_patterns:
             cls.factory_patterns[pattern['pattern_index']] = patterns_to_class[pattern['class']](
                 pattern_dict=pattern, scene_reader=scene_reader, random_seed=random_seed,
-                pick_random_distractors=pick_random_distractors
+                pick_random_distractors=pick_random_distractors, bitset_executor=bitset_executor,
+                index_scenes=index_scenes
             )
 
         return cls.factory_patterns[pattern['pattern_index']]
\ No newline at end of file
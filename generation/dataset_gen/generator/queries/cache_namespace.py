@@ -0,0 +1,105 @@
+import json
+import re
+import time
+from typing import Dict
+
+from generator.redis import redis
+from generator.resources import Resources
+
+# a hash of the graph files is stored in a single `GraphVersion` node by `scripts/index_neo4j.py`
+GRAPH_VERSION_QUERY = "MATCH (v:GraphVersion) RETURN v.hash AS hash LIMIT 1"
+UNVERSIONED_GRAPH = "unversioned"
+NEO4J_URI = "neo4j://localhost:7687"
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{40}(:|$)')
+
+
+class CacheNamespace:
+    """
+    Cached results are only valid for the graph they were queried from (and, to be safe, for the resources the
+    generator was configured with), so cache keys are prefixed by a namespace of the split, a hash of the imported
+    graph and a hash of the resource files. Namespaces of older versions are kept side by side until they are dropped
+    (see `scripts/cache_namespaces.py`), and are listed in a registry hash in redis.
+    """
+    REGISTRY_KEY = "cache_namespaces"
+    # prefixes of all keys that are written under a namespace (`ResultCache` and `TripletIndex`)
+    KEY_PREFIXES = ("q", "t")
+    HASH_LENGTH = 12
+
+    def __init__(self, split: str, graph_version: str, resources_version: str):
+        self.split = split
+        self.graph_version = graph_version
+        self.resources_version = resources_version
+        self.name = f"{split}:{graph_version[:CacheNamespace.HASH_LENGTH]}:" \
+                    f"{resources_version[:CacheNamespace.HASH_LENGTH]}"
+
+    def __str__(self):
+        return self.name
+
+    @staticmethod
+    def current(split: str, graph_version: str = None, neo4j_uri: str = NEO4J_URI) -> 'CacheNamespace':
+        """
+        Returns the namespace of the graph served by neo4j (unless `graph_version` is given) and of the loaded
+        resources
+        """
+        if graph_version is None:
+            graph_version = CacheNamespace.read_graph_version(neo4j_uri)
+        return CacheNamespace(split, graph_version, Resources.version)
+
+    @staticmethod
+    def read_graph_version(neo4j_uri: str = NEO4J_URI) -> str:
+        # read with a driver of its own that is closed right away, so that no connection is left in the pool of the
+        # caller, to be shared by the worker processes that are forked after it
+        from neo4j import GraphDatabase
+        graph_db_driver = GraphDatabase.driver(neo4j_uri, max_connection_pool_size=1)
+        try:
+            with graph_db_driver.session() as session:
+                results = list(session.run(GRAPH_VERSION_QUERY))
+        finally:
+            graph_db_driver.close()
+        if not results:
+            # graphs imported before versions were added
+            return UNVERSIONED_GRAPH
+        return results[0]['hash']
+
+    def register(self):
+        redis.hset(CacheNamespace.REGISTRY_KEY, mapping={self.name: json.dumps({
+            'split': self.split,
+            'graph_version': self.graph_version,
+            'resources_version': self.resources_version,
+            'last_used': time.time()
+        })})
+
+    @staticmethod
+    def registered() -> Dict[str, Dict]:
+        return {name.decode('utf-8'): json.loads(info)
+                for name, info in redis.hgetall(CacheNamespace.REGISTRY_KEY).items()}
+
+    @staticmethod
+    def keys(name: str, batch_size: int = 1000):
+        """
+        Yields all keys of the namespace. Keys of other namespaces that start with the same text (e.g. keys of the
+        `val:<graph>:<resources>` namespace for the `val` namespace of older caches) are skipped.
+        """
+        for prefix in CacheNamespace.KEY_PREFIXES:
+            namespace_prefix = f"{prefix}:{name}:"
+            for key in redis.scan_iter(match=f"{namespace_prefix}*", count=batch_size):
+                if DIGEST_RE.match(key.decode('utf-8')[len(namespace_prefix):]):
+                    yield key
+
+    @staticmethod
+    def drop(name: str, batch_size: int = 1000) -> int:
+        """
+        Deletes all keys of the namespace and removes it from the registry. Returns the number of deleted keys.
+        """
+        n_deleted = 0
+        keys = []
+        for key in CacheNamespace.keys(name, batch_size):
+            keys.append(key)
+            if len(keys) >= batch_size:
+                n_deleted += redis.unlink(*keys)
+                keys = []
+        if keys:
+            n_deleted += redis.unlink(*keys)
+        redis.hdel(CacheNamespace.REGISTRY_KEY, name)
+        return n_deleted
@@ -48,7 +48,7 @@ class QueryElement(ABC):
     original_name: str = None  # used for filtering out multiple names in scenes
 
     @abstractmethod
-    def as_cyhper_element(self):
+    def as_cyhper_element(self, parameters: dict, char_symbol_prefix='', attribute_labels=False):
         pass
 
     @abstractmethod
@@ -85,7 +85,12 @@ class QueryNode(QueryElement):
 
         return serialized_names if self.name else None, tuple(sorted(list(self.attributes))), self.empty
 
-    def as_cyhper_element(self, char_symbol_prefix=''):
+    def as_cyhper_element(self, parameters: dict, char_symbol_prefix='', attribute_labels=False):
+        """
+        Names and attributes are not inlined in the query but added to `parameters`, so that queries with the same
+        structure share the same text (and the same cached execution plan in neo4j).
+        attribute_labels: match attributes by labels (requires importing the graph with `--attribute-labels`)
+        """
         if not self.attributes:
             self.attributes = set()
         names = self.name
@@ -95,14 +100,16 @@ class QueryNode(QueryElement):
         str_elm = f'({char_symbol}:Object)'
         where_clauses = []
         if names:
-            names = sorted(list(names))  # sort to make query consistent for caching
-            where_elements_name = '(' + ' OR '.join([f'{char_symbol}.name = "{n}"' for n in names]) + ')'
-            where_clauses.append(where_elements_name)
-        if self.attributes:
-            attributes = sorted(list(self.attributes))  # sort to make query consistent for caching
-            where_elements_attributes = '(' + ' OR '.join(
-                [f'"{a}" in {char_symbol}.attributes' for a in attributes]) + ')'
-            where_clauses.append(where_elements_attributes)
+            names_parameter = f"names_{self.char_symbol}"
+            parameters[names_parameter] = sorted(list(names))  # sort to make query consistent for caching
+            where_clauses.append(f'({char_symbol}.name IN ${names_parameter})')
+        if self.attributes and attribute_labels:
+            labels = [f'{char_symbol}:`Attr_{a.replace(" ", "_")}`' for a in sorted(list(self.attributes))]
+            where_clauses.append('(' + ' OR '.join(labels) + ')')
+        elif self.attributes:
+            attributes_parameter = f"attrs_{self.char_symbol}"
+            parameters[attributes_parameter] = sorted(list(self.attributes))
+            where_clauses.append(f'any(attr IN {char_symbol}.attributes WHERE attr IN ${attributes_parameter})')
         where_clause = ' AND '.join(where_clauses)
         return str_elm, where_clause
 
@@ -136,7 +143,8 @@ class QueryRelationship(QueryElement):
             serialized_names = (self.name,)
         return serialized_names if self.name else None
 
-    def as_cyhper_element(self, char_symbol_prefix=''):
+    def as_cyhper_element(self, parameters: dict, char_symbol_prefix='', attribute_labels=False):
+        # relationship types can not be parameterized in cypher, so they are always part of the query text
         str_elm = "["
         char_symbol = f"{char_symbol_prefix}{self.char_symbol}"
         str_elm += f"{char_symbol}"
@@ -1,23 +1,35 @@
 import itertools
 import json
+import os
+import pickle
+import threading
 import time
 from collections import defaultdict
+from concurrent.futures.thread import ThreadPoolExecutor
 from copy import deepcopy
 from random import Random
 from typing import Tuple, Set, Dict, List, Union
 
 from neo4j import GraphDatabase
+from neo4j.exceptions import DriverError, Neo4jError
 
-from executor.executor import Executor
+from executor.scene_index import CompiledRefProgram
+from generator.queries.cache_namespace import CacheNamespace
 from generator.queries.data_classes import QueryNode
 
 from generator.queries.query_builder import QueryBuilder
+from generator.queries.query_log import QueryLog
+from generator.lru_cache import LRUCache
+from generator.queries.query_stats import QueryStats, PruningCacheStats
+from generator.queries.result_cache import ResultCache
 from generator.queries.sub_graph import SubGraph
+from generator.queries.triplet_index import TripletIndex
 from generator.redis import redis
 from generator.utils import extract_elements_triplets, neo4j_results_to_sub_graph, sub_graph_root_to_ref_program
 
 
 FilterOutSubGraphs = Union[SubGraph, List[SubGraph]]
+ExecutionRequest = Tuple[SubGraph, FilterOutSubGraphs, str]
 
 
 class GraphExecutor:
@@ -25,66 +37,360 @@ class GraphExecutor:
     n_queries_executed_cached = 0
 
     def __init__(self, split, scene_reader, limit_scenes_output: int = 10, random_seed=None, enable_cache=True,
-                 perform_verification=False, output_verification_inference_data=False, verification_file_path=None):
+                 perform_verification=False, output_verification_inference_data=False, verification_file_path=None,
+                 max_concurrent_queries: int = 4, slow_query_threshold: float = 0.5, slow_query_log_path=None,
+                 sample_first: bool = False, pruning_cache_size: int = 64 * 1024 * 1024, pruning_cache_path=None,
+                 query_batch_size: int = 1, triplet_index: bool = False,
+                 triplet_index_size: int = 256 * 1024 * 1024, graph_version: str = None, query_log_path=None):
         self._split = split
-        self._graph_db = GraphDatabase.driver("neo4j://localhost:7687").session()
+
+        # each concurrent query holds its own session, so the connection pool is bounded by the concurrency limit
+        self._max_concurrent_queries = max(1, max_concurrent_queries)
+        self._graph_db_driver = GraphDatabase.driver("neo4j://localhost:7687",
+                                                     max_connection_pool_size=self._max_concurrent_queries)
+        # created lazily, so that worker processes do not inherit threads from the parent process
+        self._queries_pool = None
+        # uncached queries that are sent together are combined into statements of up to this many queries
+        self._query_batch_size = query_batch_size
+
+        # latencies of queries executed by neo4j, and a log of queries slower than `slow_query_threshold` seconds
+        self.query_stats = QueryStats()
+        self._slow_query_threshold = slow_query_threshold
+        self._slow_query_log_path = slow_query_log_path
+        self._stats_lock = threading.Lock()
+        # optionally, every executed query is logged to be replayed later (see `QueryLog`)
+        self._query_log = QueryLog(query_log_path) if query_log_path else None
+
         self._random = Random(random_seed)
         self._scene_reader = scene_reader
-        self._enable_cache = enable_cache
-        self._executor = Executor()
 
-        self._limit_scenes_output = limit_scenes_output
+        # cached results are kept per version of the graph and of the resources, see `CacheNamespace`
+        self.cache_namespace = None
+        if enable_cache:
+            self.cache_namespace = CacheNamespace.current(split, graph_version)
+            self.cache_namespace.register()
+        namespace = self.cache_namespace.name if self.cache_namespace else None
+        self._cache = ResultCache(split, enabled=enable_cache, namespace=namespace)
 
-        self._pruning_cache = {}
+        self._limit_scenes_output = limit_scenes_output
 
-    def _execute_query_str(self, query_str, sub_graph):
+        # queries of several triplets are answered by joining the cached matches of each triplet, see `TripletIndex`
+        self._triplet_index = TripletIndex(split, self._graph_db_driver, triplet_index_size, enable_cache,
+                                           self._record_query, namespace) if triplet_index else None
+
+        # queries whose results are filtered and sampled down to `limit_scenes_output` scenes are executed in two
+        # phases: first only the scene ids are fetched, and then the scene infos only of the sampled scenes
+        self._sample_first = sample_first
+
+        # results of `_prune_triplet` depend only on the dataset, so they are kept across scenes (and, if a path is
+        # given, across runs), bounded by their estimated size in bytes
+        self._pruning_cache = LRUCache(pruning_cache_size)
+        self._pruning_cache_path = pruning_cache_path
+        self.pruning_stats = PruningCacheStats()
+        if pruning_cache_path:
+            self._load_pruning_cache()
+
+        # results of queries executed for the current scene, keyed by their cache key. Many distractor queries of
+        # different sub-graphs (and of the same sub-graph) are identical after pruning, so each is executed only once
+        self._scene_key = None
+        self._scene_results = {}
+        self._scene_ids_results = {}
+        self._scenes_info_results = {}
+
+    def _execute_query(self, sub_graph, cache_key, fetched_results=None):
         result_scenes = []
         scenes_info = {}
 
-        if len(sub_graph) == 1 and not sub_graph.root.attributes:
+        if self._is_random_query(sub_graph):
             # only needed for verification output
             random_scenes = self._random.sample(self._scene_reader.all_scenes_keys, 20)
             for scene_id in random_scenes:
                 result_scenes.append(scene_id)
                 scenes_info[scene_id] = {}
+        elif fetched_results and cache_key in fetched_results:
+            GraphExecutor.n_queries_executed_not_cached += 1
+            result_scenes, scenes_info = fetched_results[cache_key]
+            result_scenes = list(result_scenes)
         else:
-            if self._enable_cache:
-                cached = redis.get(query_str)
-            else:
-                cached = None
+            cached = self._cache.get(cache_key)
             if cached:
-                cached = json.loads(cached)
-                result_scenes = cached['scenes']
-                scenes_info = cached['scenes_info']
+                result_scenes, scenes_info = cached
                 GraphExecutor.n_queries_executed_cached += 1
             else:
                 GraphExecutor.n_queries_executed_not_cached += 1
-                # print("no cache!")
+                result_scenes, scenes_info = self._run_query(sub_graph, cache_key)
+
+        return result_scenes, scenes_info
+
+    @staticmethod
+    def _is_random_query(sub_graph):
+        return len(sub_graph) == 1 and not sub_graph.root.attributes
+
+    def _run_query(self, sub_graph, cache_key):
+        """
+        Runs a query against neo4j and saves its results to the cache. Sessions are not thread-safe, so every call
+        opens its own session from the driver's connection pool.
+        """
+        joined = self._match_with_triplet_index(sub_graph, cache_key)
+        if joined is not None:
+            return joined
+
+        result_scenes = []
+        scenes_info = {}
+
+        query_str, query_parameters = QueryBuilder.build_query(sub_graph, self._split)
+        with self._graph_db_driver.session() as session:
+            st = time.time()
+            results = session.run(query_str, query_parameters)
+
+            for result in results:
+                scene_id = result['scene.scene_id']
+                result_scenes.append(scene_id)
+                scenes_info[scene_id] = self.get_scene_info(result, sub_graph)
+            et = time.time()
+
+        self._cache.set(cache_key, result_scenes, scenes_info)
+        self._record_query(sub_graph.shape(), cache_key, query_str, query_parameters, et - st, len(result_scenes),
+                           'full', sub_graph)
+
+        return result_scenes, scenes_info
+
+    def _run_scene_ids_query(self, sub_graph, cache_key):
+        """
+        First phase of a two-phase query, only the scene id of each row is fetched
+        """
+        joined = self._match_with_triplet_index(sub_graph, cache_key)
+        if joined is not None:
+            # the scene infos of the second phase come from the same join
+            self._cache.set_scene_ids(cache_key, joined[0])
+            self._cache.set_scenes_info(cache_key, joined[1])
+            return joined[0]
+
+        query_str, query_parameters = QueryBuilder.build_scene_ids_query(sub_graph, self._split)
+        with self._graph_db_driver.session() as session:
+            st = time.time()
+            result_scenes = [result['scene.scene_id'] for result in session.run(query_str, query_parameters)]
+            et = time.time()
+
+        self._cache.set_scene_ids(cache_key, result_scenes)
+        self._record_query(sub_graph.shape() + " [ids]", cache_key, query_str, query_parameters, et - st,
+                           len(result_scenes), 'ids', sub_graph)
+
+        return result_scenes
+
+    def _run_scenes_info_query(self, sub_graph, cache_key, scene_ids):
+        """
+        Second phase of a two-phase query, the scene infos are fetched only for the given scenes
+        """
+        scenes_info = {}
+
+        query_str, query_parameters = QueryBuilder.build_scenes_info_query(sub_graph, self._split, scene_ids)
+        with self._graph_db_driver.session() as session:
+            st = time.time()
+            for result in session.run(query_str, query_parameters):
+                scenes_info[result['scene.scene_id']] = self.get_scene_info(result['elements'], sub_graph)
+            et = time.time()
+
+        self._cache.set_scenes_info(cache_key, scenes_info)
+        self._record_query(sub_graph.shape() + " [info]", cache_key, query_str, query_parameters, et - st,
+                           len(scenes_info), 'info', sub_graph)
+
+        return scenes_info
+
+    def _match_with_triplet_index(self, sub_graph, cache_key):
+        """
+        Answers the query from the posting lists of its triplets, if possible. The joined results are saved to the
+        cache just like the results of neo4j.
+        """
+        if not self._triplet_index or not TripletIndex.supports(sub_graph):
+            return None
+
+        st = time.time()
+        matches = self._triplet_index.match(sub_graph)
+        if matches is None:
+            return None
+        result_scenes, matched_sub_graphs = matches
+        scenes_info = {scene_id: GraphExecutor._relevant_scene_info(matched_sub_graphs[scene_id], sub_graph)
+                       for scene_id in result_scenes}
+        et = time.time()
+
+        self._cache.set(cache_key, result_scenes, scenes_info)
+        self._record_query(sub_graph.shape() + " [joined]", cache_key, None, None, et - st, len(result_scenes),
+                           'joined', sub_graph)
+
+        return result_scenes, scenes_info
+
+    def _get_scene_ids(self, sub_graph, cache_key, fetched_scene_ids):
+        if cache_key in fetched_scene_ids:
+            GraphExecutor.n_queries_executed_not_cached += 1
+            return fetched_scene_ids[cache_key]
+
+        cached = self._cache.get_scene_ids(cache_key)
+        if cached is not None:
+            GraphExecutor.n_queries_executed_cached += 1
+            return cached
+
+        GraphExecutor.n_queries_executed_not_cached += 1
+        return self._run_scene_ids_query(sub_graph, cache_key)
+
+    def _run_batch_query(self, queries: Dict[str, SubGraph], scene_ids_only=False) -> Dict:
+        """
+        Runs several queries in a single statement (see `QueryBuilder.build_batch_query`) and splits the rows by their
+        query key. If the statement fails, the queries are run one by one.
+        """
+        run_single_query = self._run_scene_ids_query if scene_ids_only else self._run_query
+        if len(queries) == 1:
+            return {cache_key: run_single_query(sub_graph, cache_key) for cache_key, sub_graph in queries.items()}
+
+        query_str, query_parameters = QueryBuilder.build_batch_query(list(queries.items()), self._split,
+                                                                     scene_ids_only)
+        try:
+            with self._graph_db_driver.session() as session:
                 st = time.time()
-                results = self._graph_db.run(query_str)
+                results = list(session.run(query_str, query_parameters))
                 et = time.time()
+        except (Neo4jError, DriverError) as e:
+            print(f"Batch of {len(queries)} queries failed, running them separately: {e}")
+            return {cache_key: run_single_query(sub_graph, cache_key) for cache_key, sub_graph in queries.items()}
+
+        result_scenes = {cache_key: [] for cache_key in queries}
+        scenes_info = {cache_key: {} for cache_key in queries}
+        for result in results:
+            cache_key, scene_id = result['query_key'], result['scene_id']
+            result_scenes[cache_key].append(scene_id)
+            if not scene_ids_only:
+                scenes_info[cache_key][scene_id] = self.get_scene_info(result['elements'], queries[cache_key])
+
+        for cache_key in queries:
+            if scene_ids_only:
+                self._cache.set_scene_ids(cache_key, result_scenes[cache_key])
+            else:
+                self._cache.set(cache_key, result_scenes[cache_key], scenes_info[cache_key])
+        self._record_query(f"batch of {len(queries)}" + (" [ids]" if scene_ids_only else ""), list(queries),
+                           query_str, query_parameters, et - st, len(results),
+                           'batch_ids' if scene_ids_only else 'batch', list(queries.values()))
+
+        if scene_ids_only:
+            return result_scenes
+        return {cache_key: (result_scenes[cache_key], scenes_info[cache_key]) for cache_key in queries}
+
+    def _record_query(self, shape, cache_key, query_str, query_parameters, latency, n_rows, kind, sub_graph):
+        if self._query_log:
+            self._query_log.write(kind, shape, cache_key, sub_graph, query_str, query_parameters, latency, n_rows)
+
+        with self._stats_lock:
+            self.query_stats.record(shape, latency, n_rows)
+
+            if query_str and self._slow_query_log_path and latency >= self._slow_query_threshold:
+                with open(self._slow_query_log_path, 'at') as f:
+                    f.write(json.dumps({
+                        'time': time.time(),
+                        'latency': round(latency, 4),
+                        'rows': n_rows,
+                        'shape': shape,
+                        'query_hash': cache_key,
+                        'query': query_str,
+                        'parameters': query_parameters
+                    }) + '\n')
+
+    def pop_query_stats(self) -> QueryStats:
+        with self._stats_lock:
+            query_stats = self.query_stats
+            self.query_stats = QueryStats()
+        return query_stats
+
+    def _fetch_uncached_queries(self, queries: List[Tuple[SubGraph, str]]) -> Dict[str, Tuple[List, Dict]]:
+        """
+        Runs all queries that are not in the cache concurrently, and returns their results keyed by the cache key
+        """
+        uncached_queries = {}
+        for sub_graph, cache_key in queries:
+            if cache_key not in uncached_queries and not self._is_random_query(sub_graph):
+                uncached_queries[cache_key] = sub_graph
+        # checked in a single round trip
+        for cache_key, exists in zip(list(uncached_queries), self._cache.exists_many(list(uncached_queries))):
+            if exists:
+                del uncached_queries[cache_key]
+
+        if len(uncached_queries) <= 1:
+            # nothing to gain from concurrency, the query will run as usual when it is needed
+            return {}
+
+        return self._run_queries(uncached_queries)
+
+    def _fetch_uncached_scene_ids(self, queries: List[Tuple[SubGraph, str]]) -> Dict[str, List]:
+        """
+        Same as `_fetch_uncached_queries`, for the first phase of two-phase queries
+        """
+        uncached_queries = {}
+        for sub_graph, cache_key in queries:
+            if cache_key not in uncached_queries:
+                uncached_queries[cache_key] = sub_graph
+        for cache_key, exists in zip(list(uncached_queries), self._cache.scene_ids_exist_many(list(uncached_queries))):
+            if exists:
+                del uncached_queries[cache_key]
 
-                # if et - st > 0.5:
-                #     print(query_str)
-                #     print("*******************************")
-                #     print(f"{(et - st):.2f}s")
+        if len(uncached_queries) <= 1:
+            return {}
 
-                for result in results:
-                    scene_id = result['scene.scene_id']
-                    result_scenes.append(scene_id)
-                    scenes_info[scene_id] = self.get_scene_info(result, sub_graph)
+        return self._run_queries(uncached_queries, scene_ids_only=True)
 
-                redis.set(query_str, json.dumps({
-                    'scenes': list(result_scenes),
-                    'scenes_info': scenes_info
-                }))
+    def _run_queries(self, queries: Dict[str, SubGraph], scene_ids_only=False) -> Dict:
+        """
+        Runs the queries concurrently, combined into statements of up to `query_batch_size` queries each
+        """
+        run_query = self._run_scene_ids_query if scene_ids_only else self._run_query
+        if self._query_batch_size <= 1:
+            return self._run_concurrently(run_query, {cache_key: (sub_graph, cache_key)
+                                                      for cache_key, sub_graph in queries.items()})
+
+        # queries that the triplet index can answer are not batched, since most of them never reach neo4j
+        single_queries = {cache_key: (sub_graph, cache_key) for cache_key, sub_graph in queries.items()
+                          if self._triplet_index and TripletIndex.supports(sub_graph)}
+        queries = [(cache_key, sub_graph) for cache_key, sub_graph in queries.items() if cache_key not in single_queries]
+        batches = {i: (dict(queries[i:i + self._query_batch_size]), scene_ids_only)
+                   for i in range(0, len(queries), self._query_batch_size)}
+        results = self._run_concurrently(run_query, single_queries)
+        for batch_results in self._run_concurrently(self._run_batch_query, batches).values():
+            results.update(batch_results)
+        return results
+
+    def _run_concurrently(self, run_query, queries: Dict[str, Tuple]) -> Dict:
+        """
+        Calls `run_query` with the arguments of each query concurrently, and returns the results by the same keys
+        """
+        if self._queries_pool is None:
+            self._queries_pool = ThreadPoolExecutor(max_workers=self._max_concurrent_queries)
 
-        return result_scenes, scenes_info
+        futures = {key: self._queries_pool.submit(run_query, *arguments) for key, arguments in queries.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+    def get_queries(self, requests: List[ExecutionRequest]) -> Dict[str, SubGraph]:
+        """
+        Returns the distinct queries that executing `requests` would send to neo4j (if not cached), as pruned
+        sub-graphs keyed by their cache key
+        """
+        queries = {}
+        for sub_graph, _, _ in requests:
+            pruned_elements = self._optimize_elements(sub_graph)
+            if not pruned_elements or self._is_random_query(pruned_elements):
+                continue
+            queries.setdefault(self._cache.key(pruned_elements), pruned_elements)
+        return queries
+
+    def fill_cache(self, queries: Dict[str, SubGraph]):
+        """
+        Runs the given queries concurrently and saves their results to the cache, without checking whether they are
+        already cached
+        """
+        self._run_queries(queries)
 
     @staticmethod
     def get_scene_info(result, original_sub_graph: SubGraph):
-        result_sub_graph = neo4j_results_to_sub_graph(result)
+        return GraphExecutor._relevant_scene_info(neo4j_results_to_sub_graph(result), original_sub_graph)
 
+    @staticmethod
+    def _relevant_scene_info(result_sub_graph: SubGraph, original_sub_graph: SubGraph):
         # keep only relevant attributes
         relevant_attributes_per_element = defaultdict(set)
         for node in original_sub_graph:
@@ -111,18 +417,130 @@ class GraphExecutor:
             filter_out: FilterOutSubGraphs = None,
             query_key=None
     ) -> Tuple[List, Dict]:
-        pruned_elements = self._optimize_elements(sub_graph)
+        return self.execute_many([(sub_graph, filter_out, query_key)])[0]
 
-        if not pruned_elements:
-            return set(), {}
+    def execute_many(self, requests: List[ExecutionRequest]) -> List[Tuple[List, Dict]]:
+        """
+        Executes multiple (sub_graph, filter_out, query_key) requests. Requests are deduplicated by the canonical form
+        of their pruned sub-graph, so each distinct query is executed once and its results are shared by all requests
+        (each with its own filter_out). Queries that are not cached are sent to neo4j concurrently, but results are
+        processed in the order of the requests, so the output (including any random sampling) is identical to
+        executing the requests one after the other.
+
+        With `sample_first`, requests that are filtered (and sampled) are executed in two phases, unless the full
+        results of their query are needed by another request or are already cached.
+        """
+        pruned_requests = []
+        for sub_graph, filter_out, query_key in requests:
+            pruned_elements = self._optimize_elements(sub_graph)
+            cache_key = self._cache.key(pruned_elements) if pruned_elements else None
+            pruned_requests.append((pruned_elements, cache_key, filter_out, query_key))
+
+        two_phase_keys = self._get_two_phase_keys(pruned_requests) if self._sample_first else set()
+
+        fetched_results = {}
+        fetched_scene_ids = {}
+        if self._max_concurrent_queries > 1 or self._query_batch_size > 1:
+            fetched_results = self._fetch_uncached_queries(
+                [(pruned_elements, cache_key) for pruned_elements, cache_key, _, _ in pruned_requests
+                 if cache_key and cache_key not in self._scene_results and cache_key not in two_phase_keys]
+            )
+            fetched_scene_ids = self._fetch_uncached_scene_ids(
+                [(pruned_elements, cache_key) for pruned_elements, cache_key, _, _ in pruned_requests
+                 if cache_key in two_phase_keys and cache_key not in self._scene_ids_results]
+            )
+
+        outputs = []
+        two_phase_requests = []
+        for pruned_elements, cache_key, filter_out, query_key in pruned_requests:
+            if not pruned_elements:
+                outputs.append((set(), {}))
+                continue
+
+            if self._is_random_query(pruned_elements):
+                # these are sampled at random on each execution, so they are not shared
+                result_scenes, scenes_info = self._execute_query(pruned_elements, cache_key, fetched_results)
+            elif cache_key in two_phase_keys:
+                if cache_key in self._scene_ids_results:
+                    self.query_stats.record_saved_execution(self._scene_key)
+                else:
+                    self._scene_ids_results[cache_key] = self._get_scene_ids(pruned_elements, cache_key,
+                                                                             fetched_scene_ids)
+                output_scenes = self._sample_filtered_scenes(list(self._scene_ids_results[cache_key]), filter_out)
+
+                # scene infos are added once the scenes of all requests are known, so they can be fetched together
+                two_phase_requests.append((len(outputs), pruned_elements, cache_key))
+                outputs.append((output_scenes, None))
+                continue
+            else:
+                if cache_key in self._scene_results:
+                    self.query_stats.record_saved_execution(self._scene_key)
+                else:
+                    self._scene_results[cache_key] = self._execute_query(pruned_elements, cache_key,
+                                                                         fetched_results)
+                result_scenes, scenes_info = self._scene_results[cache_key]
+                result_scenes, scenes_info = list(result_scenes), dict(scenes_info)
 
-        query_str = QueryBuilder.build_query(pruned_elements, self._split)
-        result_scenes, scenes_info = self._execute_query_str(query_str, pruned_elements)
+            if filter_out:
+                result_scenes, scenes_info = self._filter_results(result_scenes, scenes_info, filter_out, query_key)
 
-        if filter_out:
-            result_scenes, scenes_info = self._filter_results(result_scenes, scenes_info, filter_out, query_key)
+            outputs.append((result_scenes, scenes_info))
 
-        return result_scenes, scenes_info
+        if two_phase_requests:
+            self._add_scenes_info(outputs, two_phase_requests)
+
+        return outputs
+
+    def _get_two_phase_keys(self, pruned_requests) -> Set[str]:
+        """
+        Returns the cache keys of queries whose results are only needed to be filtered and sampled
+        """
+        full_keys = set(self._scene_results)
+        filtered_keys = set()
+        for pruned_elements, cache_key, filter_out, _ in pruned_requests:
+            if not pruned_elements or self._is_random_query(pruned_elements):
+                continue
+            if filter_out:
+                filtered_keys.add(cache_key)
+            else:
+                full_keys.add(cache_key)
+
+        # reading cached full results is cheap, so these are not executed again in two phases
+        return {cache_key for cache_key in filtered_keys - full_keys
+                if cache_key in self._scene_ids_results or not self._cache.exists(cache_key)}
+
+    def _add_scenes_info(self, outputs, two_phase_requests):
+        """
+        Second phase of two-phase requests, fetches the scene infos of the sampled scenes (from the cache, or from
+        neo4j with a single query for each distinct query)
+        """
+        sub_graphs = {}
+        requested_scenes = defaultdict(set)
+        for index, sub_graph, cache_key in two_phase_requests:
+            sub_graphs[cache_key] = sub_graph
+            requested_scenes[cache_key].update(outputs[index][0])
+
+        queries = {}
+        for cache_key, scenes in requested_scenes.items():
+            scenes_info = self._scenes_info_results.setdefault(cache_key, {})
+            missing_scenes = sorted(scenes - scenes_info.keys())
+            scenes_info.update(self._cache.get_scenes_info(cache_key, missing_scenes))
+            missing_scenes = [scene for scene in missing_scenes if scene not in scenes_info]
+            if missing_scenes:
+                queries[cache_key] = (sub_graphs[cache_key], cache_key, missing_scenes)
+
+        if self._max_concurrent_queries > 1 and len(queries) > 1:
+            fetched_scenes_info = self._run_concurrently(self._run_scenes_info_query, queries)
+        else:
+            fetched_scenes_info = {cache_key: self._run_scenes_info_query(*arguments)
+                                   for cache_key, arguments in queries.items()}
+        for cache_key, scenes_info in fetched_scenes_info.items():
+            self._scenes_info_results[cache_key].update(scenes_info)
+
+        for index, _, cache_key in two_phase_requests:
+            output_scenes = outputs[index][0]
+            scenes_info = self._scenes_info_results[cache_key]
+            outputs[index] = (output_scenes, {scene: scenes_info.get(scene, {}) for scene in output_scenes})
 
     def _optimize_elements(self, sub_graph: SubGraph):
         if not sub_graph:
@@ -185,7 +603,9 @@ class GraphExecutor:
     def _prune_triplet(self, subject_names, relation_names, object_names, subject_attributes, object_attributes):
         key = (frozenset(subject_names), frozenset(relation_names), frozenset(object_names), frozenset(subject_attributes), frozenset(object_attributes))
         if key in self._pruning_cache:
-            return self._pruning_cache[key]
+            self.pruning_stats.hits += 1
+            return self._pruning_cache.get(key)
+        self.pruning_stats.misses += 1
 
         output = {
             'pruned_subject_attributes': set([]),
@@ -230,12 +650,45 @@ class GraphExecutor:
         if not at_least_one_triple_exists:
             output = None
 
-        self._pruning_cache[key] = output
+        self._pruning_cache.set(key, output)
+        if self._pruning_cache_path:
+            self.pruning_stats.new_entries[key] = output
         return output
 
+    def pop_pruning_stats(self) -> PruningCacheStats:
+        pruning_stats = self.pruning_stats
+        self.pruning_stats = PruningCacheStats()
+        return pruning_stats
+
+    def _load_pruning_cache(self):
+        if not os.path.exists(self._pruning_cache_path):
+            return
+        with open(self._pruning_cache_path, 'rb') as f:
+            saved = pickle.load(f)
+        if saved['split'] != self._split or saved.get('namespace') != self._cache.namespace:
+            print(f"Ignoring pruning cache of {saved.get('namespace', saved['split'])}: {self._pruning_cache_path}")
+            return
+        for key, output in saved['entries']:
+            self._pruning_cache.set(key, output)
+        print(f"Loaded {len(self._pruning_cache)} pruning cache entries from {self._pruning_cache_path}")
+
+    def save_pruning_cache(self, new_entries: Dict = None):
+        """
+        Saves the pruning cache, along with entries that were computed by other processes
+        """
+        if not self._pruning_cache_path:
+            return
+        for key, output in (new_entries or {}).items():
+            self._pruning_cache.set(key, output)
+        with open(self._pruning_cache_path, 'wb') as f:
+            pickle.dump({'split': self._split, 'namespace': self._cache.namespace,
+                         'entries': self._pruning_cache.items()}, f)
+
     def starting_new_scene(self, scene_key):
-        # clear out the cache to save memory, since cache is mostly useful only withing the same scene
-        self._pruning_cache = {}
+        self._scene_key = scene_key
+        self._scene_results = {}
+        self._scene_ids_results = {}
+        self._scenes_info_results = {}
 
         # set random seed here based on the scene key, to keep consistency between processes
         self._random.seed(scene_key)
@@ -252,18 +705,25 @@ class GraphExecutor:
         """
         if not filter_out_graph:
             return result_scenes, scenes_info
+
+        output_scenes = self._sample_filtered_scenes(result_scenes, filter_out_graph)
+        output_scenes_info = {s: scenes_info[s] for s in output_scenes}
+
+        return output_scenes, output_scenes_info
+
+    def _sample_filtered_scenes(self, result_scenes, filter_out_graph) -> Set:
         if type(filter_out_graph) is list:
             assert(len(filter_out_graph) == 1)
             filter_out_graph = filter_out_graph[0]
 
-        # first filter out using graph
-        candidate_output_scenes = []
-        for scene in result_scenes:
-            formatted_scene = self._scene_reader.get_formatted_scenes(scene)
-            if self._filter_using_scene(filter_out_graph, formatted_scene):
-                continue
-
-            candidate_output_scenes.append(scene)
+        # first filter out using graph. The program is compiled once and checked against the index of each scene,
+        # which is equivalent to running it on the scene
+        filter_program = CompiledRefProgram(self._get_filter_program(filter_out_graph))
+        distinct_scenes = list(dict.fromkeys(result_scenes))
+        is_filtered = dict(zip(distinct_scenes, filter_program.exists_in_scenes(
+            [self._scene_reader.get_scene_index(scene) for scene in distinct_scenes]
+        )))
+        candidate_output_scenes = [scene for scene in result_scenes if not is_filtered[scene]]
 
         self._random.seed(str(result_scenes))
         candidate_output_scenes = self._random.sample(candidate_output_scenes, k=min(self._limit_scenes_output, len(candidate_output_scenes)))
@@ -271,14 +731,11 @@ class GraphExecutor:
 
         # verification against lxmert should be here (code not available yet)
 
-        output_scenes_info = {s: scenes_info[s] for s in output_scenes}
-
-        return output_scenes, output_scenes_info
+        return output_scenes
 
-    def _filter_using_scene(self, sub_graph, formatted_scene):
-        program = sub_graph_root_to_ref_program(sub_graph.root)
-        program.append({'operation': 'exists', 'dependencies': [len(program) - 1]})
-        return self._executor.run(program, formatted_scene['objects'])
+    @staticmethod
+    def _get_filter_program(sub_graph):
+        return sub_graph_root_to_ref_program(sub_graph.root)
 
     @staticmethod
     def _serialize_filter_out(filter_out: FilterOutSubGraphs):
@@ -1,42 +1,45 @@
+from copy import deepcopy
+from typing import Dict, List, Tuple
+
+from generator.queries.data_classes import QueryNode
 from generator.queries.sub_graph import SubGraph
 from generator.utils import extract_all_root_to_leaves_paths, extract_flattened_elements
 
 
 class QueryBuilder:
+    # match splits and attributes with labels instead of properties, see `scripts/index_neo4j.py`
+    use_split_labels = False
+    use_attribute_labels = False
+
     @staticmethod
-    def _build_match_query(where: SubGraph, split, prefix=""):
-        if where.multi_count and where.multi_count > 1:
-            # limiting due to performance issues with this query
-            where.multi_count = min(where.multi_count, 2)
-            repeat = where.multi_count
-            cypher_query_str = ""
-            where_elements = []
-            for i in range(repeat):
-                prefix_i = prefix if i == 0 else f"multi_{i}_{prefix}"
-                cypher_query_str_i, where_elements_i = QueryBuilder.build_match_clause(where, prefix_symbol=prefix_i)
-                cypher_query_str += cypher_query_str_i + "\n"
-                where_elements += where_elements_i
-                if i > 0:
-                    where_elements.append(f"{where[0].char_symbol} <> "
-                                          f"multi_{i}_{where[0].char_symbol}")
-        else:
-            cypher_query_str, where_elements = QueryBuilder.build_match_clause(where, prefix, prefix)
+    def _build_match_query(where: SubGraph, parameters: Dict, prefix="", extra_where_elements: List[str] = ()):
+        cypher_query_str, where_elements = QueryBuilder.build_match_clause(where, parameters, prefix, prefix)
+        where_elements = where_elements + list(extra_where_elements)
 
-        cypher_query_str += f" WHERE {prefix}scene.split = '{split}' "
+        if QueryBuilder.use_split_labels:
+            # the split is already part of the scene label
+            if where_elements:
+                cypher_query_str += " WHERE (" + " AND ".join(where_elements) + ") "
+            return cypher_query_str
+
+        cypher_query_str += f" WHERE {prefix}scene.split = $split "
         if where_elements:
             cypher_query_str += " AND (" + " AND ".join(where_elements) + ") "
 
         return cypher_query_str
 
     @staticmethod
-    def build_match_clause(sub_graph, prefix_scene="", prefix_symbol=""):
+    def build_match_clause(sub_graph, parameters: Dict, prefix_scene="", prefix_symbol=""):
         paths_to_match = extract_all_root_to_leaves_paths(sub_graph.root)
         cypher_query_matches = []
         where_elements = set()
+        scene_label = QueryBuilder.split_label(parameters['split']) if QueryBuilder.use_split_labels else "Scene"
         for path in paths_to_match:
-            match_str = f'MATCH ({prefix_scene}scene:Scene)-[{prefix_symbol}r:IN]-'
+            match_str = f'MATCH ({prefix_scene}scene:{scene_label})-[{prefix_symbol}r:IN]-'
             for i, query_element in enumerate(path):
-                node_query_str, node_where_elements = query_element.as_cyhper_element(char_symbol_prefix=prefix_symbol)
+                node_query_str, node_where_elements = query_element.as_cyhper_element(
+                    parameters, char_symbol_prefix=prefix_symbol, attribute_labels=QueryBuilder.use_attribute_labels
+                )
                 match_str += node_query_str
                 if i < len(path) - 1:
                     match_str += query_element.get_trailing_symbol()
@@ -53,12 +56,144 @@ class QueryBuilder:
         return cypher_query_str, sorted(list(where_elements))
 
     @staticmethod
-    def build_query(sub_graph, split):
-        positive_match = QueryBuilder._build_match_query(sub_graph, split)
+    def _is_multi_instances(sub_graph: SubGraph) -> bool:
+        return sub_graph.n_instances() > 1
+
+    @staticmethod
+    def _build_multi_instances_aggregation(sub_graph: SubGraph, parameters: Dict, returned_elements_str=None) -> str:
+        """
+        Keeps only scenes where at least `multi_count` distinct objects match the root of the sub-graph (each with its
+        own match of the rest of the sub-graph), with the elements of one arbitrary match of each scene as `elements`.
+        This replaces matching the whole pattern `multi_count` times in each scene, which is too slow for more than two
+        instances.
+        """
+        root_symbol = sub_graph[0].char_symbol
+        parameters[f'multi_count_{root_symbol}'] = sub_graph.n_instances()
+        aggregations = f"count(DISTINCT {root_symbol}) AS n_instances"
+        if returned_elements_str:
+            aggregations += f", head(collect([{returned_elements_str}])) AS elements"
+        return f" WITH scene, {aggregations} WHERE n_instances >= $multi_count_{root_symbol} "
+
+    @staticmethod
+    def split_label(split):
+        # e.g. `TrainScene`, allows matching scenes of a split by label instead of filtering a property
+        return f"{split.capitalize()}Scene"
+
+    @staticmethod
+    def _with_canonical_symbols(sub_graph: SubGraph, prefix="") -> SubGraph:
+        # symbols are derived from object ids in the scene, so they are replaced by the position of each element in the
+        # sub-graph to keep the query text identical for sub-graphs with the same structure
+        sub_graph = deepcopy(sub_graph)
+        for i, element in enumerate(sub_graph):
+            element.char_symbol = f"{prefix}n{i}" if type(element) is QueryNode else f"{prefix}r{i}"
+        return sub_graph
+
+    @staticmethod
+    def build_query(sub_graph, split) -> Tuple[str, Dict]:
+        """
+        Returns the query text and its parameters separately. Only the structure of the sub-graph (and relation types,
+        which can not be parameterized) is part of the text, while names, attributes and the split are parameters.
+        """
+        sub_graph = QueryBuilder._with_canonical_symbols(sub_graph)
+        parameters = {'split': split}
+
+        positive_match = QueryBuilder._build_match_query(sub_graph, parameters)
 
         cypher_query_str = positive_match + "\n\n"
 
-        returned_elements_str = ', '.join([n.char_symbol for n in extract_flattened_elements(sub_graph.root)])
+        returned_elements = [n.char_symbol for n in extract_flattened_elements(sub_graph.root)]
+        returned_elements_str = ', '.join(returned_elements)
+        if QueryBuilder._is_multi_instances(sub_graph):
+            cypher_query_str += QueryBuilder._build_multi_instances_aggregation(sub_graph, parameters,
+                                                                               returned_elements_str)
+            # the elements are returned in the same columns as in a single instance query
+            returned_elements_str = ', '.join(f"elements[{i}] AS {symbol}" for i, symbol in enumerate(returned_elements))
         cypher_query_str += f" RETURN {returned_elements_str}, scene.scene_id LIMIT 500"
 
-        return cypher_query_str
+        return cypher_query_str, parameters
+
+    @staticmethod
+    def build_scene_ids_query(sub_graph, split) -> Tuple[str, Dict]:
+        """
+        Same as `build_query`, but returns only the scene id of each row
+        """
+        sub_graph = QueryBuilder._with_canonical_symbols(sub_graph)
+        parameters = {'split': split}
+
+        cypher_query_str = QueryBuilder._build_match_query(sub_graph, parameters) + "\n\n"
+        if QueryBuilder._is_multi_instances(sub_graph):
+            cypher_query_str += QueryBuilder._build_multi_instances_aggregation(sub_graph, parameters)
+        cypher_query_str += " RETURN scene.scene_id LIMIT 500"
+
+        return cypher_query_str, parameters
+
+    @staticmethod
+    def build_scenes_info_query(sub_graph, split, scene_ids: List[str]) -> Tuple[str, Dict]:
+        """
+        Returns the elements of a single match of the sub-graph (as a list, under `elements`) for each of the given
+        scenes
+        """
+        sub_graph = QueryBuilder._with_canonical_symbols(sub_graph)
+        parameters = {'split': split, 'scene_ids': list(scene_ids)}
+
+        cypher_query_str = QueryBuilder._build_match_query(
+            sub_graph, parameters, extra_where_elements=["scene.scene_id IN $scene_ids"]
+        ) + "\n\n"
+
+        returned_elements_str = ', '.join([n.char_symbol for n in extract_flattened_elements(sub_graph.root)])
+        if QueryBuilder._is_multi_instances(sub_graph):
+            cypher_query_str += QueryBuilder._build_multi_instances_aggregation(sub_graph, parameters,
+                                                                               returned_elements_str)
+            cypher_query_str += " RETURN scene.scene_id, elements"
+        else:
+            cypher_query_str += f" RETURN scene.scene_id, head(collect([{returned_elements_str}])) AS elements"
+
+        return cypher_query_str, parameters
+
+    @staticmethod
+    def build_batch_query(queries: List[Tuple[str, SubGraph]], split, scene_ids_only=False) -> Tuple[str, Dict]:
+        """
+        Combines several (query_key, sub_graph) queries into a single statement with `UNION ALL`, each part limited
+        to 500 rows as in `build_query`. Rows hold the key of their query (`query_key`), the `scene_id` and, unless
+        `scene_ids_only`, the matched elements as a list (`elements`). Symbols, and therefore parameters, of each query
+        are prefixed by its position in the batch.
+        """
+        parameters = {'split': split}
+        query_parts = []
+        for i, (query_key, sub_graph) in enumerate(queries):
+            sub_graph = QueryBuilder._with_canonical_symbols(sub_graph, prefix=f"q{i}_")
+            parameters[f'key_q{i}'] = query_key
+
+            query_part = QueryBuilder._build_match_query(sub_graph, parameters) + "\n"
+            returned_str = f"$key_q{i} AS query_key, scene.scene_id AS scene_id"
+            returned_elements_str = None if scene_ids_only else \
+                ', '.join([n.char_symbol for n in extract_flattened_elements(sub_graph.root)])
+            if QueryBuilder._is_multi_instances(sub_graph):
+                query_part += QueryBuilder._build_multi_instances_aggregation(sub_graph, parameters,
+                                                                             returned_elements_str)
+                if returned_elements_str:
+                    returned_str += ", elements"
+            elif returned_elements_str:
+                returned_str += f", [{returned_elements_str}] AS elements"
+            query_parts.append(query_part + f" RETURN {returned_str} LIMIT 500")
+
+        return "\nUNION ALL\n".join(query_parts), parameters
+
+    @staticmethod
+    def build_triplet_query(triplet: SubGraph, split, limit: int) -> Tuple[str, Dict]:
+        """
+        Returns every (subject, relation, object) match of a single triplet, with the internal id, name and
+        attributes of both objects. See `TripletIndex`.
+        """
+        triplet = QueryBuilder._with_canonical_symbols(triplet)
+        parameters = {'split': split, 'limit': limit}
+
+        subject, relation, obj = (element.char_symbol for element in triplet)
+        cypher_query_str = QueryBuilder._build_match_query(triplet, parameters) + "\n\n"
+        cypher_query_str += (f" RETURN scene.scene_id AS scene_id, type({relation}) AS relation, "
+                             f"id({subject}) AS subject_id, {subject}.name AS subject_name, "
+                             f"{subject}.attributes AS subject_attributes, "
+                             f"id({obj}) AS object_id, {obj}.name AS object_name, {obj}.attributes AS object_attributes "
+                             f"LIMIT $limit")
+
+        return cypher_query_str, parameters
@@ -0,0 +1,99 @@
+import json
+import threading
+import time
+from typing import Dict, Iterator, List, Union
+
+from generator.queries.data_classes import QueryNode, QueryRelationship
+from generator.queries.sub_graph import SubGraph
+
+
+class QueryLog:
+    """
+    Appends every query executed by `GraphExecutor` to a JSON lines file: its kind (`full`, `ids` and `info` for the
+    phases of two-phase queries, `batch`, `batch_ids`, `triplet` for posting lists of `TripletIndex` and `joined` for
+    queries answered by it), the sub-graph (a list of sub-graphs for batches), the cache key, the query text and
+    parameters, the number of rows and the latency. The log can be replayed with `scripts/replay_queries.py`.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+
+    def write(self, kind: str, shape: str, cache_key: Union[str, List[str]], sub_graph: Union[SubGraph, List],
+              query_str: str, query_parameters: Dict, latency: float, n_rows: int):
+        if type(sub_graph) is list:
+            serialized_sub_graph = [QueryLog.sub_graph_to_json(g) for g in sub_graph]
+        else:
+            serialized_sub_graph = QueryLog.sub_graph_to_json(sub_graph)
+        line = json.dumps({
+            'time': time.time(),
+            'kind': kind,
+            'shape': shape,
+            'key': cache_key,
+            'sub_graph': serialized_sub_graph,
+            'query': query_str,
+            'parameters': query_parameters,
+            'rows': n_rows,
+            'latency': round(latency, 6)
+        })
+        # worker processes append to the same file, each line is written at once
+        with self._lock:
+            with open(self._path, 'at') as f:
+                f.write(line + '\n')
+
+    @staticmethod
+    def read(path: str) -> Iterator[Dict]:
+        with open(path, 'rt') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    @staticmethod
+    def sub_graph_to_json(sub_graph: SubGraph) -> Dict:
+        def _names(names):
+            if not names or type(names) is str:
+                return names or None
+            return sorted(names)
+
+        def _node(node):
+            output = {'name': _names(node.name), 'attributes': sorted(node.attributes or [])}
+            if node.relations:
+                output['relations'] = [_relation(relation) for relation in node.relations]
+            return output
+
+        def _relation(relation):
+            output = {'name': _names(relation.name), 'target': _node(relation.target)}
+            if relation.prepositions:
+                output['prepositions'] = [_relation(pp) for pp in relation.prepositions]
+            return output
+
+        return {'root': _node(sub_graph.root), 'multi_count': sub_graph.multi_count}
+
+    @staticmethod
+    def sub_graph_from_json(data: Dict) -> SubGraph:
+        """
+        Reconstructs a sub-graph written by `sub_graph_to_json`. Parallel elements are not kept in the log.
+        """
+        symbols = iter(range(1000))
+
+        def _names(names):
+            return set(names) if type(names) is list else names
+
+        def _node(node_data):
+            node = QueryNode(char_symbol=f"n{next(symbols)}", name=_names(node_data['name']),
+                             attributes=set(node_data['attributes']), relations=[])
+            for relation_data in node_data.get('relations', []):
+                relation = _relation(relation_data, node)
+                node.relations.append(relation)
+                relation.prepositions = [_relation(pp_data, node)
+                                         for pp_data in relation_data.get('prepositions', [])] or None
+            return node
+
+        def _relation(relation_data, source):
+            relation = QueryRelationship(char_symbol=f"r{next(symbols)}", name=_names(relation_data['name']),
+                                         source=source)
+            relation.target = _node(relation_data['target'])
+            relation.target.backward_relation = relation
+            return relation
+
+        return SubGraph(_node(data['root']), multi_count=data['multi_count'])
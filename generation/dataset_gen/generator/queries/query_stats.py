@@ -0,0 +1,101 @@
+import bisect
+from collections import Counter
+
+
+class QueryStats:
+    """
+    Aggregates latencies of graph queries that were sent to neo4j, per sub-graph shape (see `SubGraph.shape`), and
+    the number of query executions saved by deduplication in each scene.
+    Stats are collected separately by each worker process and merged by the main process.
+    """
+    BUCKETS_MS = [5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+    def __init__(self):
+        self.histograms = {}
+        self.counts = Counter()
+        self.total_latency = Counter()
+        self.max_latency = Counter()
+        self.total_rows = Counter()
+        self.saved_executions_per_scene = Counter()
+
+    def record(self, shape: str, latency: float, n_rows: int):
+        if shape not in self.histograms:
+            self.histograms[shape] = [0] * (len(QueryStats.BUCKETS_MS) + 1)
+        self.histograms[shape][bisect.bisect_left(QueryStats.BUCKETS_MS, latency * 1000)] += 1
+        self.counts[shape] += 1
+        self.total_latency[shape] += latency
+        self.max_latency[shape] = max(self.max_latency[shape], latency)
+        self.total_rows[shape] += n_rows
+
+    def record_saved_execution(self, scene_key: str):
+        self.saved_executions_per_scene[scene_key] += 1
+
+    def merge(self, other: 'QueryStats'):
+        for shape, histogram in other.histograms.items():
+            if shape not in self.histograms:
+                self.histograms[shape] = [0] * len(histogram)
+            self.histograms[shape] = [a + b for a, b in zip(self.histograms[shape], histogram)]
+        self.counts.update(other.counts)
+        self.total_latency.update(other.total_latency)
+        self.total_rows.update(other.total_rows)
+        self.saved_executions_per_scene.update(other.saved_executions_per_scene)
+        for shape, latency in other.max_latency.items():
+            self.max_latency[shape] = max(self.max_latency[shape], latency)
+
+    def percentile(self, shape: str, q: float) -> float:
+        """
+        Estimates a percentile (in seconds) from the histogram, as the upper bound of the bucket that contains it
+        """
+        histogram = self.histograms[shape]
+        threshold = q * self.counts[shape]
+        cumulative = 0
+        for i, count in enumerate(histogram):
+            cumulative += count
+            if cumulative >= threshold:
+                return QueryStats.BUCKETS_MS[i] / 1000 if i < len(QueryStats.BUCKETS_MS) else self.max_latency[shape]
+        return self.max_latency[shape]
+
+    def print_saved_executions(self, n_scenes: int):
+        total_saved = sum(self.saved_executions_per_scene.values())
+        max_saved = max(self.saved_executions_per_scene.values(), default=0)
+        print(f"Query executions saved by deduplication: {total_saved} "
+              f"(mean per scene: {total_saved / max(n_scenes, 1):.1f}, max: {max_saved})")
+
+    def print_histograms(self):
+        if not self.counts:
+            return
+        bucket_names = [f"<{b}ms" for b in QueryStats.BUCKETS_MS] + [f">{QueryStats.BUCKETS_MS[-1]}ms"]
+        shape_width = max(len("shape"), max(len(shape) for shape in self.counts))
+        print("Latency of neo4j queries per sub-graph shape (sorted by total time):")
+        print(f"{'shape':<{shape_width}} {'count':>7} {'total':>9} {'mean':>8} {'p50':>8} {'p95':>8} {'max':>8} "
+              f"{'rows':>7} " + " ".join(f"{b:>7}" for b in bucket_names))
+        for shape, total in self.total_latency.most_common():
+            count = self.counts[shape]
+            print(f"{shape:<{shape_width}} {count:>7} {total:>8.1f}s {total / count:>7.3f}s "
+                  f"{self.percentile(shape, 0.5):>7.3f}s {self.percentile(shape, 0.95):>7.3f}s "
+                  f"{self.max_latency[shape]:>7.3f}s {self.total_rows[shape] / count:>7.1f} " +
+                  " ".join(f"{c:>7}" for c in self.histograms[shape]))
+
+
+class PruningCacheStats:
+    """
+    Hits and misses of the triplet pruning cache of `GraphExecutor`. When the cache is persisted, the entries that
+    were computed by a worker are passed along, so the main process can save them.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.new_entries = {}
+
+    def merge(self, other: 'PruningCacheStats'):
+        self.hits += other.hits
+        self.misses += other.misses
+        self.new_entries.update(other.new_entries)
+
+    def hit_ratio(self) -> float:
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def print_summary(self):
+        print(f"Pruning cache hit ratio: {self.hit_ratio():.1%} "
+              f"(hits: {self.hits}, misses: {self.misses})")
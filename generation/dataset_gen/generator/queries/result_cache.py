@@ -0,0 +1,143 @@
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+import zstandard
+from srsly import msgpack
+
+from generator.queries.sub_graph import SubGraph
+from generator.redis import redis
+
+
+class ResultCache:
+    """
+    Caches results of graph queries in redis.
+
+    Keys are a hash of the canonical form of the (pruned) sub-graph and the split, so they do not depend on symbol
+    names or on the order of elements in the query. Values are msgpack-encoded and zstd-compressed, with all strings
+    interned into a single table and scene infos stored as nested lists rather than dictionaries.
+
+    Keys are prefixed by a namespace (see `CacheNamespace`), which is only the split for caches that are not versioned.
+    """
+    KEY_PREFIX = "q"
+    PAYLOAD_VERSION = 1
+
+    def __init__(self, split: str, enabled: bool = True, namespace: str = None):
+        self._split = split
+        self._enabled = enabled
+        self.namespace = namespace or split
+
+    def key(self, sub_graph: SubGraph) -> str:
+        return self.key_for_canonical(sub_graph.canonical())
+
+    def key_for_canonical(self, canonical) -> str:
+        digest = hashlib.sha1(repr(canonical).encode('utf-8')).hexdigest()
+        return f"{ResultCache.KEY_PREFIX}:{self.namespace}:{digest}"
+
+    def get(self, key: str) -> Optional[Tuple[List, Dict]]:
+        if not self._enabled:
+            return None
+        payload = redis.get(key)
+        if not payload:
+            return None
+        return ResultCache.decode(payload)
+
+    def exists(self, key: str) -> bool:
+        return self._enabled and bool(redis.exists(key))
+
+    def exists_many(self, keys: List[str]) -> List[bool]:
+        if not self._enabled:
+            return [False] * len(keys)
+        pipeline = redis.pipeline(transaction=False)
+        for key in keys:
+            pipeline.exists(key)
+        return [bool(exists) for exists in pipeline.execute()]
+
+    def set(self, key: str, result_scenes: List, scenes_info: Dict):
+        redis.set(key, ResultCache.encode(result_scenes, scenes_info))
+
+    # scene ids and scene infos of queries executed in two phases (see `GraphExecutor`) are stored separately from the
+    # full results, with the scene infos in a hash so that they can be added for any subset of the scenes
+
+    def get_scene_ids(self, key: str) -> Optional[List]:
+        if not self._enabled:
+            return None
+        payload = redis.get(f"{key}:ids")
+        if not payload:
+            return None
+        return ResultCache.decode(payload)[0]
+
+    def scene_ids_exist_many(self, keys: List[str]) -> List[bool]:
+        return self.exists_many([f"{key}:ids" for key in keys])
+
+    def set_scene_ids(self, key: str, result_scenes: List):
+        redis.set(f"{key}:ids", ResultCache.encode(result_scenes, {}))
+
+    def get_scenes_info(self, key: str, scene_ids: List) -> Dict:
+        if not self._enabled or not scene_ids:
+            return {}
+        payloads = redis.hmget(f"{key}:info", scene_ids)
+        scenes_info = {}
+        for payload in payloads:
+            if payload:
+                scenes_info.update(ResultCache.decode(payload)[1])
+        return scenes_info
+
+    def set_scenes_info(self, key: str, scenes_info: Dict):
+        if not scenes_info:
+            return
+        redis.hset(f"{key}:info", mapping={scene: ResultCache.encode([], {scene: info})
+                                           for scene, info in scenes_info.items()})
+
+    @staticmethod
+    def encode(result_scenes: List, scenes_info: Dict) -> bytes:
+        strings = {}
+
+        def _intern(string):
+            if string is None:
+                return -1
+            if string not in strings:
+                strings[string] = len(strings)
+            return strings[string]
+
+        def _encode_node(node):
+            relations = []
+            for relation in node.get('relations', []):
+                prepositions = [[_intern(pp['name']), _encode_node(pp['target'])]
+                                for pp in relation.get('prepositions', [])]
+                relations.append([_intern(relation['name']), _encode_node(relation['target']),
+                                  prepositions if 'prepositions' in relation else None])
+            attributes = [_intern(attr) for attr in node['attributes']] if node['attributes'] is not None else None
+            return [_intern(node['name']), attributes, relations if 'relations' in node else None]
+
+        encoded_scenes = [_intern(scene) for scene in result_scenes]
+        encoded_infos = [[_intern(scene), _encode_node(info) if info else None] for scene, info in scenes_info.items()]
+
+        packed = msgpack.dumps([ResultCache.PAYLOAD_VERSION, list(strings), encoded_scenes, encoded_infos])
+        return zstandard.ZstdCompressor(level=3).compress(packed)
+
+    @staticmethod
+    def decode(payload: bytes) -> Tuple[List, Dict]:
+        version, strings, encoded_scenes, encoded_infos = msgpack.loads(
+            zstandard.ZstdDecompressor().decompress(payload), raw=False
+        )
+        assert version == ResultCache.PAYLOAD_VERSION
+
+        def _string(index):
+            return strings[index] if index >= 0 else None
+
+        def _decode_node(encoded_node):
+            name, attributes, relations = encoded_node
+            node = {"name": _string(name),
+                    "attributes": [strings[attr] for attr in attributes] if attributes is not None else None}
+            if relations is not None:
+                node["relations"] = []
+                for relation_name, target, prepositions in relations:
+                    node["relations"].append({"name": _string(relation_name), "target": _decode_node(target)})
+                    if prepositions is not None:
+                        node["relations"][-1]["prepositions"] = [{"name": _string(pp_name), "target": _decode_node(pp)}
+                                                                 for pp_name, pp in prepositions]
+            return node
+
+        result_scenes = [strings[scene] for scene in encoded_scenes]
+        scenes_info = {strings[scene]: _decode_node(info) if info else {} for scene, info in encoded_infos}
+        return result_scenes, scenes_info
@@ -122,3 +122,53 @@ class SubGraph:
         serialized_elements = [elm.serialize() for elm in self]
         return tuple(serialized_elements)
 
+    def n_instances(self) -> int:
+        """
+        The number of distinct instances of the sub-graph that its queries match in each scene (see `QueryBuilder`)
+        """
+        return self.multi_count if self.multi_count and self.multi_count > 1 else 1
+
+    def canonical(self):
+        """
+        Returns a hashable representation of the sub-graph that does not depend on symbol names, nor on the order of
+        names and attributes. Sub-graphs that translate to semantically identical queries are equal. Relations keep
+        their order, since the scene infos of cached results list the matched elements in the order of the sub-graph.
+        """
+        def _names(names):
+            if not names:
+                return ()
+            if type(names) is str:
+                return (names,)
+            return tuple(sorted(names))
+
+        def _node(node):
+            if node is None:
+                return ()
+            relations = tuple(_relation(relation) for relation in node.relations or [])
+            return _names(node.name), tuple(sorted(node.attributes or [])), relations
+
+        def _relation(relation):
+            prepositions = tuple(_relation(pp) for pp in relation.prepositions or [])
+            return _names(relation.name), _node(relation.target), prepositions
+
+        return _node(self.root), self.n_instances()
+
+    def shape(self) -> str:
+        """
+        Returns a short description of the structure of the sub-graph, without names, e.g. `N+a(N,N(N))` for a node
+        with attributes that has two relations, one of them to a node that has a relation of its own.
+        """
+        def _node(node):
+            node_shape = "N+a" if node.attributes else "N"
+            children = []
+            for relation in node.relations or []:
+                children.append(_node(relation.target))
+                children += ["~" + _node(pp.target) for pp in relation.prepositions or []]
+            if children:
+                node_shape += "(" + ",".join(children) + ")"
+            return node_shape
+
+        shape = _node(self.root)
+        if self.multi_count and self.multi_count > 1:
+            shape += f"*{self.multi_count}"
+        return shape
@@ -0,0 +1,214 @@
+import hashlib
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import zstandard
+from srsly import msgpack
+
+from generator.lru_cache import LRUCache
+from generator.queries.data_classes import QueryNode, QueryRelationship
+from generator.queries.query_builder import QueryBuilder
+from generator.queries.sub_graph import SubGraph
+from generator.redis import redis
+from generator.utils import extract_elements_triplets
+
+
+class PostingList:
+    """
+    All matches of a single triplet in a split: the (subject id, relation, object id) rows of each scene, in the order
+    they were returned, and the name and attributes of every object that appears in them
+    """
+
+    def __init__(self, rows: Dict[str, List[Tuple]], objects: Dict[int, Tuple], too_large: bool = False):
+        self.rows = rows
+        self.objects = objects
+        # posting lists with more than `TripletIndex.MAX_ROWS` rows are not kept, queries that contain their triplet
+        # are executed by neo4j
+        self.too_large = too_large
+
+    def encode(self) -> bytes:
+        rows = [[scene_id, subject_id, relation, object_id]
+                for scene_id, scene_rows in self.rows.items() for subject_id, relation, object_id in scene_rows]
+        objects = [[object_id, name, attributes] for object_id, (name, attributes) in self.objects.items()]
+        return zstandard.ZstdCompressor(level=3).compress(msgpack.dumps([self.too_large, rows, objects]))
+
+    @staticmethod
+    def decode(payload: bytes) -> 'PostingList':
+        too_large, rows, objects = msgpack.loads(zstandard.ZstdDecompressor().decompress(payload), raw=False)
+        scene_rows = defaultdict(list)
+        for scene_id, subject_id, relation, object_id in rows:
+            scene_rows[scene_id].append((subject_id, relation, object_id))
+        return PostingList(dict(scene_rows), {object_id: (name, attributes) for object_id, name, attributes in objects},
+                           too_large)
+
+
+class TripletIndex:
+    """
+    Answers queries of sub-graphs with several triplets by joining the posting lists of their single triplets
+    (subject, relation and object, with their names and attributes) in Python. Only triplets that were not seen
+    before are sent to neo4j. Posting lists are cached in redis per split, and in memory by an `LRUCache`.
+
+    Sub-graphs with imsitu prepositions or with parallel elements are not supported (see `supports`), and are
+    executed by neo4j as before. Keys are prefixed by the same namespace as keys of `ResultCache`.
+    """
+    KEY_PREFIX = "t"
+    MAX_ROWS = 20000
+    MAX_RESULT_SCENES = 500
+
+    def __init__(self, split: str, graph_db_driver, memory_cache_size: int = 256 * 1024 * 1024,
+                 enable_cache: bool = True, record_query=None, namespace: str = None):
+        self._split = split
+        self._namespace = namespace or split
+        self._graph_db_driver = graph_db_driver
+        self._enable_cache = enable_cache
+        # called with the same arguments as `GraphExecutor._record_query` for every posting list fetched from neo4j
+        self._record_query = record_query
+        self._posting_lists = LRUCache(memory_cache_size)
+        # posting lists are fetched by the threads that execute queries concurrently
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def supports(sub_graph: SubGraph) -> bool:
+        if not sub_graph.root.relations:
+            return False
+        for element in sub_graph:
+            if element.parallel_element:
+                return False
+            if type(element) is QueryRelationship and element.prepositions:
+                return False
+        return True
+
+    def key(self, triplet: SubGraph) -> str:
+        digest = hashlib.sha1(repr(triplet.canonical()).encode('utf-8')).hexdigest()
+        return f"{TripletIndex.KEY_PREFIX}:{self._namespace}:{digest}"
+
+    @staticmethod
+    def _triplet_sub_graph(subject: QueryNode, relation: QueryRelationship, target: QueryNode) -> SubGraph:
+        subject = QueryNode(char_symbol=subject.char_symbol, name=subject.name, attributes=subject.attributes,
+                            relations=[])
+        target = QueryNode(char_symbol=target.char_symbol, name=target.name, attributes=target.attributes,
+                           relations=[])
+        relation = QueryRelationship(char_symbol=relation.char_symbol, name=relation.name, source=subject,
+                                     target=target)
+        subject.relations.append(relation)
+        target.backward_relation = relation
+        return SubGraph(subject)
+
+    def get_posting_list(self, triplet: SubGraph) -> PostingList:
+        key = self.key(triplet)
+        with self._lock:
+            posting_list = self._posting_lists.get(key)
+        if posting_list is not None:
+            return posting_list
+
+        payload = redis.get(key) if self._enable_cache else None
+        if payload:
+            posting_list = PostingList.decode(payload)
+        else:
+            posting_list = self._fetch_posting_list(triplet, key)
+            if self._enable_cache:
+                redis.set(key, posting_list.encode())
+
+        with self._lock:
+            self._posting_lists.set(key, posting_list)
+        return posting_list
+
+    def _fetch_posting_list(self, triplet: SubGraph, key: str) -> PostingList:
+        query_str, query_parameters = QueryBuilder.build_triplet_query(triplet, self._split, TripletIndex.MAX_ROWS + 1)
+        rows = defaultdict(list)
+        objects = {}
+        with self._graph_db_driver.session() as session:
+            st = time.time()
+            results = list(session.run(query_str, query_parameters))
+            et = time.time()
+        if self._record_query:
+            self._record_query(triplet.shape() + " [triplet]", key, query_str, query_parameters, et - st, len(results),
+                               'triplet', triplet)
+
+        if len(results) > TripletIndex.MAX_ROWS:
+            return PostingList({}, {}, too_large=True)
+
+        for result in results:
+            rows[result['scene_id']].append((result['subject_id'], result['relation'], result['object_id']))
+            objects[result['subject_id']] = (result['subject_name'], result['subject_attributes'])
+            objects[result['object_id']] = (result['object_name'], result['object_attributes'])
+        return PostingList(dict(rows), objects)
+
+    def match(self, sub_graph: SubGraph) -> Optional[Tuple[List, Dict[str, SubGraph]]]:
+        """
+        Returns the scenes that match the sub-graph (up to `MAX_RESULT_SCENES`), each with the sub-graph of one of its
+        matches, or None if the query can not be answered from posting lists
+        """
+        triplets = [triplet for _, triplet in extract_elements_triplets(sub_graph.root)]
+        posting_lists = []
+        for subject, relation, target in triplets:
+            posting_list = self.get_posting_list(TripletIndex._triplet_sub_graph(subject, relation, target))
+            if posting_list.too_large:
+                return None
+            posting_lists.append(posting_list)
+
+        # the posting list of each triplet, by the id of its subject in the query
+        children = defaultdict(list)
+        for (subject, _, target), posting_list in zip(triplets, posting_lists):
+            children[id(subject)].append((posting_list, target))
+
+        min_instances = sub_graph.multi_count if sub_graph.multi_count and sub_graph.multi_count > 1 else 1
+
+        result_scenes = []
+        matched_sub_graphs = {}
+        candidate_scenes = set(posting_lists[0].rows).intersection(*[p.rows for p in posting_lists[1:]])
+        for scene_id in posting_lists[0].rows:
+            if scene_id not in candidate_scenes:
+                continue
+            valid_objects = {}
+            root_objects = self._find_valid_objects(sub_graph.root, scene_id, children, valid_objects)
+            if len(root_objects) < min_instances:
+                continue
+
+            result_scenes.append(scene_id)
+            matched_sub_graphs[scene_id] = SubGraph(
+                self._build_match(sub_graph.root, min(root_objects), scene_id, children, valid_objects, posting_lists)
+            )
+            if len(result_scenes) >= TripletIndex.MAX_RESULT_SCENES:
+                break
+
+        return result_scenes, matched_sub_graphs
+
+    def _find_valid_objects(self, node, scene_id, children, valid_objects):
+        """
+        Returns the ids of objects in the scene that match the node along with the whole sub-tree below it. Leaves are
+        matched by the posting list of their parent triplet, so they are represented by None (any object).
+        """
+        objects = None
+        for posting_list, target in children[id(node)]:
+            target_objects = self._find_valid_objects(target, scene_id, children, valid_objects)
+            subjects = {subject_id for subject_id, _, object_id in posting_list.rows[scene_id]
+                        if target_objects is None or object_id in target_objects}
+            objects = subjects if objects is None else objects & subjects
+        valid_objects[id(node)] = objects
+        return objects
+
+    def _build_match(self, node, object_id, scene_id, children, valid_objects, posting_lists):
+        name, attributes = posting_lists[0].objects.get(object_id) or self._find_object(object_id, posting_lists)
+        matched_node = QueryNode(char_symbol=f"o_{object_id}", name=name, attributes=list(attributes or []),
+                                 relations=[])
+        for posting_list, target in children[id(node)]:
+            target_objects = valid_objects[id(target)]
+            relation, target_id = next((relation, target_id) for subject_id, relation, target_id
+                                       in posting_list.rows[scene_id]
+                                       if subject_id == object_id and (target_objects is None or
+                                                                       target_id in target_objects))
+            matched_target = self._build_match(target, target_id, scene_id, children, valid_objects, posting_lists)
+            matched_relation = QueryRelationship(char_symbol=f"r_{object_id}_{target_id}", name=relation,
+                                                 source=matched_node, target=matched_target)
+            matched_target.backward_relation = matched_relation
+            matched_node.relations.append(matched_relation)
+        return matched_node
+
+    @staticmethod
+    def _find_object(object_id, posting_lists):
+        for posting_list in posting_lists:
+            if object_id in posting_list.objects:
+                return posting_list.objects[object_id]
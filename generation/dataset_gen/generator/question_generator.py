@@ -1,15 +1,19 @@
 import os
 import re
-from collections import Counter, defaultdict
+from collections import defaultdict
 from copy import deepcopy
-from typing import List
+from typing import Dict, List
 
-from executor.executor import Executor, NonUniqueException, NoCommonAttributeException, \
-    MultipleAttributesForTypeException, NonExistentException, NeitherOfChooseException
+from executor.bitset_executor import BitsetExecutor, BitsetScene
+from executor.executor import Executor
+from executor.executor_profile import ExecutorProfile
 from generator.graph_traversal import GraphTraversal
+from generator.patterns.question_pattern import QuestionPattern
 from generator.patterns.question_pattern_factory import QuestionPatternFactory
 from generator.queries.distractor_queries import DistractorQueries
-from generator.queries.graph_executor import GraphExecutor
+from generator.queries.graph_executor import GraphExecutor, ExecutionRequest
+from generator.queries.query_stats import PruningCacheStats
+from generator.queries.sub_graph import SubGraph
 
 from generator.resources import Resources
 from generator.scene_reader import SceneReader
@@ -30,28 +34,68 @@ class QuestionGenerator:
     This is the core class that generates questions given a scene key
     """
     MAX_RETRIES = 5
-    generation_errors_per_pattern = defaultdict(lambda: Counter())
+    # failures of answers and of the programs run by patterns, by their codes
+    generation_errors_per_pattern = QuestionPattern.generation_errors_per_pattern
 
     def __init__(self,
                  random_seed=0,
                  split: str = 'val',
                  question_patterns_ids: List = None,
                  enable_graph_cache: bool = True,
-                 scene_reader: SceneReader = None):
+                 scene_reader: SceneReader = None,
+                 max_concurrent_graph_queries: int = 4,
+                 slow_query_threshold: float = 0.5,
+                 slow_query_log_path: str = None,
+                 sample_first_context_queries: bool = False,
+                 pruning_cache_size: int = 64 * 1024 * 1024,
+                 pruning_cache_path: str = None,
+                 graph_query_batch_size: int = 1,
+                 triplet_index: bool = False,
+                 triplet_index_size: int = 256 * 1024 * 1024,
+                 graph_version: str = None,
+                 graph_query_log_path: str = None,
+                 bitset_executor: bool = False,
+                 profile_executor: bool = False,
+                 share_sub_programs: bool = False,
+                 index_scenes: bool = False):
         # train or validation split
         self._split = split
 
         # graph executor - executes our formal semantic language on scene graphs
         self._executor = Executor()
+        # answers are computed on object sets indexed as bitmasks (see `BitsetExecutor`)
+        self._bitset_executor = bitset_executor
+        self._answer_executor = BitsetExecutor() if bitset_executor else self._executor
+        # operations of all executors are recorded per pattern (see `ExecutorProfile`)
+        if profile_executor:
+            Executor.profile = ExecutorProfile()
+        # answers are computed on indexed scenes (see `SceneIndex`)
+        self._index_scenes = index_scenes
+        # reference sub-programs are run once per scenes for all programs (see `Executor._share_sub_programs`)
+        Executor.share_sub_programs = share_sub_programs
 
         # the scene reader is responsible for
         self.scene_reader = scene_reader or SceneReader(self._split, os.path.join(Resources.base_path, 'data'))
 
         self._graph_traversal = GraphTraversal(random_seed)
         self._graph_executor = GraphExecutor(split=split, random_seed=random_seed,
-                                             scene_reader=self.scene_reader, enable_cache=enable_graph_cache)
-
-        self._question_patterns = [QuestionPatternFactory.create(p, self.scene_reader, random_seed)
+                                             scene_reader=self.scene_reader, enable_cache=enable_graph_cache,
+                                             max_concurrent_queries=max_concurrent_graph_queries,
+                                             slow_query_threshold=slow_query_threshold,
+                                             slow_query_log_path=slow_query_log_path,
+                                             sample_first=sample_first_context_queries,
+                                             pruning_cache_size=pruning_cache_size,
+                                             pruning_cache_path=pruning_cache_path,
+                                             query_batch_size=graph_query_batch_size,
+                                             triplet_index=triplet_index,
+                                             triplet_index_size=triplet_index_size,
+                                             graph_version=graph_version,
+                                             query_log_path=graph_query_log_path)
+        self.cache_namespace = self._graph_executor.cache_namespace
+
+        self._question_patterns = [QuestionPatternFactory.create(p, self.scene_reader, random_seed,
+                                                                 bitset_executor=bitset_executor,
+                                                                 index_scenes=index_scenes)
                                    for (i, p) in enumerate(Resources.question_patterns)
                                    if not question_patterns_ids or i in question_patterns_ids]
 
@@ -61,33 +105,10 @@ class QuestionGenerator:
         scene = self.scene_reader.get_formatted_scenes(scene_key)
 
         self._graph_executor.starting_new_scene(scene_key)
+        Executor.starting_new_scene()
 
-        objects_to_iterate = scene['objects'].items()
-
-        ref_text_to_sub_graphs = defaultdict(list)
-
-        for sel_obj_id, sel_obj in objects_to_iterate:
-            for sub_graph in self._graph_traversal.traverse(sel_obj_id, scene):
-                ref_text = sub_graph_root_to_ref_text(sub_graph.root)
-
-                ref_text_to_sub_graphs[ref_text].append(sub_graph)
-
-        # take one arbitrary sub graph for each text (doesn't matter which one since text will be the same)
-        sub_graphs_for_questions = [sgs[0] for sgs in ref_text_to_sub_graphs.values()]
-
-        # we want to detect similar sub-graphs in the same scene, to ask questions such as "in one image there are
-        # at least three dogs"
         mult_scene_verified_prob = None
-        for sub_graphs in ref_text_to_sub_graphs.values():
-            if len(sub_graphs) > 4:
-                continue
-            mult_sub_graph = deepcopy(sub_graphs[0])  # arbitrarily taking first
-            mult_sub_graph.multi_count = len(sub_graphs)
-            sub_graphs_for_questions.append(mult_sub_graph)
-
-        for sub_graph in sub_graphs_for_questions:
-            if not self._is_valid_question_sub_graph(sub_graph):
-                continue
+        for sub_graph in self.get_sub_graphs_for_questions(scene):
             if keep_only_graph_structure == "v_shape":
                 if not (len(sub_graph) > 3 and sub_graph.depth() == 3):
                     continue
@@ -102,30 +123,26 @@ class QuestionGenerator:
             for (picked_slots, question_pattern, program, scenes, dbg_info, sub_graphs, simple_ref_text, _) \
                     in self._generate_questions_from_sub_graph(sub_graph, scene):
 
-                formatted_scenes = [self.scene_reader.get_formatted_scenes(k) for k in scenes]
-                objects_from_all_scenes = {ok: ov for s in formatted_scenes for ok, ov in s['objects'].items()}
+                if self._bitset_executor:
+                    objects_from_all_scenes = BitsetScene.merge([self.scene_reader.get_bitset_scene(k) for k in scenes])
+                    scene_index = None
+                elif self._index_scenes:
+                    objects_from_all_scenes = self.scene_reader.get_scenes_view(scenes)
+                    scene_index = objects_from_all_scenes.index
+                else:
+                    objects_from_all_scenes = self.scene_reader.get_scenes_objects(scenes)
+                    scene_index = None
 
                 text = self._fill_text_slots(question_pattern['text'], picked_slots)
                 program = fill_program_slots(program, picked_slots)
 
                 err_counter = QuestionGenerator.generation_errors_per_pattern[question_pattern['pattern_index']]
-                try:
-                    answer = self._executor.run(program, objects_from_all_scenes)
-                except NonUniqueException:
-                    err_counter['non_unique'] += 1
-                    continue
-                except NonExistentException:
-                    err_counter['non_existent'] += 1
-                    continue
-                except NeitherOfChooseException:
-                    err_counter['invalid_choose'] += 1
-                    continue
-                except MultipleAttributesForTypeException:
-                    err_counter['multiple_attributes'] += 1
-                    continue
-                except NoCommonAttributeException:
-                    err_counter['no_common_attribute'] += 1
-                    print(f"NoCommonAttributeException, scene: {scene_key}, picked_slots: {picked_slots}")
+                # failures are counted by their codes (see `EXCEPTION_CODES`)
+                answer, error = self._answer_executor.run_with_status(program, objects_from_all_scenes, scene_index)
+                if error:
+                    err_counter[error] += 1
+                    if error == 'no_common_attribute':
+                        print(f"NoCommonAttributeException, scene: {scene_key}, picked_slots: {picked_slots}")
                     continue
 
                 if not self._is_valid_answer(answer):
@@ -141,6 +158,63 @@ class QuestionGenerator:
                 dbg_info['mult_scene_verified_prob'] = mult_scene_verified_prob
                 yield text, program, scenes, answer, question_pattern, dbg_info, sub_graphs, simple_ref_text, None
 
+    def get_sub_graphs_for_questions(self, scene) -> List[SubGraph]:
+        """
+        Returns the sub-graphs of the scene that questions are generated for
+        """
+        ref_text_to_sub_graphs = defaultdict(list)
+
+        for sel_obj_id, sel_obj in scene['objects'].items():
+            for sub_graph in self._graph_traversal.traverse(sel_obj_id, scene):
+                ref_text = sub_graph_root_to_ref_text(sub_graph.root)
+
+                ref_text_to_sub_graphs[ref_text].append(sub_graph)
+
+        # take one arbitrary sub graph for each text (doesn't matter which one since text will be the same)
+        sub_graphs_for_questions = [sgs[0] for sgs in ref_text_to_sub_graphs.values()]
+
+        # we want to detect similar sub-graphs in the same scene, to ask questions such as "in one image there are
+        # at least three dogs"
+        for sub_graphs in ref_text_to_sub_graphs.values():
+            if len(sub_graphs) > 4:
+                continue
+            mult_sub_graph = deepcopy(sub_graphs[0])  # arbitrarily taking first
+            mult_sub_graph.multi_count = len(sub_graphs)
+            sub_graphs_for_questions.append(mult_sub_graph)
+
+        return [sub_graph for sub_graph in sub_graphs_for_questions if self._is_valid_question_sub_graph(sub_graph)]
+
+    def get_scene_queries(self, scene_key) -> Dict[str, SubGraph]:
+        """
+        Returns all distinct graph queries (pruned sub-graphs, keyed by their cache key) that generating questions
+        for the scene may execute, without executing them
+        """
+        scene = self.scene_reader.get_formatted_scenes(scene_key)
+
+        self._graph_executor.starting_new_scene(scene_key)
+
+        queries = {}
+        for sub_graph in self.get_sub_graphs_for_questions(scene):
+            negatives = self._distractor_queries.get_negative_queries(sub_graph)
+            requests = self._get_context_requests(sub_graph, negatives)
+            for cache_key, query in self._graph_executor.get_queries(requests).items():
+                queries.setdefault(cache_key, query)
+        return queries
+
+    def pop_stats(self) -> Dict:
+        """
+        Returns the stats collected since the last call. Each value can be merged into stats of other processes with
+        `merge`.
+        """
+        stats = {'queries': self._graph_executor.pop_query_stats(),
+                 'pruning': self._graph_executor.pop_pruning_stats()}
+        if Executor.profile is not None:
+            stats['executor'], Executor.profile = Executor.profile, ExecutorProfile()
+        return stats
+
+    def save_pruning_cache(self, pruning_stats: PruningCacheStats = None):
+        self._graph_executor.save_pruning_cache(pruning_stats.new_entries if pruning_stats else None)
+
     def _generate_questions_from_sub_graph(self, sub_graph, scene):
         scene_key = scene['scene_key']
         positive_scenes, negative_scenes, scenes_info = self._get_verified_context_scenes(scene_key, sub_graph)
@@ -149,13 +223,19 @@ class QuestionGenerator:
             return
 
         ref_program = sub_graph_root_to_ref_program(sub_graph.root)
-        all_ref_instances = self._executor.run(ref_program, scene['objects'])
+        all_ref_instances = self._executor.run(ref_program, scene['objects'],
+                                               self.scene_reader.get_scene_index(scene_key))
         for question_pattern in self._question_patterns:
             if sub_graph.multi_count and not question_pattern.does_pattern_support_multi_instances():
                 continue
             question_info_gen = question_pattern.generate_questions(
                 sub_graph, negative_scenes, positive_scenes, scene_key, scenes_info, all_ref_instances)
+            if Executor.profile is not None:
+                # answers of the yielded questions are executed before the pattern is resumed
+                Executor.profile.pattern = question_pattern.name
             yield from question_info_gen
+        if Executor.profile is not None:
+            Executor.profile.pattern = None
 
     @staticmethod
     def _fill_text_slots(question_pattern: str, picked_slots: dict):
@@ -173,16 +253,18 @@ class QuestionGenerator:
     def _get_context_scenes(self, curr_scene_key, sub_graph):
         negative_scenes = {}
 
-        positive_scenes, scenes_subgraphs = self._graph_executor.execute(sub_graph)
+        negatives = self._distractor_queries.get_negative_queries(sub_graph)
+
+        # the positive query and all negative queries are executed together, so uncached queries can run concurrently
+        results = self._graph_executor.execute_many(self._get_context_requests(sub_graph, negatives))
+
+        positive_scenes, scenes_subgraphs = results[0]
         positive_scenes.append(curr_scene_key)
 
         scenes_info = {'subgraphs': scenes_subgraphs, 'queries': {k: {'positive'} for k in positive_scenes}}
 
-        negatives = self._distractor_queries.get_negative_queries(sub_graph)
-
-        for neg in negatives:
+        for neg, (scenes, dbg) in zip(negatives, results[1:]):
             key = str(neg['e_id']) + '_' + neg['source']
-            scenes, dbg = self._graph_executor.execute(neg['query'], neg['filter_out'], key)
             if scenes:
                 neg_scenes = set()
                 for scene in scenes:
@@ -202,6 +284,11 @@ class QuestionGenerator:
 
         return list(set(positive_scenes)), negative_scenes, scenes_info
 
+    @staticmethod
+    def _get_context_requests(sub_graph, negatives) -> List[ExecutionRequest]:
+        return [(sub_graph, None, None)] + \
+               [(neg['query'], neg['filter_out'], str(neg['e_id']) + '_' + neg['source']) for neg in negatives]
+
     def _is_valid_question_sub_graph(self, sub_graph):
         for _, triplet in extract_elements_triplets(sub_graph.root):
             pair = f"{triplet[1].name},{triplet[2].name}"
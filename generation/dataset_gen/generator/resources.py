@@ -1,3 +1,4 @@
+import hashlib
 import os
 
 import re
@@ -53,6 +54,20 @@ class Resources:
         Resources.entailing_attributes = _convert_annotated_pairs_to_dict(annotated_groups, 'entailing_attributes')
         Resources.entailing_nouns = _convert_annotated_pairs_to_dict(annotated_groups, 'entailing_predicted_nouns')
 
+        # identifies the loaded resources, e.g. to keep cached results of different resources apart
+        Resources.version = Resources.files_hash([f'{resources_path}/{questions_yaml}',
+                                                  f'{resources_path}/ignore.yaml',
+                                                  f'{resources_path}/ontology.yaml',
+                                                  f'{resources_path}/{groups_yaml}.yaml'])
+
+    @staticmethod
+    def files_hash(file_paths):
+        digest = hashlib.sha1()
+        for file_path in file_paths:
+            with open(file_path, 'rb') as f:
+                digest.update(f.read())
+        return digest.hexdigest()
+
     @staticmethod
     def load_yaml_cached(yaml_path):
         """
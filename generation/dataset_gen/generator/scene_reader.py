@@ -1,13 +1,20 @@
 import json
 import os
 from collections import defaultdict
+from typing import Dict, List
 
 from tqdm import tqdm
 
+from executor.bitset_executor import BitsetScene
+from executor.scene_index import MultiSceneView, SceneIndex
+from generator.lru_cache import LRUCache
 from generator.resources import Resources
 
 
 class SceneReader:
+    # indexes of scenes are kept for the most recently used scenes, up to this number of objects in total
+    MAX_INDEXED_OBJECTS = 200000
+
     def __init__(self, split=None, data_dir="data", selected_scenes=None):
         # triplet to attributes of subject and object, used for optimization by preventing queries triplets if they
         # do not exist at all
@@ -36,6 +43,10 @@ class SceneReader:
 
         self.all_scenes_keys = list(self._all_scenes.keys())
 
+        # built lazily, since only scenes that are candidates of filtered queries need them
+        self._scene_indexes = LRUCache(SceneReader.MAX_INDEXED_OBJECTS)
+        self._bitset_scenes = LRUCache(SceneReader.MAX_INDEXED_OBJECTS)
+
     def _read_formatted_scenes(self, file_path, selected_scenes=None):
         print(f"Loading scenes file: {file_path}")
         scenes = json.load(open(file_path))
@@ -108,3 +119,33 @@ class SceneReader:
             return d[specific_scene_key]
         else:
             return d
+
+    def get_scene_index(self, scene_key) -> SceneIndex:
+        scene_index = self._scene_indexes.get(scene_key)
+        if scene_index is None:
+            objects = self._all_scenes[scene_key]['objects']
+            scene_index = SceneIndex(objects)
+            self._scene_indexes.set(scene_key, scene_index, size=len(objects))
+        return scene_index
+
+    def get_scenes_objects(self, scene_keys: List[str]) -> Dict:
+        """
+        The objects of several scenes, merged into a single dict
+        """
+        return {ok: ov for k in scene_keys for ok, ov in self.get_formatted_scenes(k)['objects'].items()}
+
+    def get_scenes_view(self, scene_keys: List[str]) -> MultiSceneView:
+        """
+        The objects of several scenes (each kept once), with their indexes, without merging them into a new dict
+        """
+        scene_keys = list(dict.fromkeys(scene_keys))
+        return MultiSceneView([self.get_formatted_scenes(k)['objects'] for k in scene_keys],
+                              [self.get_scene_index(k) for k in scene_keys])
+
+    def get_bitset_scene(self, scene_key) -> BitsetScene:
+        bitset_scene = self._bitset_scenes.get(scene_key)
+        if bitset_scene is None:
+            objects = self._all_scenes[scene_key]['objects']
+            bitset_scene = BitsetScene(objects)
+            self._bitset_scenes.set(scene_key, bitset_scene, size=len(objects))
+        return bitset_scene
@@ -0,0 +1,339 @@
+"""
+Micro-benchmark of the execution modes of `Executor`, on synthetic GQA-like scenes (so that neither the datasets nor
+neo4j are needed). Every program of `questions.yaml` is instantiated with references and slots picked from sub-graphs
+of the scenes (as traversed by `GraphTraversal`), and run on sets of scenes by each mode:
+
+    interpret  `Executor.run` of the program, on a merged objects dict
+    compiled   `Executor.run` of the compiled program, on a merged objects dict
+    indexed    `Executor.run` of the compiled program, on a `MultiSceneView` of the scenes (with their indexes)
+    status     `Executor.run_with_status` of the program, on a `MultiSceneView`
+    shared     as `indexed`, with sub-programs shared by programs (see `Executor.share_sub_programs`)
+    bitset     `BitsetExecutor.run` of the compiled program, on a merged `BitsetScene`
+
+Each run gets a copy of its program, as programs are filled again for each question, so programs are compiled (or found
+in the cache of compiled programs) within the measured time.
+
+Reports the number of programs per second of each mode and pattern, and fails if the answers (or failures) of a mode
+differ from those of `interpret` (objects are compared regardless of their order). Results can be saved as a baseline
+and compared with it, to detect regressions (baselines are only comparable on the same machine and arguments).
+
+Should be executed from the `dataset_gen` directory:
+    python -m scripts.benchmark_executor --baseline output/executor_benchmark.json --save_baseline
+    python -m scripts.benchmark_executor --baseline output/executor_benchmark.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from copy import deepcopy
+from random import Random
+from typing import Dict, List, Optional
+
+import yaml
+
+from executor.bitset_executor import BitsetExecutor, BitsetScene
+from executor.executor import Executor, EXCEPTION_CODES, PROGRAM_EXCEPTIONS
+from generator.graph_traversal import GraphTraversal
+from generator.resources import Resources
+from generator.scene_reader import SceneReader
+from generator.utils import fill_program_slots, merge_ref_program, sub_graph_root_to_ref_program
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--scenes', default=200, type=int, help='number of synthetic scenes')
+parser.add_argument('--objects', default=16, type=int, help='mean number of objects per scene')
+parser.add_argument('--names', default=40, type=int, help='number of distinct object names')
+parser.add_argument('--attributes', default=2, type=int, help='maximum number of attributes per object')
+parser.add_argument('--relations', default=2, type=int, help='maximum number of relations per object')
+parser.add_argument('--scenes_per_question', default=6, type=int, help='number of scenes each program is run on')
+parser.add_argument('--programs_per_pattern', default=100, type=int)
+parser.add_argument('--runs_per_program', default=3, type=int,
+                    help='number of sets of scenes each program is run on (as distractors of a question are)')
+parser.add_argument('--repeat', default=3, type=int, help='the fastest of this many repeats is reported')
+parser.add_argument('--modes', nargs='+', default=['interpret', 'compiled', 'indexed', 'status', 'shared', 'bitset'])
+parser.add_argument('--seed', default=0, type=int)
+parser.add_argument('--baseline', help='path of a baseline (json) to compare with, see `--save_baseline`')
+parser.add_argument('--save_baseline', action='store_true', help='save the results as the baseline')
+parser.add_argument('--max_slowdown', default=0.2, type=float,
+                    help='fail if a mode is slower than its baseline by more than this fraction')
+
+args = parser.parse_args()
+
+RELATIONS = ['on', 'wearing', 'holding', 'near', 'behind', 'in front of', 'next to', 'sitting on', 'riding', 'in',
+             'under', 'above', 'carrying', 'standing on', 'looking at', 'eating', 'covering', 'hanging on']
+REF_SLOTS = ['REF_1', 'REF_2', 'POS_REF_2', 'REF_1_SUBJECT', 'REF_1_NO_RELATION', 'OBJ']
+# slots of the relation from the referred object, which can only be filled for references with relations
+RELATION_SLOTS = {'REF_1_NO_SUBJECT_CONDITION', 'RELATION', 'REL_1', 'OBJ'}
+
+
+def make_scenes(random: Random) -> Dict:
+    """
+    Scenes in the format of the GQA scene graphs files
+    """
+    nouns = sorted(name for names in yaml.safe_load(open('resources/ontology.yaml'))['objects'].values()
+                   for name in names if name not in Resources.ignore['nouns'])
+    names = random.sample(nouns, args.names)
+    attributes = sorted(Resources.attributes_group_by_name)
+
+    scenes = {}
+    for i in range(args.scenes):
+        scene_id = str(1000000 + i)
+        object_keys = [str(i * 1000 + j) for j in range(random.randint(args.objects // 2, args.objects * 3 // 2))]
+        objects = {}
+        for object_key in object_keys:
+            objects[object_key] = {'name': random.choice(names), 'x': 0, 'y': 0, 'w': 100, 'h': 100,
+                                   'attributes': random.sample(attributes, random.randint(0, args.attributes)),
+                                   'relations': []}
+        for object_key in object_keys:
+            for other_key in random.sample(object_keys, random.randint(0, args.relations)):
+                if other_key != object_key:
+                    objects[object_key]['relations'].append({'name': random.choice(RELATIONS), 'object': other_key})
+        scenes[scene_id] = {'objects': objects}
+    return scenes
+
+
+class ProgramSampler:
+    """
+    Instantiates the programs of question patterns with references to sub-graphs of the scenes
+    """
+
+    def __init__(self, scene_reader: SceneReader, random: Random):
+        self._scene_reader = scene_reader
+        self._random = random
+        self._names = sorted({obj['name'] for scene_key in scene_reader.all_scenes_keys
+                              for obj in scene_reader.get_formatted_scenes(scene_key)['objects'].values()})
+        self._attributes = sorted(Resources.attributes_group_by_name)
+
+        traversal = GraphTraversal(args.seed)
+        self._sub_graphs = {}
+        for scene_key in scene_reader.all_scenes_keys:
+            scene = scene_reader.get_formatted_scenes(scene_key)
+            self._sub_graphs[scene_key] = [sub_graph for object_key in scene['objects']
+                                           for sub_graph in traversal.traverse(object_key, scene)]
+
+    def sample(self, pattern: Dict) -> Optional[List[Dict]]:
+        """
+        Runs of a program of the pattern, each with the scenes to run it on. None if the picked sub-graph does not fit
+        the pattern
+        """
+        scene_keys = self._random.sample(self._scene_reader.all_scenes_keys, args.scenes_per_question)
+        if not self._sub_graphs[scene_keys[0]]:
+            return None
+        root = self._random.choice(self._sub_graphs[scene_keys[0]]).root
+        obj = self._scene_reader.get_formatted_scenes(scene_keys[0])['objects'][root.char_symbol[2:]]
+        relation = root.relations[0] if root.relations else None
+
+        slots_in_program = ProgramSampler._slots(pattern['program'])
+        if relation is None and slots_in_program & RELATION_SLOTS:
+            return None
+
+        no_relation_root = deepcopy(root)
+        no_relation_root.relations = []
+        ref_programs = {
+            'REF_1': sub_graph_root_to_ref_program(root),
+            'REF_2': self._other_ref_program(scene_keys),
+            'POS_REF_2': self._other_ref_program(scene_keys),
+            # the subject of a condition on its relation (see `AllSubjectPattern`), or the whole reference
+            'REF_1_SUBJECT': sub_graph_root_to_ref_program(
+                no_relation_root if 'REF_1_NO_SUBJECT_CONDITION' in slots_in_program else root),
+            'REF_1_NO_RELATION': sub_graph_root_to_ref_program(no_relation_root),
+        }
+        attribute_groups = sorted(obj['attributes_by_group'] or set(Resources.attributes_group_by_name.values()))
+        slots = {
+            'ATTR_TYPE_1': self._random.choice(attribute_groups),
+            'ATTR_POS': self._random.choice(obj['attributes'] or self._attributes),
+            'ATTR_NEG': self._random.choice(self._attributes),
+            'COMPARISON_MODULE': self._random.choice(['gt', 'lt', 'eq']),
+            'QUANTIFIER_MODULE': self._random.choice(['all', 'some', 'none']),
+            'LOGIC_MODULE': self._random.choice(['logic_and', 'logic_or']),
+            'NUM_QUANTIFIER_MODULE': self._random.choice(['eq', 'geq', 'leq', 'gt', 'lt']),
+            'NUM_POS': self._random.randint(1, 4),
+            'NUM_POS_GROUP_BY': self._random.randint(1, 3),
+            'KEEP_IF_VALUES_COUNT_QUANTIFIER': self._random.choice(['keep_if_values_count_eq',
+                                                                    'keep_if_values_count_geq',
+                                                                    'keep_if_values_count_leq']),
+        }
+        if relation is not None:
+            # the relation as a condition on any object
+            condition_root = deepcopy(root)
+            condition_root.empty, condition_root.name, condition_root.attributes = True, None, {}
+            condition_root.backward_relation = None
+            condition_root.relations = [condition_root.relations[0]]
+            ref_programs['OBJ'] = sub_graph_root_to_ref_program(relation.target)
+            slots.update({
+                'REF_1_NO_SUBJECT_CONDITION': sub_graph_root_to_ref_program(condition_root),
+                'RELATION': relation.name,
+                'OBJ': relation.target.name,
+                'OBJ_NEG': self._random.choice(self._names),
+                'REL_1': relation.name,
+                'REL_NEG': self._random.choice(RELATIONS),
+            })
+
+        program = pattern['program']
+        for slot in REF_SLOTS:
+            if any(row['operation'] == 'refer' and row.get('arguments') == slot for row in program):
+                program = merge_ref_program(program, ref_programs[slot], slot)
+        program = fill_program_slots(program, slots)
+        # the scenes of the referred object, and other sets of scenes
+        return [{'program': program, 'scene_keys': scene_keys}] + \
+            [{'program': program, 'scene_keys': self._random.sample(self._scene_reader.all_scenes_keys,
+                                                                    args.scenes_per_question)}
+             for _ in range(args.runs_per_program - 1)]
+
+    def _other_ref_program(self, scene_keys: List[str]) -> List[Dict]:
+        scene_key = self._random.choice([k for k in scene_keys if self._sub_graphs[k]] or scene_keys[:1])
+        if not self._sub_graphs[scene_key]:
+            return [{'operation': 'find', 'arguments': [self._random.choice(self._names)]}]
+        return sub_graph_root_to_ref_program(self._random.choice(self._sub_graphs[scene_key]).root)
+
+    @staticmethod
+    def _slots(program: List[Dict]) -> set:
+        slots = set()
+        for row in program:
+            slots.add(row['operation'])
+            arguments = row.get('arguments', [])
+            for argument in arguments if type(arguments) is list else [arguments]:
+                if type(argument) is list and argument and type(argument[0]) is dict:
+                    slots |= ProgramSampler._slots(argument)
+                elif type(argument) is str:
+                    slots.add(argument)
+        return slots
+
+
+def normalize(answer):
+    # objects are compared by their keys, regardless of their order
+    if isinstance(answer, dict):
+        if 'object_key' in answer:
+            return answer['object_key']
+        return sorted((str(key), normalize(value)) for key, value in answer.items())
+    if isinstance(answer, list):
+        return sorted((normalize(a) for a in answer), key=repr)
+    return answer
+
+
+def run_mode(mode: str, instances: List[Dict], scene_reader: SceneReader):
+    """
+    Runs the instances by the mode, returns the elapsed time and the (normalized) outcome of each instance
+    """
+    executor = BitsetExecutor() if mode == 'bitset' else Executor()
+    if mode in ('interpret', 'compiled'):
+        inputs = [{k: v for scene_key in dict.fromkeys(instance['scene_keys'])
+                   for k, v in scene_reader.get_formatted_scenes(scene_key)['objects'].items()}
+                  for instance in instances]
+    elif mode == 'bitset':
+        inputs = [BitsetScene.merge([scene_reader.get_bitset_scene(k) for k in dict.fromkeys(instance['scene_keys'])])
+                  for instance in instances]
+    else:
+        inputs = [scene_reader.get_scenes_view(instance['scene_keys']) for instance in instances]
+
+    # compiled programs and outputs of conditions and reference sub-programs are kept between programs, but not
+    # between runs
+    Executor.starting_new_scene()
+    Executor._condition_outputs.clear()
+    Executor._compiled_programs.clear()
+    Executor.share_sub_programs = mode == 'shared'
+    BitsetExecutor._compiled_programs.clear()
+
+    programs = [deepcopy(instance['program']) for instance in instances]
+
+    outcomes = []
+    st = time.perf_counter()
+    for program, scene in zip(programs, inputs):
+        if mode == 'status':
+            answer, error = executor.run_with_status(program, scene)
+            outcomes.append((answer, error))
+            continue
+        try:
+            outcomes.append((executor.run(program if mode == 'interpret' else executor.compile(program), scene), None))
+        except PROGRAM_EXCEPTIONS as e:
+            outcomes.append((None, EXCEPTION_CODES[type(e)]))
+    elapsed = time.perf_counter() - st
+    return elapsed, [(normalize(answer), error) for answer, error in outcomes]
+
+
+def print_report(instances_per_pattern: Dict[str, List], programs_per_second: Dict[str, Dict[str, float]],
+                 baseline: Optional[Dict]):
+    width = max(len('pattern'), max(len(name) for name in instances_per_pattern))
+    print(f"Programs per second ({args.scenes_per_question} scenes per program, {args.runs_per_program} runs of each "
+          f"program, best of {args.repeat} repeats):")
+    print(f"{'pattern':<{width}} {'runs':>8} " + " ".join(f"{mode:>10}" for mode in args.modes))
+    for name in list(instances_per_pattern) + ['all']:
+        n_programs = sum(map(len, instances_per_pattern.values())) if name == 'all' else \
+            len(instances_per_pattern[name])
+        print(f"{name:<{width}} {n_programs:>8} " +
+              " ".join(f"{programs_per_second[mode][name]:>10.0f}" for mode in args.modes))
+    if baseline:
+        print(f"{'baseline':<{width}} {'':>8} " +
+              " ".join(f"{baseline['programs_per_second'].get(mode, {}).get('all', 0):>10.0f}" for mode in args.modes))
+
+
+def main():
+    Resources.load()
+    random = Random(args.seed)
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.makedirs(os.path.join(data_dir, 'gqa'))
+        os.makedirs(os.path.join(data_dir, 'imsitu'))
+        json.dump(make_scenes(random), open(os.path.join(data_dir, 'gqa', 'synthetic_sceneGraphs.json'), 'wt'))
+        json.dump({}, open(os.path.join(data_dir, 'imsitu', 'synthetic_imsitu_formatted.json'), 'wt'))
+        scene_reader = SceneReader('synthetic', data_dir)
+
+    sampler = ProgramSampler(scene_reader, random)
+    instances_per_pattern = {}
+    for pattern in Resources.question_patterns:
+        instances = []
+        for _ in range(args.programs_per_pattern * 20):
+            program_instances = sampler.sample(pattern)
+            if program_instances:
+                instances += program_instances
+                if len(instances) == args.programs_per_pattern * args.runs_per_program:
+                    break
+        instances_per_pattern[f"#{pattern['pattern_index']} {pattern['pattern_name']}"] = instances
+
+    programs_per_second = {mode: {} for mode in args.modes}
+    divergences = []
+    total_elapsed = {mode: 0 for mode in args.modes}
+    for name, instances in instances_per_pattern.items():
+        expected = None
+        for mode in args.modes:
+            elapsed = []
+            for _ in range(args.repeat):
+                mode_elapsed, outcomes = run_mode(mode, instances, scene_reader)
+                elapsed.append(mode_elapsed)
+                if expected is None:
+                    expected = outcomes
+                divergences += [(name, mode, instance['program']) for instance, outcome, expected_outcome
+                                in zip(instances, outcomes, expected) if outcome != expected_outcome]
+            programs_per_second[mode][name] = len(instances) / max(min(elapsed), 1e-9)
+            total_elapsed[mode] += min(elapsed)
+    n_programs = sum(map(len, instances_per_pattern.values()))
+    for mode in args.modes:
+        programs_per_second[mode]['all'] = n_programs / max(total_elapsed[mode], 1e-9)
+
+    baseline = json.load(open(args.baseline)) if args.baseline and os.path.exists(args.baseline) else None
+    print_report(instances_per_pattern, programs_per_second, baseline)
+
+    failed = False
+    if divergences:
+        failed = True
+        print(f"{len(divergences)} outcomes differ from those of `{args.modes[0]}`, e.g. {divergences[0]}")
+    if baseline:
+        if baseline['arguments'] != {k: v for k, v in vars(args).items() if k not in ('baseline', 'save_baseline')}:
+            print("Warning: the baseline was measured with different arguments")
+        for mode in args.modes:
+            baseline_pps = baseline['programs_per_second'].get(mode, {}).get('all')
+            if baseline_pps and programs_per_second[mode]['all'] < baseline_pps * (1 - args.max_slowdown):
+                failed = True
+                print(f"Mode `{mode}` is slower than its baseline: {programs_per_second[mode]['all']:.0f} programs/s "
+                      f"(baseline: {baseline_pps:.0f})")
+    if args.save_baseline and args.baseline and not failed:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        json.dump({'arguments': {k: v for k, v in vars(args).items() if k not in ('baseline', 'save_baseline')},
+                   'programs_per_second': programs_per_second}, open(args.baseline, 'wt'), indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
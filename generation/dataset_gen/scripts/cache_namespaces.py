@@ -0,0 +1,51 @@
+"""
+Lists and drops cache namespaces (see `CacheNamespace`). Each namespace holds the cached query results of one split,
+graph version and resources version, so caches of several versions can be kept in the same redis side by side, and
+dropped once they are not needed anymore.
+
+Should be executed from the `dataset_gen` directory:
+    python -m scripts.cache_namespaces --count
+    python -m scripts.cache_namespaces --drop val:0123456789ab:0123456789ab
+    python -m scripts.cache_namespaces --drop_older_than 30
+"""
+import argparse
+import time
+from datetime import datetime
+
+from generator.queries.cache_namespace import CacheNamespace
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--count', action='store_true', help='count the keys of each namespace (scans the whole cache)')
+parser.add_argument('--drop', nargs='+', default=[],
+                    help='namespaces to drop. Caches written before namespaces were added are in a namespace named '
+                         'after their split (e.g. `val`)')
+parser.add_argument('--drop_older_than', type=float, help='drop registered namespaces not used for this many days')
+parser.add_argument('--batch_size', default=1000, type=int)
+args = parser.parse_args()
+
+
+def print_namespaces(namespaces):
+    print(f"{'namespace':<40} {'last used':<20}" + (f" {'keys':>10}" if args.count else ""))
+    for name, info in sorted(namespaces.items(), key=lambda item: item[1]['last_used']):
+        last_used = datetime.fromtimestamp(info['last_used']).strftime('%Y-%m-%d %H:%M')
+        line = f"{name:<40} {last_used:<20}"
+        if args.count:
+            line += f" {sum(1 for _ in CacheNamespace.keys(name, args.batch_size)):>10}"
+        print(line)
+
+
+if __name__ == "__main__":
+    namespaces = CacheNamespace.registered()
+
+    to_drop = list(args.drop)
+    if args.drop_older_than is not None:
+        min_last_used = time.time() - args.drop_older_than * 24 * 60 * 60
+        to_drop += [name for name, info in namespaces.items() if info['last_used'] < min_last_used]
+
+    for name in to_drop:
+        n_deleted = CacheNamespace.drop(name, args.batch_size)
+        print(f"Dropped namespace {name} ({n_deleted} keys)")
+        namespaces.pop(name, None)
+
+    if not to_drop:
+        print_namespaces(namespaces)
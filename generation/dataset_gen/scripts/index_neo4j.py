@@ -2,16 +2,55 @@ import argparse
 import json
 import os
 import csv
+import hashlib
+import time
+
 import wget
 import shutil
 
 from tqdm import tqdm
 
+from generator.queries.query_builder import QueryBuilder
+
+# a fixed sample of queries (in the format of `QueryBuilder`) used to report the effect of indexes and labels
+BENCHMARK_QUERIES = [
+    ('MATCH (scene:Scene)-[r:IN]-(n0:Object)-[r1:`wearing`]->(n2:Object)\n'
+     ' WHERE scene.split = $split  AND ((n0.name IN $names_n0) AND (n2.name IN $names_n2)) ',
+     {'names_n0': ['man'], 'names_n2': ['shirt']}),
+    ('MATCH (scene:Scene)-[r:IN]-(n0:Object)-[r1:`holding`]->(n2:Object)\n'
+     ' WHERE scene.split = $split  AND ((n0.name IN $names_n0) AND '
+     'any(attr IN n0.attributes WHERE attr IN $attrs_n0) AND (n2.name IN $names_n2)) ',
+     {'names_n0': ['woman'], 'attrs_n0': ['young'], 'names_n2': ['umbrella']}),
+    ('MATCH (scene:Scene)-[r:IN]-(n0:Object)-[r1:`on`|`sitting on`]->(n2:Object)\n'
+     ' WHERE scene.split = $split  AND ((n0.name IN $names_n0) AND '
+     'any(attr IN n2.attributes WHERE attr IN $attrs_n2) AND (n2.name IN $names_n2)) ',
+     {'names_n0': ['cat', 'dog'], 'names_n2': ['bench', 'chair', 'table'], 'attrs_n2': ['wooden', 'white']}),
+    ('MATCH (scene:Scene)-[r:IN]-(n0:Object)-[r1:`riding`]->(n2:Object)\n'
+     'MATCH (scene:Scene)-[r:IN]-(n0:Object)-[r3:`wearing`]->(n4:Object)\n'
+     ' WHERE scene.split = $split  AND ((n0.name IN $names_n0) AND (n2.name IN $names_n2) AND '
+     'any(attr IN n4.attributes WHERE attr IN $attrs_n4) AND (n4.name IN $names_n4)) ',
+     {'names_n0': ['man'], 'names_n2': ['horse'], 'names_n4': ['helmet'], 'attrs_n4': ['black', 'white']}),
+    ('MATCH (scene:Scene)-[r:IN]-(n0:Object)-[r1:`wearing`]->(n2:Object)\n'
+     ' WHERE scene.split = $split  AND (any(attr IN n0.attributes WHERE attr IN $attrs_n0) AND '
+     '(n2.name IN $names_n2)) ',
+     {'attrs_n0': ['standing'], 'names_n2': ['jacket', 'coat']}),
+]
+
+INDEXES = [
+    'CREATE INDEX object_name IF NOT EXISTS FOR (o:Object) ON (o.name)',
+    'CREATE INDEX scene_split IF NOT EXISTS FOR (s:Scene) ON (s.split)',
+    'CREATE INDEX scene_id IF NOT EXISTS FOR (s:Scene) ON (s.scene_id)',
+]
+
 
 def normalize_name(name):
     return name.replace(" ", "_")
 
 
+def attribute_label(attribute):
+    return f"Attr_{normalize_name(attribute)}"
+
+
 def index_gqa(data_dir):
     print("Loading GQA scenes")
     index_gqa_scenes(json.load(open(os.path.join(data_dir, "gqa", "train_sceneGraphs.json"))), 'train')
@@ -22,7 +61,7 @@ def index_gqa_scenes(scenes, split):
     source = 'gqa'
     for scene_id, scene in tqdm(scenes.items()):
         scene_key = f"scene_{scene_id}"
-        objects_csv.writerow([scene_key, 'Scene', scene_id, '', source, '', split])
+        objects_csv.writerow([scene_key, f'Scene;{QueryBuilder.split_label(split)}', scene_id, '', source, '', split])
         for obj_id, obj in scene['objects'].items():
             attributes = [a for a in obj['attributes'] if a]
             write_object(obj_id, obj['name'], scene_id, source, attributes, split)
@@ -40,7 +79,10 @@ def write_relation(obj_id, other_object_id, relation_name):
 
 
 def write_object(obj_id, obj_name, scene_id, source, attributes, split):
-    objects_csv.writerow([obj_id, 'Object', scene_id, obj_name, source, ';'.join(attributes), split])
+    labels = ['Object']
+    if with_attribute_labels:
+        labels += [attribute_label(attr) for attr in attributes]
+    objects_csv.writerow([obj_id, ';'.join(labels), scene_id, obj_name, source, ';'.join(attributes), split])
 
 
 def get_imsitu_actions(spc, data_dir):
@@ -69,8 +111,7 @@ def index_imsitu(data_dir):
     imsitu_dir = f"{data_dir}/imsitu"
 
     index_imsitu_scenes(space, json.load(open(f"{imsitu_dir}/train.json", "rt")), 'train', imsitu_dir)
-    index_imsitu_scenes(space, json.load(open(f"{imsitu_dir}/dev.json", "rt")), 'val', imsitu_dirב
-                        )
+    index_imsitu_scenes(space, json.load(open(f"{imsitu_dir}/dev.json", "rt")), 'val', imsitu_dir)
 
 
 def index_imsitu_scenes(space, scenes, split, data_dir):
@@ -104,7 +145,7 @@ def index_imsitu_scenes(space, scenes, split, data_dir):
         frame = valid_frames[0]
 
         first_noun_name = get_name_from_placeholder(frame[first_placeholder])
-        objects_csv.writerow([scene_id, 'Scene', scene_id, '', source, '', split])
+        objects_csv.writerow([scene_id, f'Scene;{QueryBuilder.split_label(split)}', scene_id, '', source, '', split])
         obj_id = f"{scene_id}_0"
         write_object(obj_id, first_noun_name, scene_id, source, [], split)
         scene_formatted['objects'][obj_id] = {
@@ -184,21 +225,115 @@ def download_input_files(download_path):
         wget.download(f"https://github.com/my89/imSitu/raw/master/{file}", f"{download_path}/imsitu")
 
 
+def to_labels_query(query_str, parameters, split):
+    """
+    Rewrites a benchmark query to match the split and attributes using labels rather than properties
+    """
+    query_str = query_str.replace("(scene:Scene)", f"(scene:{QueryBuilder.split_label(split)})")
+    query_str = query_str.replace("scene.split = $split  AND ", "")
+    for parameter, attributes in parameters.items():
+        if not parameter.startswith('attrs_'):
+            continue
+        symbol = parameter[len('attrs_'):]
+        labels_predicate = ' OR '.join([f"{symbol}:`{attribute_label(attr)}`" for attr in attributes])
+        query_str = query_str.replace(f"any(attr IN {symbol}.attributes WHERE attr IN ${parameter})",
+                                      f"({labels_predicate})")
+    return query_str
+
+
+def time_benchmark_queries(session, split, use_labels=False, repeats=3):
+    timings = []
+    for query_str, parameters in BENCHMARK_QUERIES:
+        if use_labels:
+            query_str = to_labels_query(query_str, parameters, split)
+        query_str += " RETURN scene.scene_id LIMIT 500"
+        best = None
+        for _ in range(repeats):
+            st = time.time()
+            n_rows = len(list(session.run(query_str, dict(parameters, split=split))))
+            elapsed = time.time() - st
+            best = elapsed if best is None else min(best, elapsed)
+        timings.append((best, n_rows))
+    return timings
+
+
+def write_graph_version(neo4j_import_path):
+    """
+    Writes a single `GraphVersion` node with a hash of the imported files, which namespaces the cached query results
+    of this graph (see `CacheNamespace`)
+    """
+    digest = hashlib.sha1()
+    for file_name in ['objects.csv', 'relations.csv']:
+        with open(neo4j_import_path + file_name, 'rb') as f:
+            for chunk in iter(lambda: f.read(2 ** 20), b''):
+                digest.update(chunk)
+
+    with open(neo4j_import_path + 'graph_version.csv', 'wt') as f:
+        version_csv = csv.writer(f)
+        version_csv.writerow([':ID', ':LABEL', 'hash'])
+        version_csv.writerow(['graph_version', 'GraphVersion', digest.hexdigest()])
+    print(f"Graph version: {digest.hexdigest()}")
+
+
+def create_indexes(neo4j_uri, split):
+    from neo4j import GraphDatabase
+
+    with GraphDatabase.driver(neo4j_uri).session() as session:
+        print("Timing benchmark queries before creating indexes")
+        before = time_benchmark_queries(session, split)
+
+        for index_query in INDEXES:
+            print(index_query)
+            session.run(index_query).consume()
+        session.run("CALL db.awaitIndexes(3600)").consume()
+
+        print("Timing benchmark queries after creating indexes")
+        after = time_benchmark_queries(session, split)
+        after_labels = time_benchmark_queries(session, split, use_labels=True)
+
+    # labels results are only comparable if the graph was imported with `--attribute-labels`
+    print(f"{'query':>5} {'rows':>6} {'before':>9} {'indexes':>9} {'labels':>9} {'rows (labels)':>14}")
+    for i, ((t_before, n_rows), (t_after, _), (t_labels, n_rows_labels)) in enumerate(zip(before, after,
+                                                                                          after_labels)):
+        print(f"{i:>5} {n_rows:>6} {t_before:>8.3f}s {t_after:>8.3f}s {t_labels:>8.3f}s {n_rows_labels:>14}")
+    total_before, total_after, total_labels = [sum(t for t, _ in timings) for timings in (before, after, after_labels)]
+    print(f"{'total':>5} {'':>6} {total_before:>8.3f}s {total_after:>8.3f}s {total_labels:>8.3f}s")
+
+
 if __name__ == "__main__":
     args = argparse.ArgumentParser()
     args.add_argument('--data-dir', default='data/')
     args.add_argument('--neo4j-import-path', default='../../../neo4j-community-4.2.1/import/')
+    args.add_argument('--attribute-labels', action='store_true',
+                      help='add a label for each attribute of an object (e.g. `Attr_white`)')
+    args.add_argument('--create-indexes', action='store_true',
+                      help='create schema indexes in a running (already imported) neo4j and report query timings '
+                           'before and after')
+    args.add_argument('--neo4j-uri', default='neo4j://localhost:7687')
+    args.add_argument('--benchmark-split', default='val')
     args = args.parse_args()
 
+    if args.create_indexes:
+        create_indexes(args.neo4j_uri, args.benchmark_split)
+        exit()
+
+    with_attribute_labels = args.attribute_labels
+
     download_input_files(args.data_dir)
 
-    objects_csv = csv.writer(open(args.neo4j_import_path + 'objects.csv', 'wt'))
+    objects_file = open(args.neo4j_import_path + 'objects.csv', 'wt')
+    objects_csv = csv.writer(objects_file)
     objects_csv.writerow([':ID', ':LABEL', 'scene_id', 'name', 'source', 'attributes:string[]', 'split'])
 
-    relations_csv = csv.writer(open(args.neo4j_import_path + 'relations.csv', 'wt'))
+    relations_file = open(args.neo4j_import_path + 'relations.csv', 'wt')
+    relations_csv = csv.writer(relations_file)
     relations_csv.writerow([':START_ID', ':END_ID', ':TYPE'])
 
     index_gqa(args.data_dir)
     index_imsitu(args.data_dir)
 
+    objects_file.close()
+    relations_file.close()
+    write_graph_version(args.neo4j_import_path)
+
     print("Done")
@@ -0,0 +1,143 @@
+"""
+Migrates a redis cache written by older versions of the generator, where keys are the full cypher query and values
+are JSON, to the `ResultCache` format (canonical sub-graph keys and compact payloads). Entries are written to the cache
+namespace of the current graph and resources (see `CacheNamespace`).
+
+Should be executed from the `dataset_gen` directory:
+    python -m scripts.migrate_cache --delete-legacy
+"""
+import argparse
+import json
+import re
+from collections import Counter
+
+from generator.queries.cache_namespace import CacheNamespace
+from generator.queries.data_classes import QueryNode, QueryRelationship
+from generator.queries.result_cache import ResultCache
+from generator.queries.sub_graph import SubGraph
+from generator.redis import redis
+from generator.resources import Resources
+
+MATCH_ELEMENT_RE = re.compile(r'\((\w+):Object\)|\[(\w+)(?::([^\]]*))?\]')
+SPLIT_RE = re.compile(r"scene\.split = '([^']*)'")
+NAME_RE = re.compile(r'(\w+)\.name = "([^"]*)"')
+ATTRIBUTE_RE = re.compile(r'"([^"]*)" in (\w+)\.attributes')
+MULTI_RE = re.compile(r'\bmulti_(\d+)_')
+
+
+def legacy_query_to_sub_graph(query_str):
+    """
+    Reconstructs the pruned sub-graph from a cypher query that was built by the legacy `QueryBuilder`, where all names
+    and attributes are inlined in the query text
+    """
+    split = SPLIT_RE.search(query_str).group(1)
+
+    names, attributes = {}, {}
+    for symbol, name in NAME_RE.findall(query_str):
+        names.setdefault(symbol, set()).add(name)
+    for attribute, symbol in ATTRIBUTE_RE.findall(query_str):
+        attributes.setdefault(symbol, set()).add(attribute)
+
+    nodes = {}
+    relations = {}
+    root = None
+    match_lines = [line for line in query_str.split('\n') if line.startswith('MATCH') and 'multi_' not in line]
+    for line in match_lines:
+        path = []
+        for node_symbol, relation_symbol, relation_types in MATCH_ELEMENT_RE.findall(line):
+            if node_symbol:
+                if node_symbol not in nodes:
+                    nodes[node_symbol] = QueryNode(char_symbol=node_symbol, name=names.get(node_symbol),
+                                                   attributes=attributes.get(node_symbol, set()), relations=[])
+                path.append(nodes[node_symbol])
+            elif relation_types != 'IN':
+                relation_names = set(t.strip('`') for t in relation_types.split('|')) if relation_types else None
+                path.append((relation_symbol, relation_names))
+
+        root = root or path[0]
+        for i in range(1, len(path) - 1, 2):
+            source, (relation_symbol, relation_names), target = path[i - 1], path[i], path[i + 1]
+            if relation_symbol in relations:
+                continue
+            relation = QueryRelationship(char_symbol=relation_symbol, name=relation_names, target=target)
+            relations[relation_symbol] = relation
+
+            # imsitu prepositions are stored as a chain in the DB, following the target of the main relation
+            is_preposition = relation_names and all(":_" in n for n in relation_names) and source.backward_relation
+            if is_preposition:
+                main_relation = source.backward_relation
+                relation.source = main_relation
+                relation.backward_relation = main_relation
+                main_relation.prepositions = (main_relation.prepositions or []) + [relation]
+            else:
+                relation.source = source
+                source.relations.append(relation)
+            target.backward_relation = relation
+
+    multi_instances = [int(i) for i in MULTI_RE.findall(query_str)]
+    multi_count = max(multi_instances) + 1 if multi_instances else None
+
+    return split, SubGraph(root, multi_count=multi_count)
+
+
+def migrate(delete_legacy=False, dry_run=False, batch_size=1000, graph_version=None):
+    stats = Counter()
+    caches = {}
+
+    def _cache(split):
+        if split not in caches:
+            namespace = CacheNamespace.current(split, graph_version)
+            if not dry_run:
+                namespace.register()
+            print(f"Migrating entries of split {split} to cache namespace {namespace}")
+            caches[split] = ResultCache(split, namespace=namespace.name)
+        return caches[split]
+
+    pipe = redis.pipeline()
+    for key in redis.scan_iter(match="MATCH*", count=batch_size):
+        query_str = key.decode('utf-8')
+        legacy_value = redis.get(key)
+        try:
+            split, sub_graph = legacy_query_to_sub_graph(query_str)
+        except (AttributeError, IndexError, ValueError):
+            stats['failed'] += 1
+            continue
+
+        legacy_payload = json.loads(legacy_value)
+        payload = ResultCache.encode(legacy_payload['scenes'], legacy_payload['scenes_info'])
+
+        stats['migrated'] += 1
+        stats['legacy_bytes'] += len(key) + len(legacy_value)
+        new_key = _cache(split).key(sub_graph)
+        stats['new_bytes'] += len(new_key) + len(payload)
+
+        if dry_run:
+            continue
+        pipe.set(new_key, payload)
+        if delete_legacy:
+            pipe.delete(key)
+        if stats['migrated'] % batch_size == 0:
+            pipe.execute()
+            print(f"Migrated {stats['migrated']} entries")
+    if not dry_run:
+        pipe.execute()
+
+    return stats
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser()
+    args.add_argument('--delete-legacy', action='store_true', help='delete legacy entries after migrating them')
+    args.add_argument('--dry-run', action='store_true', help='only report the expected size reduction')
+    args.add_argument('--batch-size', default=1000, type=int)
+    args.add_argument('--graph-version', help='version of the graph in the cache namespace, instead of reading it from '
+                                              'neo4j')
+    args = args.parse_args()
+
+    Resources.load()
+    migration_stats = migrate(args.delete_legacy, args.dry_run, args.batch_size, args.graph_version)
+
+    print(f"Migrated entries: {migration_stats['migrated']} (failed to parse: {migration_stats['failed']})")
+    if migration_stats['migrated']:
+        print(f"Size (keys + values): {migration_stats['legacy_bytes'] / 2 ** 20:.1f}MB -> "
+              f"{migration_stats['new_bytes'] / 2 ** 20:.1f}MB")
@@ -0,0 +1,203 @@
+"""
+Replays a log of graph queries (written by `generate.py --query_log`) against a backend, to measure changes of the
+query layer in isolation. Reports the throughput and the latency percentiles of each kind of query.
+
+Backends:
+    neo4j    runs the logged query text and parameters
+    matcher  matches the logged sub-graphs against the scenes of the split in Python (imsitu prepositions are matched as
+             relations of their subject, and parallel elements are not logged, so row counts may differ from neo4j)
+    cache    reads the logged cache keys from redis
+    local    a stand-in that needs neither neo4j nor redis: every query sleeps for its logged latency (scaled by
+             `--latency_scale`) and returns its logged number of rows, e.g. to run the replay in CI
+
+Should be executed from the `dataset_gen` directory:
+    python -m scripts.replay_queries --query_log output/queries.jsonl --backend neo4j --concurrency 8
+"""
+import argparse
+import time
+from collections import Counter, defaultdict
+from concurrent.futures.thread import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from generator.queries.query_log import QueryLog
+from generator.queries.query_stats import QueryStats
+from generator.queries.result_cache import ResultCache
+from generator.queries.sub_graph import SubGraph
+from generator.queries.triplet_index import PostingList
+from generator.redis import redis
+from generator.resources import Resources
+from generator.scene_reader import SceneReader
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--query_log', required=True)
+parser.add_argument('--backend', default='neo4j', choices=['neo4j', 'matcher', 'cache', 'local'])
+parser.add_argument('--concurrency', default=4, type=int, help='number of queries executed concurrently')
+parser.add_argument('--kinds', nargs='+', help='replay only these kinds of queries (e.g. `full ids`)')
+parser.add_argument('--limit', type=int, help='replay only the first queries of the log')
+parser.add_argument('--neo4j_uri', default='neo4j://localhost:7687')
+parser.add_argument('--data_dir', default='data', help='scenes directory of the `matcher` backend')
+parser.add_argument('--latency_scale', default=1.0, type=float, help='latency multiplier of the `local` backend')
+
+args = parser.parse_args()
+
+
+class Neo4jBackend:
+    def __init__(self, records: List[Dict]):
+        from neo4j import GraphDatabase
+        self._graph_db_driver = GraphDatabase.driver(args.neo4j_uri, max_connection_pool_size=args.concurrency)
+
+    def run(self, record: Dict) -> Optional[int]:
+        with self._graph_db_driver.session() as session:
+            return len(list(session.run(record['query'], record['parameters'])))
+
+
+class MatcherBackend:
+    MAX_RESULT_SCENES = 500
+
+    def __init__(self, records: List[Dict]):
+        split = next(record['parameters']['split'] for record in records if record['parameters'])
+        self._scene_reader = SceneReader(split, args.data_dir)
+
+    def run(self, record: Dict) -> Optional[int]:
+        if record['kind'] in ('batch', 'batch_ids'):
+            return sum(len(self.match(QueryLog.sub_graph_from_json(g))) for g in record['sub_graph'])
+        scene_ids = record['parameters']['scene_ids'] if record['kind'] == 'info' else None
+        return len(self.match(QueryLog.sub_graph_from_json(record['sub_graph']), scene_ids))
+
+    def match(self, sub_graph: SubGraph, scene_ids: List[str] = None) -> List[str]:
+        min_instances = sub_graph.multi_count if sub_graph.multi_count and sub_graph.multi_count > 1 else 1
+        result_scenes = []
+        for scene_id in scene_ids or self._scene_reader.all_scenes_keys:
+            if len(self._match_node(sub_graph.root, self._scene_reader.get_scene_index(scene_id))) >= min_instances:
+                result_scenes.append(scene_id)
+                if len(result_scenes) >= MatcherBackend.MAX_RESULT_SCENES:
+                    break
+        return result_scenes
+
+    def _match_node(self, node, index):
+        names = {node.name} if type(node.name) is str else node.name
+        if names:
+            objects = set().union(*[index.objects_by_name.get(name, ()) for name in names])
+        else:
+            objects = index.object_keys
+        if node.attributes:
+            objects = objects & set().union(*[index.objects_by_attribute.get(attr, ()) for attr in node.attributes])
+
+        for relation in node.relations or []:
+            for relation_to_match in [relation] + (relation.prepositions or []):
+                if not objects:
+                    return objects
+                targets = self._match_node(relation_to_match.target, index)
+                relation_names = {relation_to_match.name} if type(relation_to_match.name) is str \
+                    else relation_to_match.name
+                objects = {obj for obj in objects
+                           if any((not relation_names or name in relation_names) and other in targets
+                                  for name, other in index.relations[obj])}
+        return objects
+
+
+class CacheBackend:
+    def __init__(self, records: List[Dict]):
+        # keys are logged with their namespace, so the split is not needed
+        self._cache = ResultCache(split=None)
+
+    def run(self, record: Dict) -> Optional[int]:
+        kind, key = record['kind'], record['key']
+        if kind in ('full', 'joined'):
+            cached = self._cache.get(key)
+            return len(cached[0]) if cached else None
+        if kind == 'ids':
+            cached = self._cache.get_scene_ids(key)
+            return len(cached) if cached is not None else None
+        if kind == 'info':
+            return len(self._cache.get_scenes_info(key, record['parameters']['scene_ids']))
+        if kind in ('batch', 'batch_ids'):
+            n_rows = 0
+            for batch_key in key:
+                cached = self._cache.get(batch_key) if kind == 'batch' else self._cache.get_scene_ids(batch_key)
+                if cached is None:
+                    return None
+                n_rows += len(cached[0]) if kind == 'batch' else len(cached)
+            return n_rows
+        if kind == 'triplet':
+            payload = redis.get(key)
+            if not payload:
+                return None
+            return sum(len(rows) for rows in PostingList.decode(payload).rows.values())
+        assert False, f"Unknown query kind: {kind}"
+
+
+class LocalBackend:
+    def __init__(self, records: List[Dict]):
+        pass
+
+    def run(self, record: Dict) -> Optional[int]:
+        time.sleep(record['latency'] * args.latency_scale)
+        return record['rows']
+
+
+BACKENDS = {'neo4j': Neo4jBackend, 'matcher': MatcherBackend, 'cache': CacheBackend, 'local': LocalBackend}
+
+
+def percentile(sorted_latencies: List[float], q: float) -> float:
+    return sorted_latencies[min(int(q * len(sorted_latencies)), len(sorted_latencies) - 1)]
+
+
+def replay(backend, records: List[Dict]):
+    def _run(record):
+        st = time.time()
+        n_rows = backend.run(record)
+        return time.time() - st, n_rows
+
+    st = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(_run, records))
+    return time.time() - st, results
+
+
+def print_report(records: List[Dict], elapsed: float, results: List):
+    latencies = defaultdict(list)
+    query_stats = QueryStats()
+    misses = Counter()
+    different_rows = Counter()
+    for record, (latency, n_rows) in zip(records, results):
+        for kind in (record['kind'], 'all'):
+            latencies[kind].append(latency)
+        query_stats.record(record['shape'], latency, n_rows or 0)
+        if n_rows is None:
+            misses[record['kind']] += 1
+        elif n_rows != record['rows']:
+            different_rows[record['kind']] += 1
+
+    print(f"Replayed {len(records)} queries in {elapsed:.1f}s with {args.backend} "
+          f"(concurrency {args.concurrency}): {len(records) / elapsed:.1f} queries/s")
+    print(f"{'kind':<10} {'count':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'logged p50':>11} {'misses':>7} "
+          f"{'rows differ':>12}")
+    logged_latencies = defaultdict(list)
+    for record in records:
+        for kind in (record['kind'], 'all'):
+            logged_latencies[kind].append(record['latency'])
+    for kind in sorted(latencies, key=lambda k: (k == 'all', k)):
+        kind_latencies = sorted(latencies[kind])
+        logged_p50 = percentile(sorted(logged_latencies[kind]), 0.5)
+        print(f"{kind:<10} {len(kind_latencies):>7} {percentile(kind_latencies, 0.5):>7.4f}s "
+              f"{percentile(kind_latencies, 0.95):>7.4f}s {percentile(kind_latencies, 0.99):>7.4f}s "
+              f"{logged_p50:>10.4f}s "
+              f"{sum(misses.values()) if kind == 'all' else misses[kind]:>7} "
+              f"{sum(different_rows.values()) if kind == 'all' else different_rows[kind]:>12}")
+    print()
+    query_stats.print_histograms()
+
+
+if __name__ == "__main__":
+    records = [record for record in QueryLog.read(args.query_log) if not args.kinds or record['kind'] in args.kinds]
+    if args.backend == 'neo4j':
+        # queries answered by the triplet index were never sent to neo4j
+        records = [record for record in records if record['query']]
+    records = records[:args.limit]
+    print(f"Loaded {len(records)} queries from {args.query_log}")
+
+    if args.backend == 'matcher':
+        Resources.load()
+    replay_elapsed, replay_results = replay(BACKENDS[args.backend](records), records)
+    print_report(records, replay_elapsed, replay_results)
@@ -0,0 +1,144 @@
+"""
+Fills the graph query cache for a whole split before generation, so that `generate.py` runs (almost) without waiting
+for neo4j. All scenes are traversed to collect the distinct pruned queries of their sub-graphs and distractors, and
+the queries that are not cached yet are executed in concurrent batches.
+
+The collected queries are saved to a state file, so an interrupted run can be resumed: scenes that were already
+traversed are skipped, and so are queries that are already cached.
+
+Should be executed from the `dataset_gen` directory:
+    python -m scripts.warm_cache --split train
+"""
+import argparse
+import concurrent
+import os
+import pickle
+import time
+from concurrent.futures.process import ProcessPoolExecutor
+
+from tqdm import tqdm
+
+from generator.queries.graph_executor import GraphExecutor
+from generator.queries.query_builder import QueryBuilder
+from generator.queries.result_cache import ResultCache
+from generator.question_generator import QuestionGenerator
+from generator.resources import Resources
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--split', default='val')
+parser.add_argument('--multiproc', default=16, type=int, help='number of processes collecting queries')
+parser.add_argument('--graph_concurrency', default=16, type=int,
+                    help='maximum number of neo4j queries executed concurrently')
+parser.add_argument('--graph_batch_size', default=1, type=int,
+                    help='number of queries combined into a single statement (with UNION ALL)')
+parser.add_argument('--batch_size', default=1000, type=int, help='number of queries executed between progress reports')
+parser.add_argument('--state_file', help='defaults to `output/warm_cache_<split>.pkl`')
+parser.add_argument('--checkpoint_every', default=1000, type=int,
+                    help='number of traversed scenes between saves of the state file')
+parser.add_argument('--collect_only', action='store_true', help='only collect queries and report how many are missing')
+parser.add_argument('--graph_version', help='version of the graph in the cache namespace, instead of reading it from '
+                                           'neo4j')
+parser.add_argument('--split_labels', action='store_true')
+parser.add_argument('--attribute_labels', action='store_true')
+
+args = parser.parse_args()
+
+
+def collect_worker(scene_id):
+    return scene_id, question_generator.get_scene_queries(scene_id)
+
+
+def load_state(path, namespace):
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('namespace') == namespace:
+            return state
+        # keys of collected queries belong to the cache namespace of the previous run
+        print(f"Ignoring state of cache namespace {state.get('namespace')}: {path}")
+    return {'namespace': namespace, 'scenes': set(), 'queries': {}}
+
+
+def save_state(state, path):
+    # written to a temporary file first, so that interrupting the save does not corrupt the state
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def collect_queries(state, scene_ids):
+    remaining_scene_ids = [s for s in scene_ids if s not in state['scenes']]
+    print(f"Collecting queries of {len(remaining_scene_ids)} scenes "
+          f"({len(scene_ids) - len(remaining_scene_ids)} were collected in previous runs)")
+
+    def _add(scene_id, queries):
+        for cache_key, query in queries.items():
+            state['queries'].setdefault(cache_key, query)
+        state['scenes'].add(scene_id)
+        if len(state['scenes']) % args.checkpoint_every == 0:
+            save_state(state, state_path)
+
+    if args.multiproc > 1:
+        with ProcessPoolExecutor(max_workers=args.multiproc) as executor:
+            futures = [executor.submit(collect_worker, scene_id) for scene_id in remaining_scene_ids]
+            loop = tqdm(concurrent.futures.as_completed(futures), total=len(futures))
+            for future in loop:
+                _add(*future.result())
+                loop.desc = f'# queries: {len(state["queries"])}'
+    else:
+        for scene_id in tqdm(remaining_scene_ids):
+            _add(*collect_worker(scene_id))
+
+    save_state(state, state_path)
+
+
+def find_uncached_keys(keys):
+    cache = ResultCache(args.split, namespace=state['namespace'])
+    uncached_keys = []
+    for i in range(0, len(keys), args.batch_size):
+        batch = keys[i:i + args.batch_size]
+        uncached_keys += [key for key, exists in zip(batch, cache.exists_many(batch)) if not exists]
+    return uncached_keys
+
+
+def execute_queries(queries, uncached_keys):
+    graph_executor = GraphExecutor(split=args.split, scene_reader=question_generator.scene_reader,
+                                   max_concurrent_queries=args.graph_concurrency,
+                                   query_batch_size=args.graph_batch_size, graph_version=args.graph_version)
+
+    st = time.time()
+    executed = 0
+    for i in range(0, len(uncached_keys), args.batch_size):
+        batch = uncached_keys[i:i + args.batch_size]
+        graph_executor.fill_cache({key: queries[key] for key in batch})
+        executed += len(batch)
+
+        remaining = len(uncached_keys) - executed
+        rate = executed / (time.time() - st)
+        print(f"Executed {executed}/{len(uncached_keys)} queries ({rate:.1f} queries/s), "
+              f"remaining: {remaining}, estimated time left: {remaining / rate / 60:.1f} minutes")
+
+    graph_executor.query_stats.print_histograms()
+
+
+if __name__ == "__main__":
+    Resources.load(questions_yaml='questions.yaml', load_tiny_distract_yaml=False)
+    QueryBuilder.use_split_labels = args.split_labels
+    QueryBuilder.use_attribute_labels = args.attribute_labels
+    question_generator = QuestionGenerator(split=args.split, random_seed=2, max_concurrent_graph_queries=1,
+                                           graph_version=args.graph_version)
+    scene_ids = list(question_generator.scene_reader.get_all_scene_ids())
+
+    os.makedirs("output", exist_ok=True)
+    state_path = args.state_file or f'output/warm_cache_{args.split}.pkl'
+    state = load_state(state_path, question_generator.cache_namespace.name)
+    print(f"Cache namespace: {state['namespace']}")
+
+    collect_queries(state, scene_ids)
+
+    uncached_keys = find_uncached_keys(list(state['queries']))
+    print(f"Collected {len(state['queries'])} distinct queries, {len(uncached_keys)} of them are not cached")
+
+    if not args.collect_only and uncached_keys:
+        execute_queries(state['queries'], uncached_keys)
+        GraphExecutor.finished()
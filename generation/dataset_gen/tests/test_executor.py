@@ -0,0 +1,71 @@
+import unittest
+from copy import deepcopy
+
+from executor.executor import Executor
+from executor.scene_index import SceneIndex
+
+
+def make_object(object_key, name, attributes=(), relations=()):
+    return {'object_key': object_key, 'scene_id': '1', 'name': name, 'attributes': list(attributes),
+            'attributes_by_group': {}, 'relations': [{'name': r, 'object': o} for r, o in relations]}
+
+
+SCENE = {
+    '10': make_object('10', 'dog', ['brown'], [('on', '12')]),
+    '11': make_object('11', 'dog', ['white']),
+    '12': make_object('12', 'grass', ['green']),
+}
+
+QUANTIFIER_PROGRAM = [
+    {'operation': 'find', 'arguments': ['dog']},
+    {'operation': 'some', 'dependencies': [0], 'arguments': [[
+        {'operation': 'scene'},
+        {'operation': 'filter', 'dependencies': [0], 'arguments': [{'white', 'black'}]}
+    ]]},
+]
+
+
+class ExecutorTest(unittest.TestCase):
+    def setUp(self):
+        Executor._compiled_programs.clear()
+        Executor._condition_outputs.clear()
+        Executor.starting_new_scene()
+
+    def test_equal_programs_are_compiled_once(self):
+        executor = Executor()
+        compiled = [executor.compile(deepcopy(QUANTIFIER_PROGRAM)) for _ in range(3)]
+        self.assertTrue(all(c is compiled[0] for c in compiled))
+        self.assertEqual(len(Executor._compiled_programs), 2)
+
+    def test_condition_outputs_are_shared_by_equal_programs(self):
+        executor = Executor()
+        scene_index = SceneIndex(SCENE)
+        calls = []
+        run_nested = executor._run_nested
+
+        def _run_nested(program):
+            calls.append(program)
+            return run_nested(program)
+        executor._run_nested = _run_nested
+
+        # filled separately, as programs are for each question
+        self.assertTrue(executor.run(executor.compile(deepcopy(QUANTIFIER_PROGRAM)), SCENE, scene_index))
+        Executor._compiled_programs.clear()
+        self.assertTrue(executor.run(executor.compile(deepcopy(QUANTIFIER_PROGRAM)), SCENE, scene_index))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(Executor._condition_outputs), 1)
+
+    def test_compiled_programs_answer_as_interpreted(self):
+        executor = Executor()
+        scene_index = SceneIndex(SCENE)
+        program = [{'operation': 'find', 'arguments': ['dog']},
+                   {'operation': 'find', 'arguments': ['grass']},
+                   {'operation': 'with_relation', 'dependencies': [0, 1], 'arguments': ['on']},
+                   {'operation': 'unique', 'dependencies': [2]}]
+        expected = executor.run(program, SCENE)
+        self.assertEqual(expected['object_key'], '10')
+        self.assertIs(executor.run(executor.compile(program), SCENE, scene_index), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
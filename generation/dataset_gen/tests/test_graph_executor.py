@@ -0,0 +1,48 @@
+import unittest
+
+from neo4j.exceptions import ServiceUnavailable
+
+from generator.queries.data_classes import QueryNode
+from generator.queries.graph_executor import GraphExecutor
+from generator.queries.sub_graph import SubGraph
+
+
+class UnavailableSession:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def run(self, query, parameters=None):
+        raise ServiceUnavailable("connection lost")
+
+
+class UnavailableDriver:
+    def session(self):
+        return UnavailableSession()
+
+    def close(self):
+        pass
+
+
+class GraphExecutorTest(unittest.TestCase):
+    def test_failed_batch_queries_run_separately(self):
+        graph_executor = GraphExecutor(split='val', scene_reader=None, enable_cache=False)
+        graph_executor._graph_db_driver = UnavailableDriver()
+        single_queries = []
+
+        def _run_query(sub_graph, cache_key):
+            single_queries.append(cache_key)
+            return [cache_key], {}
+        graph_executor._run_query = _run_query
+
+        queries = {key: SubGraph(QueryNode(name=name, attributes=set(), relations=[]))
+                   for key, name in [('q1', 'dog'), ('q2', 'cat')]}
+        results = graph_executor._run_batch_query(queries)
+        self.assertEqual(single_queries, ['q1', 'q2'])
+        self.assertEqual(results, {'q1': (['q1'], {}), 'q2': (['q2'], {})})
+
+
+if __name__ == '__main__':
+    unittest.main()